@@ -0,0 +1,96 @@
+from flask import Flask
+from flask_cors import CORS
+from model.database import db
+from model import migrations, storage
+from routes import compression, request_metrics
+from routes.change_routes import change_api
+from routes.game_routes import game_api
+from routes.metrics_routes import metrics_api
+from routes.player_routes import player_api
+from routes.session_routes import session_api
+from routes.session_players_routes import session_players_api
+from routes.status_routes import status_api
+import os
+import time
+
+
+def create_app(config=None):
+    """Creates and configures the Flask app
+
+    Creating the app has no side effects on the database: the schema is only created or upgraded
+    if BGT_AUTO_UPGRADE is set (in the config or the environment).  Otherwise run "manage.py upgrade"
+    once before starting the workers.  The time taken is stored in the BGT_STARTUP_SECONDS config
+
+    :param config: A dict of config values that override the defaults and the environment
+    :return The Flask app
+    :rtype Flask
+    """
+    started = time.perf_counter()
+    config = config or {}
+
+    # create the flask app
+    app = Flask(__name__)
+
+    # SQLAlchemy config, read from the environment (see model/storage.py)
+    storage.configure(app, config.get('SQLALCHEMY_DATABASE_URI'))
+
+    # Game and Player lookup caches, see model/cache.py
+    app.config['BGT_CACHE_SIZE'] = int(os.environ.get('BGT_CACHE_SIZE', 1024))
+    app.config['BGT_CACHE_TTL'] = float(os.environ.get('BGT_CACHE_TTL', 300))
+    app.config['BGT_CACHE_CHECK_INTERVAL'] = float(os.environ.get('BGT_CACHE_CHECK_INTERVAL', 100))
+    app.config['BGT_AUTO_UPGRADE'] = os.environ.get('BGT_AUTO_UPGRADE', '').lower() in ('1', 'true', 'yes')
+    app.config['BGT_CORS_ORIGINS'] = os.environ.get('BGT_CORS_ORIGINS', 'http://localhost:8080')
+    app.config['BGT_METRICS_DIR'] = os.environ.get('BGT_METRICS_DIR')
+    # Idempotency-Key support of the create routes, see routes/idempotency.py
+    app.config['BGT_IDEMPOTENCY_TTL'] = float(os.environ.get('BGT_IDEMPOTENCY_TTL', 86400))
+    app.config['BGT_IDEMPOTENCY_MAX_KEYS'] = int(os.environ.get('BGT_IDEMPOTENCY_MAX_KEYS', 100000))
+    app.config['BGT_IDEMPOTENCY_WAIT'] = float(os.environ.get('BGT_IDEMPOTENCY_WAIT', 10))
+    # write-behind queue of live score updates, see model/live_scores.py
+    app.config['BGT_LIVE_SCORING'] = os.environ.get('BGT_LIVE_SCORING', '').lower() in ('1', 'true', 'yes')
+    app.config['BGT_LIVE_SCORING_INTERVAL'] = float(os.environ.get('BGT_LIVE_SCORING_INTERVAL', 250))
+    app.config['BGT_LIVE_SCORING_BATCH'] = int(os.environ.get('BGT_LIVE_SCORING_BATCH', 500))
+    # the number of changes kept for GET /changes/, see model/ChangeLogDB.py
+    app.config['BGT_CHANGE_LOG_MAX_ROWS'] = int(os.environ.get('BGT_CHANGE_LOG_MAX_ROWS', 100000))
+    # how often each worker reads the change log for the event streams, see model/session_events.py
+    app.config['BGT_SESSION_EVENTS_INTERVAL'] = float(os.environ.get('BGT_SESSION_EVENTS_INTERVAL', 500))
+    # response compression, see routes/compression.py
+    encodings = os.environ.get('BGT_COMPRESSION_ENCODINGS')
+    app.config['BGT_COMPRESSION_ENCODINGS'] = compression.available_encodings() if encodings is None else \
+        [encoding.strip() for encoding in encodings.split(',') if encoding.strip()]
+    app.config['BGT_COMPRESSION_MIN_SIZE'] = int(os.environ.get('BGT_COMPRESSION_MIN_SIZE', 1024))
+    app.config['BGT_COMPRESSION_CACHE_SIZE'] = int(os.environ.get('BGT_COMPRESSION_CACHE_SIZE', 64 * 1024 * 1024))
+    app.config.update(config)
+
+    db.init_app(app)
+    storage.init_app(app)
+
+    # request latency and SQL metrics, served at /metrics (see routes/request_metrics.py)
+    request_metrics.init_app(app)
+
+    # compress large responses with the best encoding the client accepts
+    compression.init_app(app)
+
+    # add in CORS support
+    origins = app.config['BGT_CORS_ORIGINS']
+    CORS(app, resources={r"/games/*": {"origins": origins},
+                         r"/players/*": {"origins": origins},
+                         r"/sessions/*": {"origins": origins},
+                         r"/session-players/*": {"origins": origins},
+                         r"/changes/*": {"origins": origins}})
+
+    app.register_blueprint(game_api, url_prefix="/games/")
+    app.register_blueprint(player_api, url_prefix="/players/")
+    app.register_blueprint(session_api, url_prefix="/sessions/")
+    app.register_blueprint(session_players_api, url_prefix="/session-players/")
+    app.register_blueprint(change_api, url_prefix="/changes/")
+    app.register_blueprint(status_api, url_prefix="/status/")
+    app.register_blueprint(metrics_api, url_prefix="/metrics")
+
+    if app.config['BGT_AUTO_UPGRADE']:
+        with app.app_context():
+            migrations.upgrade(db.engine)
+
+    app.config['BGT_STARTUP_SECONDS'] = time.perf_counter() - started
+    app.logger.info('App created in %.1f ms', app.config['BGT_STARTUP_SECONDS'] * 1000)
+
+    return app
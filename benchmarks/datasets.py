@@ -0,0 +1,39 @@
+from application import create_app
+from model.database import db
+from tools import generate_history
+import os
+
+# The dataset sizes that can be benchmarked, as a number of SessionPlayers
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+
+def build(directory, size, seed):
+    """Creates (or reuses) a seeded SQLite database and an app that serves it
+
+    The data is written by tools/generate_history.py.  The database file is named after the size and seed,
+    so a directory kept between runs only pays for generating each dataset once
+
+    :param directory: The directory holding the database files
+    :param size: The name of the size of the dataset, one of SIZES
+    :param seed: The seed of the dataset
+    :return The app
+    :rtype Flask
+    """
+    path = os.path.join(directory, 'bgt-%s-seed%d.db' % (size, seed))
+    exists = os.path.exists(path)
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+                      'BGT_AUTO_UPGRADE': True,
+                      'BGT_CORS_ORIGINS': '*'})
+
+    if not exists:
+        with app.app_context():
+            try:
+                generate_history.generate(session_players=SIZES[size], seed=seed)
+            except BaseException:
+                db.session.rollback()
+                db.engine.dispose()
+                os.remove(path)
+                raise
+
+    return app
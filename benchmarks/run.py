@@ -0,0 +1,408 @@
+"""Benchmarks every blueprint against seeded SQLite databases of several sizes
+
+Run from the root of the repository, for example:
+
+    python -m benchmarks.run --sizes 1k,100k --output results.json
+    python -m benchmarks.run --sizes 1k,100k --output new.json --compare results.json
+    python -m benchmarks.run --results new.json --compare results.json
+
+Each scenario is measured twice: serially through the Flask test client, which isolates the cost of the app
+itself, and over HTTP by several threads against a local threaded server, which adds the cost of serving
+concurrent requests.  A run records the p50 and p99 latency, the throughput and the SQL statements per request
+of every scenario, along with the peak memory allocated by its requests through the test client, and comparing
+against an earlier run flags any scenario that got slower, served fewer requests per second or started issuing
+more queries
+"""
+from benchmarks import datasets
+from model.database import db
+from model.models import Game, Player, Session, SessionPlayers
+from sqlalchemy import event, func, select
+from werkzeug.serving import make_server
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from threading import Lock, Thread
+import http.client
+import json
+import logging
+import platform
+import random
+import shutil
+import sqlalchemy
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+# The number of ids of each kind sampled from the dataset to build the request paths from
+SAMPLE_SIZE = 200
+
+# A latency change smaller than this is treated as noise when comparing runs, in milliseconds
+NOISE_FLOOR_MS = 0.5
+
+# The number of requests of each scenario sent again while tracing memory allocations, see _peak_memory_mb
+MEMORY_SAMPLE_REQUESTS = 20
+
+
+def _scenarios():
+    """Returns the scenarios to benchmark, as (blueprint, name, method, path, body, heavy) tuples, where path
+    and body are functions of the sampled ids and a random number generator, and heavy scenarios (which read
+    a whole table) are run fewer times
+    """
+    def session_body(ids, rng):
+        return {'date': '2030-01-01', 'game_id': rng.choice(ids['games']),
+                'players': [{'player_id': player_id, 'score': rng.randrange(200), 'winner': number == 0}
+                            for number, player_id in enumerate(rng.sample(ids['players'], 4))]}
+
+    return [
+        ('game_api', 'list games', 'GET', lambda ids, rng: '/games/', None, False),
+        ('game_api', 'get game', 'GET', lambda ids, rng: '/games/%s' % rng.choice(ids['games']), None, False),
+        ('game_api', 'game leaderboard', 'GET',
+         lambda ids, rng: '/games/%s/leaderboard' % rng.choice(ids['games']), None, False),
+        ('player_api', 'list players', 'GET', lambda ids, rng: '/players/', None, False),
+        ('player_api', 'get player', 'GET', lambda ids, rng: '/players/%s' % rng.choice(ids['players']), None, False),
+        ('player_api', 'player stats', 'GET',
+         lambda ids, rng: '/players/%s/stats' % rng.choice(ids['players']), None, False),
+        ('session_api', 'session page', 'GET', lambda ids, rng: '/sessions/?limit=100', None, False),
+        ('session_api', 'get session', 'GET',
+         lambda ids, rng: '/sessions/%s' % rng.choice(ids['sessions']), None, False),
+        ('session_api', 'sessions of a game', 'GET',
+         lambda ids, rng: '/sessions/?limit=100&game_id=%s' % rng.choice(ids['games']), None, False),
+        ('session_api', 'sessions of a player', 'GET',
+         lambda ids, rng: '/sessions/?limit=100&player_id=%s' % rng.choice(ids['players']), None, False),
+        ('session_api', 'stream sessions', 'GET', lambda ids, rng: '/sessions/?stream=1', None, True),
+        ('session_api', 'create session', 'POST', lambda ids, rng: '/sessions/', session_body, False),
+        ('session_players_api', 'session players page', 'GET',
+         lambda ids, rng: '/session-players/?limit=100', None, False),
+        ('session_players_api', 'get session player', 'GET',
+         lambda ids, rng: '/session-players/%s' % rng.choice(ids['session_players']), None, False),
+    ]
+
+
+def _sample_ids(app, seed):
+    rng = random.Random(seed)
+    ids = {}
+    with app.app_context():
+        for name, column in (('games', Game.id), ('players', Player.id),
+                             ('sessions', Session.id), ('session_players', SessionPlayers.id)):
+            ids[name] = list(db.session.execute(select(column).order_by(func.random()).limit(SAMPLE_SIZE)).scalars())
+            # the database picks the sample, so sort it to make the requests depend only on the seed
+            ids[name].sort()
+            rng.shuffle(ids[name])
+    return ids
+
+
+class _QueryCounter:
+    """Counts the SQL statements executed by an app's engine
+    """
+
+    def __init__(self, app):
+        self.count = 0
+        self._lock = Lock()
+        with app.app_context():
+            event.listen(db.engine, 'after_cursor_execute', self._executed)
+
+    def _executed(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def _peak_memory_mb(send, count):
+    """Sends requests while tracing memory allocations, and returns the peak memory they held at once
+
+    The RSS of the process only ever grows over a run, so it cannot tell the scenarios apart.  Tracing slows
+    every allocation down, so it is done in a pass of its own, after the latencies have been measured
+    """
+    tracemalloc.start()
+    try:
+        for _ in range(count):
+            send()
+        return round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+    finally:
+        tracemalloc.stop()
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _summarise(latencies, elapsed, queries, errors):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(_percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'queries_per_request': round(queries / len(latencies), 2)
+    }
+
+
+def _created_paths(session):
+    # deleting a Session only detaches its players, so they are deleted first
+    return ['/session-players/%s' % player['id'] for player in session['players']] + ['/sessions/%s' % session['id']]
+
+
+def _cleanup(client, method, response):
+    # remove whatever a write created, so that every scenario (and every later run) sees the same data
+    if method == 'POST' and response.status_code == 200:
+        for path in _created_paths(response.get_json()):
+            client.delete(path)
+
+
+def _run_client(app, counter, ids, scenario, requests, seed):
+    """Sends the requests of a scenario one at a time through the Flask test client
+    """
+    blueprint, name, method, path, body, heavy = scenario
+    rng = random.Random(seed)
+    client = app.test_client()
+    count = max(3, requests // 20) if heavy else requests
+
+    for _ in range(min(5, count)):
+        _cleanup(client, method, client.open(path(ids, rng), method=method, json=body and body(ids, rng)))
+
+    latencies = []
+    errors = 0
+    queries = 0
+    started = time.perf_counter()
+    for _ in range(count):
+        request_path = path(ids, rng)
+        request_body = body and body(ids, rng)
+
+        before = counter.count
+        request_started = time.perf_counter()
+        response = client.open(request_path, method=method, json=request_body)
+        response.get_data()
+        latencies.append(time.perf_counter() - request_started)
+        queries += counter.count - before
+
+        if response.status_code >= 400:
+            errors += 1
+        _cleanup(client, method, response)
+    elapsed = time.perf_counter() - started
+
+    def send():
+        _cleanup(client, method, client.open(path(ids, rng), method=method, json=body and body(ids, rng)))
+
+    return dict(_summarise(latencies, elapsed, queries, errors),
+                peak_memory_mb=_peak_memory_mb(send, min(MEMORY_SAMPLE_REQUESTS, count)))
+
+
+def _run_http(app, counter, ids, scenario, threads, duration, seed):
+    """Sends the requests of a scenario from several threads over HTTP, for the given number of seconds
+    """
+    blueprint, name, method, path, body, heavy = scenario
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    server_thread = Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    latencies = []
+    errors = []
+    results_lock = Lock()
+    deadline = time.perf_counter() + duration
+
+    def load(number):
+        rng = random.Random(seed + number)
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=60)
+        mine = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            request_body = body and body(ids, rng)
+            headers = {'Content-Type': 'application/json'} if request_body else {}
+            started = time.perf_counter()
+            try:
+                connection.request(method, path(ids, rng),
+                                   body=json.dumps(request_body) if request_body else None, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=60)
+                continue
+            mine.append(time.perf_counter() - started)
+            if response.status >= 400:
+                failed += 1
+            elif method == 'POST':
+                for created in _created_paths(json.loads(data)):
+                    connection.request('DELETE', created)
+                    connection.getresponse().read()
+        connection.close()
+        with results_lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    before = counter.count
+    started = time.perf_counter()
+    workers = [Thread(target=load, args=(number,)) for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    server.shutdown()
+    server_thread.join()
+
+    if not latencies:
+        return {'requests': 0, 'errors': sum(errors)}
+
+    # writes also count the queries of the DELETEs that undo them
+    return _summarise(latencies, elapsed, counter.count - before, sum(errors))
+
+
+def run(sizes, requests, threads, duration, seed, data_dir=None, modes=('client', 'http')):
+    """Runs every scenario against a dataset of each size
+
+    :param sizes: The names of the dataset sizes to run against, see datasets.SIZES
+    :param requests: The number of requests of each scenario sent through the test client
+    :param threads: The number of threads sending requests over HTTP
+    :param duration: The number of seconds each scenario is run for over HTTP
+    :param seed: The seed of the datasets and the requests
+    :param data_dir: A directory to keep the datasets in between runs, otherwise a temporary one is used
+    :param modes: Which of the "client" and "http" modes to run
+    :return The results, holding the details of the run under "meta" and one entry per
+        size, mode and scenario under "results"
+    :rtype dict
+    """
+    directory = data_dir or tempfile.mkdtemp(prefix='bgt-benchmarks-')
+    results = {}
+
+    try:
+        for size in sizes:
+            started = time.perf_counter()
+            app = datasets.build(directory, size, seed)
+            logging.info('Dataset %s ready in %.1f s', size, time.perf_counter() - started)
+
+            counter = _QueryCounter(app)
+            ids = _sample_ids(app, seed)
+
+            for scenario in _scenarios():
+                blueprint, name = scenario[0], scenario[1]
+                if 'client' in modes:
+                    key = '%s/client/%s/%s' % (size, blueprint, name)
+                    results[key] = _run_client(app, counter, ids, scenario, requests, seed)
+                    logging.info('%s: %s', key, results[key])
+                if 'http' in modes:
+                    key = '%s/http/%s/%s' % (size, blueprint, name)
+                    results[key] = _run_http(app, counter, ids, scenario, threads, duration, seed)
+                    logging.info('%s: %s', key, results[key])
+
+            with app.app_context():
+                db.engine.dispose()
+    finally:
+        if data_dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return {'meta': _meta(sizes, requests, threads, duration, seed), 'results': results}
+
+
+def _meta(sizes, requests, threads, duration, seed):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        'started': datetime.now(timezone.utc).isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'platform': platform.platform(),
+        'sizes': sizes,
+        'requests': requests,
+        'threads': threads,
+        'duration': duration,
+        'seed': seed
+    }
+
+
+def compare(baseline, current, threshold):
+    """Compares two runs and returns the regressions
+
+    A scenario regressed if its p50 or p99 latency grew by more than the threshold (and by more than
+    NOISE_FLOOR_MS), its throughput dropped by more than the threshold, it issued more queries per
+    request or it started failing
+
+    :param baseline: The results of the earlier run
+    :param current: The results of the new run
+    :param threshold: The allowed relative change, e.g. 0.2 for 20%
+    :return A list of human readable descriptions of each regression
+    :rtype list
+    """
+    regressions = []
+
+    for key, new in sorted(current['results'].items()):
+        old = baseline['results'].get(key)
+        if old is None or not old.get('requests') or not new.get('requests'):
+            continue
+
+        for metric in ('p50_ms', 'p99_ms'):
+            if new[metric] > old[metric] * (1 + threshold) and new[metric] - old[metric] > NOISE_FLOOR_MS:
+                regressions.append('%s: %s went from %.3f to %.3f' % (key, metric, old[metric], new[metric]))
+
+        if new['requests_per_second'] < old['requests_per_second'] * (1 - threshold):
+            regressions.append('%s: requests_per_second went from %.1f to %.1f' %
+                               (key, old['requests_per_second'], new['requests_per_second']))
+
+        if new['queries_per_request'] > old['queries_per_request'] + 0.01:
+            regressions.append('%s: queries_per_request went from %.2f to %.2f' %
+                               (key, old['queries_per_request'], new['queries_per_request']))
+
+        if new['errors'] > old['errors']:
+            regressions.append('%s: errors went from %d to %d' % (key, old['errors'], new['errors']))
+
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description='Benchmarks the BGT backend against seeded datasets')
+    parser.add_argument('--sizes', default='1k,100k',
+                        help='Comma separated dataset sizes, from %s' % ', '.join(datasets.SIZES))
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario through the test client')
+    parser.add_argument('--threads', type=int, default=8, help='Threads sending requests over HTTP')
+    parser.add_argument('--duration', type=float, default=3, help='Seconds to run each scenario over HTTP')
+    parser.add_argument('--modes', default='client,http', help='Comma separated modes to run: client, http')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the datasets and requests')
+    parser.add_argument('--data-dir', help='Keep the seeded databases in this directory between runs')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--results', help='Compare these earlier results instead of running the benchmarks')
+    parser.add_argument('--compare', help='Compare the results with this baseline JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed relative change when comparing')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    # keep the request log of the HTTP server out of the output
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    if args.results:
+        with open(args.results) as results_file:
+            current = json.load(results_file)
+    else:
+        sizes = [size.strip().lower() for size in args.sizes.split(',')]
+        unknown = [size for size in sizes if size not in datasets.SIZES]
+        if unknown:
+            parser.error('Unknown sizes: %s' % ', '.join(unknown))
+
+        current = run(sizes, args.requests, args.threads, args.duration, args.seed, args.data_dir,
+                      [mode.strip() for mode in args.modes.split(',')])
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(current, output_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(json.load(baseline_file), current, args.threshold)
+
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+
+        if regressions:
+            raise SystemExit(1)
+
+        print('No regressions against %s' % args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+from application import create_app
+from argparse import ArgumentParser
+from model.database import db
+from model import migrations
+import logging
+import model.LeaderboardDB as LeaderboardDB
+import model.PlayerStatsDB as PlayerStatsDB
+
+
+def schema_version():
+    """Returns the current schema version of the database
+
+    :return The version of the most recent migration applied
+    :rtype int
+    """
+    with db.engine.begin() as connection:
+        return migrations.current_version(connection)
+
+
+def upgrade(args):
+    """Applies any pending schema migrations
+    """
+    current = schema_version()
+    applied = migrations.upgrade(db.engine, args.target)
+
+    if applied:
+        print('Upgraded schema from version %d to %d' % (current, applied[-1]))
+    else:
+        print('Schema is already at version %d' % current)
+
+
+def version(args):
+    """Prints the current schema version
+    """
+    print('Schema is at version %d (latest is %d)' %
+          (schema_version(), migrations.latest_version()))
+
+
+def rebuild_stats(args):
+    """Recomputes the player statistics from the full session history
+    """
+    print('Rebuilt statistics for %d players' % PlayerStatsDB.rebuild())
+
+
+def check_leaderboard(args):
+    """Compares the maintained leaderboards with the full session history, optionally repairing them
+    """
+    mismatches = LeaderboardDB.check(args.game)
+
+    for player_id, game_id in mismatches:
+        print('Mismatch for player %s in game %s' % (player_id, game_id))
+
+    if not mismatches:
+        print('Leaderboards are consistent')
+    elif args.repair:
+        for game_id in sorted({game_id for player_id, game_id in mismatches}):
+            LeaderboardDB.rebuild(game_id)
+        print('Rebuilt the leaderboards of the mismatched games')
+    else:
+        raise SystemExit(1)
+
+
+def rebuild_leaderboard(args):
+    """Recomputes the leaderboards from the full session history
+    """
+    LeaderboardDB.rebuild(args.game)
+    print('Rebuilt the leaderboard of %s' % (args.game or 'every game'))
+
+
+def serve(args):
+    """Serves the app with a pool of pre-forked worker processes
+    """
+    import server
+
+    app = create_app(_config(args, BGT_AUTO_UPGRADE=args.upgrade))
+    server.serve(app, args.host, args.port, args.workers)
+
+
+def _config(args, **config):
+    if args.database:
+        config['SQLALCHEMY_DATABASE_URI'] = args.database
+
+    return config
+
+
+def main():
+    parser = ArgumentParser(description='Maintenance commands for the BGT backend')
+    parser.add_argument('--database', help='SQLAlchemy URI of the database (defaults to BGT_DATABASE_URI)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    upgrade_parser = commands.add_parser('upgrade', help='Apply pending schema migrations')
+    upgrade_parser.add_argument('--target', type=int, help='The version to upgrade to (defaults to the latest)')
+    upgrade_parser.set_defaults(func=upgrade)
+
+    version_parser = commands.add_parser('version', help='Print the current schema version')
+    version_parser.set_defaults(func=version)
+
+    rebuild_stats_parser = commands.add_parser('rebuild-stats', help='Recompute the player statistics')
+    rebuild_stats_parser.set_defaults(func=rebuild_stats)
+
+    check_leaderboard_parser = commands.add_parser('check-leaderboard',
+                                                   help='Compare the leaderboards with the session history')
+    check_leaderboard_parser.add_argument('--game', help='Only check the leaderboard of this game id')
+    check_leaderboard_parser.add_argument('--repair', action='store_true', help='Rebuild any mismatched games')
+    check_leaderboard_parser.set_defaults(func=check_leaderboard)
+
+    rebuild_leaderboard_parser = commands.add_parser('rebuild-leaderboard', help='Recompute the leaderboards')
+    rebuild_leaderboard_parser.add_argument('--game', help='Only rebuild the leaderboard of this game id')
+    rebuild_leaderboard_parser.set_defaults(func=rebuild_leaderboard)
+
+    serve_parser = commands.add_parser('serve', help='Serve the app with pre-forked worker processes')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='The address to listen on')
+    serve_parser.add_argument('--port', type=int, default=5000, help='The port to listen on')
+    serve_parser.add_argument('--workers', type=int, help='The number of workers (defaults to the number of CPUs)')
+    serve_parser.add_argument('--upgrade', action='store_true', help='Apply pending migrations before serving')
+    serve_parser.set_defaults(func=serve)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(process)d %(levelname)s %(message)s')
+
+    if args.func is serve:
+        serve(args)
+        return
+
+    with create_app(_config(args)).app_context():
+        args.func(args)
+
+
+if __name__ == '__main__':
+    main()
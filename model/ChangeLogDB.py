@@ -0,0 +1,176 @@
+from model.database import db, chunked, upsert, MAX_BIND_PARAMETERS
+from model.models import ChangeLog, TableVersion
+import model.VersionDB as VersionDB
+from flask import current_app
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.orm import Session
+from uuid import UUID
+
+# The entities whose changes are logged
+ENTITIES = ('game', 'player', 'session', 'session-players')
+
+# The operations of a change.  A create or an update means the entity should be fetched again,
+# a delete is a tombstone
+CREATE = 'create'
+UPDATE = 'update'
+DELETE = 'delete'
+
+DEFAULT_MAX_ROWS = 100000
+
+# The number of changes each process records between trimming the log down to BGT_CHANGE_LOG_MAX_ROWS
+CHANGE_LOG_TRIM_INTERVAL = 1000
+
+# The name the floor of the log is kept under in the table_version table
+FLOOR_NAME = 'change_log_floor'
+
+# The entity of the marker written by truncate(), which is never returned by get_changes()
+_TRUNCATE_ENTITY = 'change_log'
+
+# The key of Session.info marking a transaction that logged changes, see on_commit()
+_LOGGED = 'bgt_change_logged'
+
+# The functions called after every commit of this process that logged changes
+_commit_listeners = []
+
+_changes_since_trim = 0
+
+
+def record(entity, operation, entity_ids):
+    """Logs a change to each of the entities with the provided ids, without committing
+
+    Call this in the same transaction as the change itself.  Any earlier change to the same entities is
+    dropped from the log, so each entity only appears once, at the sequence number of its latest change
+
+    :param entity: The type of the entities, one of ENTITIES
+    :param operation: CREATE, UPDATE or DELETE
+    :param entity_ids: The canonical ids of the entities that changed
+    """
+    global _changes_since_trim
+
+    entity_ids = list(dict.fromkeys(entity_ids))
+    if not entity_ids:
+        return
+
+    # every writer waits on the change_log version until the previous one commits, so sequence numbers
+    # are taken, and become visible, in order and a reader never skips one that commits late
+    VersionDB.bump('change_log')
+    db.session.info[_LOGGED] = True
+
+    for chunk in chunked(entity_ids, MAX_BIND_PARAMETERS):
+        db.session.execute(delete(ChangeLog.__table__)
+                           .where(ChangeLog.entity == entity, ChangeLog.entity_id.in_(chunk)))
+    db.session.execute(insert(ChangeLog.__table__),
+                       [{'entity': entity, 'entity_id': entity_id, 'operation': operation}
+                        for entity_id in entity_ids])
+
+    _changes_since_trim += len(entity_ids)
+    if _changes_since_trim >= CHANGE_LOG_TRIM_INTERVAL:
+        _changes_since_trim = 0
+        trim(current_app.config.get('BGT_CHANGE_LOG_MAX_ROWS', DEFAULT_MAX_ROWS))
+
+
+def on_commit(listener):
+    """Registers a function to call, with no arguments, after every commit of this process that logged changes
+
+    The function is called on the committing thread, so it should only hand the news over (e.g. set an Event)
+
+    :param listener: The function to call
+    """
+    _commit_listeners.append(listener)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    if session.info.pop(_LOGGED, False):
+        for listener in _commit_listeners:
+            listener()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop(_LOGGED, None)
+
+
+def _raise_floor(seq):
+    db.session.execute(upsert(TableVersion.__table__, ['name'], max_columns=['version']),
+                       [{'name': FLOOR_NAME, 'version': seq}])
+
+
+def trim(max_rows):
+    """Drops the oldest changes until at most max_rows are left, without committing
+
+    The floor of the log is raised to the newest change dropped, so a client that has not synced
+    since then is told to download everything again
+
+    :param max_rows: The maximum number of changes to keep
+    :return The number of changes dropped
+    :rtype int
+    """
+    count = db.session.execute(select(func.count()).select_from(ChangeLog)).scalar()
+    if count <= max_rows:
+        return 0
+
+    floor = db.session.execute(select(ChangeLog.seq).order_by(ChangeLog.seq)
+                               .offset(count - max_rows - 1).limit(1)).scalar()
+    db.session.execute(delete(ChangeLog.__table__).where(ChangeLog.seq <= floor))
+    _raise_floor(floor)
+
+    return count - max_rows
+
+
+def truncate():
+    """Drops every change from the log, without committing, so every client downloads everything again
+
+    Use this after writing entities without going through the model (e.g. tools/generate_history.py)
+    """
+    VersionDB.bump('change_log')
+
+    # the floor takes a sequence number of its own, so no client can already be at it
+    db.session.execute(insert(ChangeLog.__table__).values(entity=_TRUNCATE_ENTITY, entity_id=str(UUID(int=0)),
+                                                          operation=DELETE))
+    floor = db.session.execute(select(func.max(ChangeLog.seq))).scalar()
+    db.session.execute(delete(ChangeLog.__table__).where(ChangeLog.seq <= floor))
+    _raise_floor(floor)
+
+
+def get_floor():
+    """Returns the floor of the log: changes up to and including it may have been dropped
+
+    :rtype int
+    """
+    return VersionDB.get(FLOOR_NAME)[FLOOR_NAME]
+
+
+def get_high_water_mark():
+    """Returns the sequence number of the latest change, to sync from after downloading everything
+
+    :rtype int
+    """
+    return max(db.session.execute(select(func.max(ChangeLog.seq))).scalar() or 0, get_floor())
+
+
+def get_changes(since, limit):
+    """Returns a page of the changes made after the provided sequence number, oldest first
+
+    Each entity appears at most once, with its latest change
+
+    :param since: The sequence number of the last change the client has seen
+    :param limit: The maximum number of changes to return
+    :return A tuple of the list of changes (dicts holding "seq", "type", "id" and "op"), the sequence
+        number to pass as since for the next page, and whether there are more changes after it
+    :rtype tuple
+    :raise ValueError if changes after since have been dropped from the log, see trim()
+    """
+    rows = db.session.execute(select(ChangeLog.seq, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.operation)
+                              .where(ChangeLog.seq > since)
+                              .order_by(ChangeLog.seq)
+                              .limit(limit + 1)).all()
+
+    # read after the changes, so a trim racing with this read is noticed
+    if since < get_floor():
+        raise ValueError("Changes since %d are no longer in the change log" % since)
+
+    changes = [{'seq': seq, 'type': entity, 'id': entity_id, 'op': operation}
+               for seq, entity, entity_id, operation in rows[:limit]]
+
+    return changes, changes[-1]['seq'] if changes else since, len(rows) > limit
@@ -1,15 +1,44 @@
-from model.database import db
+from model.database import db, chunked, MAX_BIND_PARAMETERS, STREAM_CHUNK_SIZE
 from model.models import Game
+import model.ChangeLogDB as ChangeLogDB
+import model.VersionDB as VersionDB
+from model.cache import ALL_ROWS, TableCache
+from model.types import canonical_id
+from sqlalchemy import select
 from uuid import uuid4
 
+# The fields of a Game, matching Game.to_obj()
+FIELDS = ('id', 'name', 'scoring')
+
+# Read-through cache of Game rows, invalidated whenever the game table changes
+_cache = TableCache('game')
+
 
 def get_all():
     """Returns all of the Game objects in the database
 
+    Served from the cache when possible, in which case the objects are detached copies
+
     :return A list of Game objects
     :rtype list
     """
-    return Game.query.all()
+    rows = _cache.get(ALL_ROWS, lambda: [_to_row(game) for game in Game.query.all()])
+    return [Game(**row) for row in rows]
+
+
+def iter_rows(chunk_size=STREAM_CHUNK_SIZE, fields=FIELDS):
+    """Iterates over all of the Games in the database as plain dicts, holding only the requested fields
+
+    Only the columns of the requested fields are read, and no model objects are created
+
+    :param chunk_size: The number of rows to fetch from the database at a time
+    :param fields: The fields to return, a subset of FIELDS
+    :return An iterator of dicts
+    :rtype iterator
+    """
+    columns = [Game.__table__.c[field] for field in fields]
+    result = db.session.execute(select(*columns).execution_options(yield_per=chunk_size))
+    return (dict(zip(fields, row)) for row in result)
 
 
 def get(game_id):
@@ -19,7 +48,50 @@ def get(game_id):
     :return A single Game object
     :rtype Game
     """
-    return Game.query.filter_by(id=game_id).first()
+    row = _cache.get(game_id, lambda: _to_row(Game.query.filter_by(id=game_id).first()))
+    return Game(**row) if row is not None else None
+
+
+def get_many(game_ids):
+    """Returns the Game objects specified by the provided ids
+
+    Ids that are not cached are fetched with IN queries of at most MAX_BIND_PARAMETERS ids each
+
+    :param game_ids: A list of the ids of the Games to retrieve
+    :return A tuple of the list of Game objects in the requested order (without duplicates),
+        and the list of requested ids that could not be found
+    :rtype tuple
+    """
+    game_ids = list(dict.fromkeys(game_ids))
+    rows = _cache.get_many(game_ids, _load_many)
+
+    return [Game(**rows[game_id]) for game_id in game_ids if game_id in rows], \
+        [game_id for game_id in game_ids if game_id not in rows]
+
+
+def _load_many(game_ids):
+    """Returns the column values of the Games with the provided ids, keyed by id
+    """
+    rows = {}
+    for chunk in chunked(game_ids, MAX_BIND_PARAMETERS):
+        rows.update({game.id: _to_row(game) for game in Game.query.filter(Game.id.in_(chunk))})
+
+    return rows
+
+
+def _to_row(game):
+    """Returns the column values of a Game for caching, or None if there is no Game
+    """
+    if game is None:
+        return None
+
+    return {column: getattr(game, column) for column in FIELDS}
+
+
+def invalidate_cache():
+    """Drops every cached Game, for use after writing to the game table without going through this module
+    """
+    _cache.invalidate()
 
 
 def create(name, scoring, game_id=None):
@@ -30,15 +102,18 @@ def create(name, scoring, game_id=None):
     :param game_id: The id to assign to the Game.  If not provided, a uuid will be generated
     :return The created Game object
     :rtype: Game
+    :raise InvalidIdError if the provided id is not a UUID
     """
 
-    if game_id is None:
-        game_id = str(uuid4())
+    game_id = str(uuid4()) if game_id is None else canonical_id(game_id)
 
     new_game = Game(id=game_id, name=name, scoring=scoring)
 
     db.session.add(new_game)
+    ChangeLogDB.record('game', ChangeLogDB.CREATE, [game_id])
+    VersionDB.bump('game')
     db.session.commit()
+    _cache.invalidate()
 
     return new_game
 
@@ -64,7 +139,10 @@ def update(game_id, name=None, scoring=None):
     if scoring is not None:
         game_to_update.scoring = scoring
 
+    ChangeLogDB.record('game', ChangeLogDB.UPDATE, [game_to_update.id])
+    VersionDB.bump('game')
     db.session.commit()
+    _cache.invalidate()
 
     return game_to_update
 
@@ -83,6 +161,9 @@ def delete(game_id):
         raise ValueError("Could not find Game with id")
 
     db.session.delete(game_to_delete)
+    ChangeLogDB.record('game', ChangeLogDB.DELETE, [game_to_delete.id])
+    VersionDB.bump('game')
     db.session.commit()
+    _cache.invalidate()
 
     return True
@@ -0,0 +1,156 @@
+from model.database import db
+from model.models import IdempotencyKey
+from sqlalchemy import and_, delete, event, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import time
+
+# The number of seconds after which a key that is still pending is assumed to belong to a request that died
+IDEMPOTENCY_PENDING_TIMEOUT = 60
+
+# The number of claims each process makes between removing the expired keys
+IDEMPOTENCY_PURGE_INTERVAL = 100
+
+# The key of Session.info holding the Idempotency-Key of the request the session belongs to, see hold()
+_HELD = 'bgt_idempotency_key'
+
+_claims_since_purge = 0
+
+
+def _get(key):
+    return db.session.execute(select(IdempotencyKey.__table__).where(IdempotencyKey.key == key)).first()
+
+
+def claim(key, fingerprint, ttl, max_keys=None):
+    """Claims an Idempotency-Key for the current request, unless another request already holds it
+
+    The claim is committed straight away, so every other process sees the key as pending until
+    complete() or release() is called.  A key whose response has expired, or whose request has been
+    pending for more than IDEMPOTENCY_PENDING_TIMEOUT seconds without committing any writes, is claimed again
+
+    :param key: The Idempotency-Key
+    :param fingerprint: A hash of the request, to tell a retry from another request reusing the key
+    :param ttl: The number of seconds the key, and its response, are kept for
+    :param max_keys: If provided, the maximum number of keys kept, see purge()
+    :return None if the key was claimed, otherwise the existing row of the key, holding its fingerprint,
+        whether its request has committed, and its status, mimetype and body once its request has completed
+    :rtype Row
+    """
+    global _claims_since_purge
+    _claims_since_purge += 1
+    if _claims_since_purge >= IDEMPOTENCY_PURGE_INTERVAL:
+        _claims_since_purge = 0
+        purge(max_keys)
+
+    while True:
+        now = time.time()
+        try:
+            db.session.execute(insert(IdempotencyKey.__table__).values(key=key, fingerprint=fingerprint,
+                                                                       created_at=now, expires_at=now + ttl))
+            db.session.commit()
+            return None
+        except IntegrityError:
+            db.session.rollback()
+
+        existing = _get(key)
+        if existing is not None and existing.expires_at > now and \
+                (existing.status is not None or existing.committed or
+                 existing.created_at > now - IDEMPOTENCY_PENDING_TIMEOUT):
+            # end the transaction, so a caller waiting for the key sees its completion
+            db.session.rollback()
+            return existing
+
+        if existing is not None:
+            # take the key over, unless another request got there first
+            result = db.session.execute(update(IdempotencyKey.__table__)
+                                        .where(and_(IdempotencyKey.key == key,
+                                                    IdempotencyKey.created_at == existing.created_at))
+                                        .values(fingerprint=fingerprint, status=None, mimetype=None, body=None,
+                                                created_at=now, expires_at=now + ttl))
+            db.session.commit()
+            if result.rowcount == 1:
+                return None
+
+
+def hold(key):
+    """Ties the writes of the current request to the Idempotency-Key it claimed
+
+    Until complete() or release() is called, every commit of the request also marks the key as committed,
+    in the same transaction, so the key is never given up (or claimed again) once the writes are in
+
+    :param key: The Idempotency-Key claimed by the current request
+    """
+    db.session.info[_HELD] = key
+
+
+@event.listens_for(Session, 'before_commit')
+def _before_commit(session):
+    key = session.info.get(_HELD)
+    if key is not None:
+        session.execute(update(IdempotencyKey.__table__)
+                        .where(and_(IdempotencyKey.key == key, IdempotencyKey.committed.is_(False)))
+                        .values(committed=True))
+
+
+def complete(key, status, mimetype, body):
+    """Records the response to the request holding an Idempotency-Key, and commits
+
+    :param key: The Idempotency-Key
+    :param status: The status code of the response
+    :param mimetype: The mimetype of the response
+    :param body: The body of the response
+    """
+    db.session.info.pop(_HELD, None)
+    db.session.execute(update(IdempotencyKey.__table__)
+                       .where(IdempotencyKey.key == key)
+                       .values(status=status, mimetype=mimetype, body=body))
+    db.session.commit()
+
+
+def release(key):
+    """Gives up the claim on a pending Idempotency-Key, so a retry runs the request again
+
+    Rolls back anything left uncommitted by the request, then commits the release.  A key whose request
+    has already committed its writes is kept, so a retry cannot write them again
+
+    :param key: The Idempotency-Key
+    :return Whether the key was given up
+    :rtype bool
+    """
+    db.session.info.pop(_HELD, None)
+    db.session.rollback()
+    result = db.session.execute(delete(IdempotencyKey.__table__)
+                                .where(and_(IdempotencyKey.key == key, IdempotencyKey.status.is_(None),
+                                            IdempotencyKey.committed.is_(False))))
+    db.session.commit()
+
+    return result.rowcount == 1
+
+
+def purge(max_keys=None):
+    """Removes the expired keys, then the oldest ones beyond max_keys, and commits
+
+    :param max_keys: If provided, the maximum number of keys to keep
+    :return The number of keys removed
+    :rtype int
+    """
+    now = time.time()
+    removed = db.session.execute(delete(IdempotencyKey.__table__)
+                                 .where(or_(IdempotencyKey.expires_at <= now,
+                                            and_(IdempotencyKey.status.is_(None),
+                                                 IdempotencyKey.committed.is_(False),
+                                                 IdempotencyKey.created_at <= now - IDEMPOTENCY_PENDING_TIMEOUT))))
+    count = removed.rowcount
+
+    if max_keys is not None:
+        # every key lives for the same ttl, so the keys expiring first are the oldest
+        oldest_kept = select(IdempotencyKey.expires_at) \
+            .order_by(IdempotencyKey.expires_at.desc()) \
+            .offset(max(max_keys - 1, 0)) \
+            .limit(1) \
+            .scalar_subquery()
+        count += db.session.execute(delete(IdempotencyKey.__table__)
+                                    .where(IdempotencyKey.expires_at < oldest_kept)).rowcount
+
+    db.session.commit()
+    return count
@@ -0,0 +1,335 @@
+from model.database import db
+from model.models import Game, Player, Session, SessionPlayers
+import model.ChangeLogDB as ChangeLogDB
+import model.GameDB as GameDB
+import model.PlayerDB as PlayerDB
+import model.PlayerStatsDB as PlayerStatsDB
+import model.VersionDB as VersionDB
+from model.types import canonical_id
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from datetime import date
+from uuid import uuid4
+import csv
+import json
+import time
+
+# The number of Sessions written by each transaction of an import
+IMPORT_BATCH_SIZE = 5000
+
+# The maximum number of line errors included in the result of an import
+MAX_REPORTED_ERRORS = 1000
+
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y', 'x')
+
+
+def parse_ndjson(lines):
+    """Parses newline delimited JSON, where each line holds one Session
+
+    Each line is an object in the same format as the body of POST /sessions/, except that games
+    and players may be referenced by name ("game", "player") instead of id ("game_id", "player_id")
+
+    :param lines: An iterable of text lines
+    :return An iterator of (line number, record, error) tuples, where exactly one of record and error is set
+    :rtype iterator
+    """
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield line_number, None, 'Invalid JSON: %s' % error
+            continue
+
+        if not isinstance(record, dict):
+            yield line_number, None, 'Each line must be a JSON object'
+            continue
+
+        yield line_number, record, None
+
+
+def parse_csv(lines):
+    """Parses CSV with a header row, where each row holds one player of a Session
+
+    Recognised columns are "session", "date", "game" or "game_id", "player" or "player_id", "score",
+    "team" and "winner".  Consecutive rows with the same "session" value (or, if there is no "session"
+    column, the same date and game) are grouped into one Session
+
+    :param lines: An iterable of text lines
+    :return An iterator of (line number, record, error) tuples, where exactly one of record and error is set
+    :rtype iterator
+    """
+    reader = csv.DictReader(lines)
+
+    current_key = None
+    current_line = None
+    current_record = None
+
+    for row in reader:
+        line_number = reader.line_num
+        key = row.get('session') or (row.get('date'), row.get('game_id') or row.get('game'))
+
+        if key != current_key:
+            if current_record is not None:
+                yield current_line, current_record, None
+
+            current_key = key
+            current_line = line_number
+            current_record = {'date': row.get('date'),
+                              'game_id': row.get('game_id') or None,
+                              'game': row.get('game') or None,
+                              'players': []}
+        elif current_record is None:
+            # an earlier row of this Session was invalid, so the whole Session is skipped
+            continue
+
+        try:
+            current_record['players'].append({'player_id': row.get('player_id') or None,
+                                              'player': row.get('player') or None,
+                                              'score': int(row['score']) if row.get('score') else None,
+                                              'team': int(row['team']) if row.get('team') else None,
+                                              'winner': (row.get('winner') or '').strip().lower() in TRUE_VALUES})
+        except ValueError as error:
+            current_record = None
+            yield line_number, None, 'Invalid number: %s' % error
+
+    if current_record is not None:
+        yield current_line, current_record, None
+
+
+class _Importer:
+    """Resolves the records of an import into rows and writes them in batched transactions
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.game_ids = {game_id: name for game_id, name in db.session.query(Game.id, Game.name)}
+        self.game_names = {name: game_id for game_id, name in self.game_ids.items()}
+        self.player_ids = {player_id: name for player_id, name in db.session.query(Player.id, Player.name)}
+        self.player_names = {name: player_id for player_id, name in self.player_ids.items()}
+        self.sessions_imported = 0
+        self.session_players_imported = 0
+        self.error_count = 0
+        self.errors = []
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self.new_games = {}
+        self.new_players = {}
+        # a (line number, Session row, list of SessionPlayers rows) tuple per Session
+        self.records = []
+
+    def error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def _resolve_game(self, record):
+        if record.get('game_id'):
+            game_id = canonical_id(record['game_id'], 'game_id')
+            if game_id not in self.game_ids:
+                raise ValueError('Unknown game_id %s' % record['game_id'])
+            return game_id
+
+        name = record.get('game')
+        if not name:
+            raise ValueError('A game or game_id is required')
+
+        game_id = self.game_names.get(name) or self.new_games.get(name)
+        if game_id is None:
+            game_id = str(uuid4())
+            self.new_games[name] = game_id
+
+        return game_id
+
+    def _resolve_player(self, entry):
+        if entry.get('player_id'):
+            player_id = canonical_id(entry['player_id'], 'player_id')
+            if player_id not in self.player_ids:
+                raise ValueError('Unknown player_id %s' % entry['player_id'])
+            return player_id
+
+        name = entry.get('player')
+        if not name:
+            raise ValueError('A player or player_id is required for every player')
+
+        player_id = self.player_names.get(name) or self.new_players.get(name)
+        if player_id is None:
+            player_id = str(uuid4())
+            self.new_players[name] = player_id
+
+        return player_id
+
+    @staticmethod
+    def _check_player(entry):
+        # the same rules whatever the format, as the values are written without going through the model
+        for field in ('score', 'team'):
+            if entry.get(field) is not None and (isinstance(entry[field], bool) or not isinstance(entry[field], int)):
+                raise ValueError('%s must be an integer' % field)
+        if entry.get('winner') not in (None, True, False):
+            raise ValueError('winner must be true or false')
+
+    def add(self, line_number, record):
+        """Resolves a single Session record and adds it to the current batch
+
+        :param line_number: The line of the upload the record started on
+        :param record: The parsed Session record
+        """
+        # resolve everything before touching the batch, so an invalid record leaves no trace
+        new_game_count = len(self.new_games)
+        new_player_count = len(self.new_players)
+        try:
+            if not record.get('date'):
+                raise ValueError('A date is required')
+            sess_date = date.fromisoformat(str(record['date']))
+
+            game_id = self._resolve_game(record)
+            players = record.get('players') or []
+            if not isinstance(players, list):
+                raise ValueError('players must be a list')
+            for entry in players:
+                self._check_player(entry)
+            player_ids = [self._resolve_player(entry) for entry in players]
+
+            session_id = canonical_id(record['id']) if record.get('id') else str(uuid4())
+            session_players_ids = [canonical_id(entry['id']) if entry.get('id') else str(uuid4())
+                                   for entry in players]
+        except (TypeError, ValueError, AttributeError) as error:
+            # forget any games and players that only this record referenced
+            for name in list(self.new_games)[new_game_count:]:
+                del self.new_games[name]
+            for name in list(self.new_players)[new_player_count:]:
+                del self.new_players[name]
+            self.error(line_number, str(error))
+            return
+
+        self.records.append((line_number,
+                             {'id': session_id, 'date': sess_date, 'game': game_id},
+                             [{'id': session_players_id,
+                               'session_id': session_id,
+                               'player_id': player_id,
+                               'score': entry.get('score'),
+                               'team': entry.get('team'),
+                               'winner': bool(entry.get('winner'))}
+                              for entry, session_players_id, player_id in zip(players, session_players_ids,
+                                                                               player_ids)]))
+
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def _write(self, records):
+        """Writes Sessions of the current batch, along with the new Games and Players they reference,
+        in a single transaction
+        """
+        sessions = [session for _, session, _ in records]
+        session_players = [row for _, _, rows in records for row in rows]
+
+        # only the new Games and Players these Sessions reference, and that an earlier write did not create
+        game_ids = {session['game'] for session in sessions}
+        player_ids = {row['player_id'] for row in session_players}
+        new_games = {name: game_id for name, game_id in self.new_games.items()
+                     if game_id in game_ids and game_id not in self.game_ids}
+        new_players = {name: player_id for name, player_id in self.new_players.items()
+                       if player_id in player_ids and player_id not in self.player_ids}
+
+        if new_games:
+            db.session.execute(insert(Game.__table__),
+                               [{'id': game_id, 'name': name, 'scoring': None} for name, game_id in new_games.items()])
+        if new_players:
+            db.session.execute(insert(Player.__table__),
+                               [{'id': player_id, 'name': name} for name, player_id in new_players.items()])
+        db.session.execute(insert(Session.__table__), sessions)
+        if session_players:
+            db.session.execute(insert(SessionPlayers.__table__), session_players)
+            games = {session['id']: session['game'] for session in sessions}
+            PlayerStatsDB.apply(added=[PlayerStatsDB.snapshot(row, games[row['session_id']])
+                                       for row in session_players])
+        ChangeLogDB.record('game', ChangeLogDB.CREATE, new_games.values())
+        ChangeLogDB.record('player', ChangeLogDB.CREATE, new_players.values())
+        ChangeLogDB.record('session', ChangeLogDB.CREATE, [session['id'] for session in sessions])
+        ChangeLogDB.record('session-players', ChangeLogDB.CREATE, [row['id'] for row in session_players])
+        VersionDB.bump('game', 'player', 'session', 'session-players')
+        db.session.commit()
+
+        if new_games:
+            GameDB.invalidate_cache()
+        if new_players:
+            PlayerDB.invalidate_cache()
+
+        for name, game_id in new_games.items():
+            self.game_names[name] = game_id
+            self.game_ids[game_id] = name
+        for name, player_id in new_players.items():
+            self.player_names[name] = player_id
+            self.player_ids[player_id] = name
+
+        self.sessions_imported += len(sessions)
+        self.session_players_imported += len(session_players)
+
+    def flush(self):
+        """Writes the current batch in a single transaction
+
+        If the transaction fails because the database is unavailable (e.g. locked), every line of the batch is
+        reported as an error.  If it fails for any other reason (e.g. an id that is already taken), the Sessions
+        are written one at a time, and only the lines of those that still fail are reported
+        """
+        records, self.records = self.records, []
+        if not records:
+            self._reset_batch()
+            return
+
+        try:
+            self._write(records)
+        except OperationalError as error:
+            db.session.rollback()
+            for line_number, _, _ in records:
+                self.error(line_number, 'Batch could not be written: %s' % error.__class__.__name__)
+        except Exception:
+            db.session.rollback()
+            for record in records:
+                try:
+                    self._write([record])
+                except Exception as error:
+                    db.session.rollback()
+                    self.error(record[0], 'Session could not be written: %s' % error.__class__.__name__)
+
+        self._reset_batch()
+
+
+def import_sessions(parsed_records, batch_size=IMPORT_BATCH_SIZE):
+    """Imports Sessions and their players in batched transactions
+
+    Games and players referenced by name are resolved against the existing rows and created if they do
+    not exist.  Records that cannot be resolved are skipped and reported as errors
+
+    :param parsed_records: An iterable of (line number, record, error) tuples, as returned by
+        parse_csv or parse_ndjson
+    :param batch_size: The number of Sessions to write in each transaction
+    :return A dict summarising the import: the number of sessions and session players imported,
+        the errors per line, the elapsed time and the number of rows imported per second
+    :rtype dict
+    """
+    started = time.perf_counter()
+    importer = _Importer(batch_size)
+
+    for line_number, record, error in parsed_records:
+        if error is not None:
+            importer.error(line_number, error)
+        else:
+            importer.add(line_number, record)
+
+    importer.flush()
+
+    elapsed = time.perf_counter() - started
+    rows = importer.sessions_imported + importer.session_players_imported
+
+    return {
+        'sessions': importer.sessions_imported,
+        'session_players': importer.session_players_imported,
+        'error_count': importer.error_count,
+        'errors': importer.errors,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(rows / elapsed) if elapsed > 0 else rows
+    }
@@ -0,0 +1,59 @@
+from model.database import db
+from model.models import PlayerGameStats
+import model.PlayerStatsDB as PlayerStatsDB
+from sqlalchemy import Float, cast, select
+
+LEADERBOARD_COLUMNS = ['games_played', 'wins', 'total_score', 'scored_games', 'best_score']
+
+
+def get(game_id, limit):
+    """Returns the leaderboard of the specified Game
+
+    Players are ranked by wins, then win rate, then best score, then average score.  The leaderboard is
+    read from the PlayerGameStats maintained by PlayerStatsDB, so the cost does not grow with the history
+
+    :param game_id: The id of the Game to return the leaderboard of
+    :param limit: The maximum number of Players to return
+    :return A list of PlayerGameStats objects, in rank order
+    :rtype list
+    """
+    win_rate = cast(PlayerGameStats.wins, Float) / PlayerGameStats.games_played
+    average_score = cast(PlayerGameStats.total_score, Float) / PlayerGameStats.scored_games
+
+    return PlayerGameStats.query \
+        .filter(PlayerGameStats.game_id == game_id, PlayerGameStats.games_played > 0) \
+        .order_by(PlayerGameStats.wins.desc(),
+                  win_rate.desc(),
+                  PlayerGameStats.best_score.desc().nullslast(),
+                  average_score.desc().nullslast(),
+                  PlayerGameStats.player_id) \
+        .limit(limit) \
+        .all()
+
+
+def check(game_id=None):
+    """Compares the maintained leaderboards with ones computed from the full history
+
+    :param game_id: If provided, only the leaderboard of this Game is checked
+    :return A list of (player_id, game_id) pairs whose maintained statistics are wrong, missing or left over
+    :rtype list
+    """
+    expected = {(row[0], row[1]): tuple(row[2:])
+                for row in db.session.execute(PlayerStatsDB.game_stats_query(game_id))}
+
+    query = select(PlayerGameStats.player_id, PlayerGameStats.game_id,
+                   *[getattr(PlayerGameStats, column) for column in LEADERBOARD_COLUMNS])
+    if game_id is not None:
+        query = query.where(PlayerGameStats.game_id == game_id)
+    actual = {(row[0], row[1]): tuple(row[2:]) for row in db.session.execute(query)}
+
+    return sorted(pair for pair in set(expected) | set(actual) if expected.get(pair) != actual.get(pair))
+
+
+def rebuild(game_id=None):
+    """Recomputes the maintained leaderboards from the full history
+
+    :param game_id: If provided, only the leaderboard of this Game is rebuilt
+    """
+    PlayerStatsDB.rebuild_game(game_id)
+    db.session.commit()
@@ -1,15 +1,44 @@
-from model.database import db
+from model.database import db, chunked, MAX_BIND_PARAMETERS, STREAM_CHUNK_SIZE
 from model.models import Player
+import model.ChangeLogDB as ChangeLogDB
+import model.VersionDB as VersionDB
+from model.cache import ALL_ROWS, TableCache
+from model.types import canonical_id
+from sqlalchemy import select
 from uuid import uuid4
 
+# The fields of a Player, matching Player.to_obj()
+FIELDS = ('id', 'name')
+
+# Read-through cache of Player rows, invalidated whenever the player table changes
+_cache = TableCache('player')
+
 
 def get_all():
     """Returns all of the Player objects in the database
 
+    Served from the cache when possible, in which case the objects are detached copies
+
     :return A list of Player objects
     :rtype list
     """
-    return Player.query.all()
+    rows = _cache.get(ALL_ROWS, lambda: [_to_row(player) for player in Player.query.all()])
+    return [Player(**row) for row in rows]
+
+
+def iter_rows(chunk_size=STREAM_CHUNK_SIZE, fields=FIELDS):
+    """Iterates over all of the Players in the database as plain dicts, holding only the requested fields
+
+    Only the columns of the requested fields are read, and no model objects are created
+
+    :param chunk_size: The number of rows to fetch from the database at a time
+    :param fields: The fields to return, a subset of FIELDS
+    :return An iterator of dicts
+    :rtype iterator
+    """
+    columns = [Player.__table__.c[field] for field in fields]
+    result = db.session.execute(select(*columns).execution_options(yield_per=chunk_size))
+    return (dict(zip(fields, row)) for row in result)
 
 
 def get(player_id):
@@ -19,7 +48,50 @@ def get(player_id):
     :return A single Player object
     :rtype Player
     """
-    return Player.query.filter_by(id=player_id).first()
+    row = _cache.get(player_id, lambda: _to_row(Player.query.filter_by(id=player_id).first()))
+    return Player(**row) if row is not None else None
+
+
+def get_many(player_ids):
+    """Returns the Player objects specified by the provided ids
+
+    Ids that are not cached are fetched with IN queries of at most MAX_BIND_PARAMETERS ids each
+
+    :param player_ids: A list of the ids of the Players to retrieve
+    :return A tuple of the list of Player objects in the requested order (without duplicates),
+        and the list of requested ids that could not be found
+    :rtype tuple
+    """
+    player_ids = list(dict.fromkeys(player_ids))
+    rows = _cache.get_many(player_ids, _load_many)
+
+    return [Player(**rows[player_id]) for player_id in player_ids if player_id in rows], \
+        [player_id for player_id in player_ids if player_id not in rows]
+
+
+def _load_many(player_ids):
+    """Returns the column values of the Players with the provided ids, keyed by id
+    """
+    rows = {}
+    for chunk in chunked(player_ids, MAX_BIND_PARAMETERS):
+        rows.update({player.id: _to_row(player) for player in Player.query.filter(Player.id.in_(chunk))})
+
+    return rows
+
+
+def _to_row(player):
+    """Returns the column values of a Player for caching, or None if there is no Player
+    """
+    if player is None:
+        return None
+
+    return {column: getattr(player, column) for column in FIELDS}
+
+
+def invalidate_cache():
+    """Drops every cached Player, for use after writing to the player table without going through this module
+    """
+    _cache.invalidate()
 
 
 def create(name, player_id=None):
@@ -29,15 +101,18 @@ def create(name, player_id=None):
     :param player_id: The id to assign to the Player.  If not provided, a uuid will be generated
     :return The created Player object
     :rtype: Player
+    :raise InvalidIdError if the provided id is not a UUID
     """
 
-    if player_id is None:
-        player_id = str(uuid4())
+    player_id = str(uuid4()) if player_id is None else canonical_id(player_id)
 
     new_player = Player(id=player_id, name=name)
 
     db.session.add(new_player)
+    ChangeLogDB.record('player', ChangeLogDB.CREATE, [player_id])
+    VersionDB.bump('player')
     db.session.commit()
+    _cache.invalidate()
 
     return new_player
 
@@ -59,7 +134,10 @@ def update(player_id, name=None):
     if name is not None:
         player_to_update.name = name
 
+    ChangeLogDB.record('player', ChangeLogDB.UPDATE, [player_to_update.id])
+    VersionDB.bump('player')
     db.session.commit()
+    _cache.invalidate()
 
     return player_to_update
 
@@ -78,6 +156,9 @@ def delete(player_id):
         raise ValueError("Could not find Player with id")
 
     db.session.delete(player_to_delete)
+    ChangeLogDB.record('player', ChangeLogDB.DELETE, [player_to_delete.id])
+    VersionDB.bump('player')
     db.session.commit()
+    _cache.invalidate()
 
     return True
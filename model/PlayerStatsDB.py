@@ -0,0 +1,229 @@
+from model.database import db, chunked, upsert, MAX_BIND_PARAMETERS
+from model.models import PlayerGameStats, PlayerStats, Session, SessionPlayers
+import model.VersionDB as VersionDB
+from sqlalchemy import and_, bindparam, case, delete, func, insert, select, update
+
+PLAYER_STATS_COLUMNS = ['games_played', 'wins', 'total_score', 'scored_games']
+PLAYER_GAME_STATS_COLUMNS = ['games_played', 'wins', 'total_score', 'scored_games']
+
+
+def get(player_id):
+    """Returns the PlayerStats of the specified Player
+
+    :param player_id: The id of the Player to retrieve the statistics of
+    :return The PlayerStats of the Player, with every count at zero if the Player has not played yet
+    :rtype PlayerStats
+    """
+    stats = db.session.get(PlayerStats, player_id)
+
+    if stats is None:
+        stats = PlayerStats(player_id=player_id, games_played=0, wins=0, total_score=0, scored_games=0)
+
+    return stats
+
+
+def get_favourite_game(player_id):
+    """Returns the id of the Game the specified Player has played the most
+
+    :param player_id: The id of the Player
+    :return The id of the Game, or None if the Player has not played yet
+    :rtype str
+    """
+    return db.session.execute(select(PlayerGameStats.game_id)
+                              .where(PlayerGameStats.player_id == player_id)
+                              .order_by(PlayerGameStats.games_played.desc(), PlayerGameStats.game_id)
+                              .limit(1)).scalar()
+
+
+def snapshot(session_players, game_id=None):
+    """Captures the values of a SessionPlayers that the statistics are built from
+
+    Take the snapshot before modifying the SessionPlayers, so the old values can be passed to apply()
+
+    :param session_players: The SessionPlayers object, or a dict holding its values
+    :param game_id: If known, the id of the Game of the Session.  Otherwise it is looked up by apply()
+    :return A dict holding the session_id, player_id, score, winner and game_id
+    :rtype dict
+    """
+    if isinstance(session_players, dict):
+        values = session_players
+    else:
+        values = {'session_id': session_players.session_id,
+                  'player_id': session_players.player_id,
+                  'score': session_players.score,
+                  'winner': session_players.winner}
+
+    return {'session_id': values['session_id'],
+            'player_id': values['player_id'],
+            'score': values.get('score'),
+            'winner': values.get('winner'),
+            'game_id': game_id}
+
+
+def _lookup_games(snapshots):
+    """Fills in the game_id of any snapshots that do not have one
+
+    Snapshots whose Session does not exist are left with a game_id of None
+    """
+    session_ids = {entry['session_id'] for entry in snapshots if entry['game_id'] is None}
+    session_ids.discard(None)
+    if not session_ids:
+        return
+
+    # make sure any Sessions created in this transaction are visible to the lookup
+    db.session.flush()
+
+    games = {}
+    for chunk in chunked(session_ids, MAX_BIND_PARAMETERS):
+        games.update(db.session.execute(select(Session.id, Session.game).where(Session.id.in_(chunk))).all())
+
+    for entry in snapshots:
+        if entry['game_id'] is None:
+            entry['game_id'] = games.get(entry['session_id'])
+
+
+def apply(removed=(), added=()):
+    """Updates the statistics for a change to some SessionPlayers, without committing
+
+    Call this after making the change, in the same transaction as the change itself.  SessionPlayers
+    that do not belong to an existing Session with a Game do not count towards the statistics
+
+    :param removed: A list of snapshots of the SessionPlayers values that no longer apply
+    :param added: A list of snapshots of the SessionPlayers values that now apply
+    """
+    removed = list(removed)
+    added = list(added)
+
+    # make sure the change itself is visible to the queries below
+    db.session.flush()
+    _lookup_games(removed + added)
+
+    player_deltas = {}
+    game_deltas = {}
+    best_scores = {}
+    lost_best_scores = set()
+    for sign, snapshots in ((-1, removed), (1, added)):
+        for entry in snapshots:
+            if entry['game_id'] is None or entry['player_id'] is None:
+                continue
+
+            won = 1 if entry['winner'] else 0
+            scored = 0 if entry['score'] is None else 1
+            score = entry['score'] or 0
+            pair = (entry['player_id'], entry['game_id'])
+
+            player_delta = player_deltas.setdefault(entry['player_id'], [0, 0, 0, 0])
+            game_delta = game_deltas.setdefault(pair, [0, 0, 0, 0])
+            for delta in (player_delta, game_delta):
+                delta[0] += sign
+                delta[1] += sign * won
+                delta[2] += sign * score
+                delta[3] += sign * scored
+
+            if scored and sign > 0:
+                best_scores[pair] = max(best_scores.get(pair, score), score)
+            elif scored:
+                lost_best_scores.add(pair)
+
+    player_rows = [dict(zip(PLAYER_STATS_COLUMNS, delta), player_id=player_id)
+                   for player_id, delta in player_deltas.items() if any(delta)]
+    game_rows = [dict(zip(PLAYER_GAME_STATS_COLUMNS, delta),
+                      player_id=pair[0], game_id=pair[1], best_score=best_scores.get(pair))
+                 for pair, delta in game_deltas.items() if any(delta) or pair in best_scores]
+
+    if player_rows:
+        db.session.execute(upsert(PlayerStats.__table__, ['player_id'],
+                                  increment_columns=PLAYER_STATS_COLUMNS), player_rows)
+
+    if game_rows:
+        db.session.execute(upsert(PlayerGameStats.__table__, ['player_id', 'game_id'],
+                                  increment_columns=PLAYER_GAME_STATS_COLUMNS,
+                                  max_columns=['best_score']), game_rows)
+
+    if lost_best_scores:
+        # a removed score may have been the best, which can only be found again from the remaining history
+        db.session.execute(update(PlayerGameStats.__table__)
+                           .where(and_(PlayerGameStats.player_id == bindparam('pair_player_id'),
+                                       PlayerGameStats.game_id == bindparam('pair_game_id')))
+                           .values(best_score=_best_score_of(PlayerGameStats.player_id, PlayerGameStats.game_id)),
+                           [{'pair_player_id': player_id, 'pair_game_id': game_id}
+                            for player_id, game_id in lost_best_scores])
+
+    if game_rows:
+        # a Player that no longer has any Sessions of a Game should not keep it as a favourite
+        for chunk in chunked({row['player_id'] for row in game_rows}, MAX_BIND_PARAMETERS):
+            db.session.execute(delete(PlayerGameStats.__table__)
+                               .where(and_(PlayerGameStats.player_id.in_(chunk),
+                                           PlayerGameStats.games_played <= 0)))
+
+
+def _best_score_of(player_id, game_id):
+    """Builds a subquery for the best score of a Player in a Game across the full history
+    """
+    return select(func.max(SessionPlayers.score)) \
+        .join(Session, SessionPlayers.session_id == Session.id) \
+        .where(and_(SessionPlayers.player_id == player_id, Session.game == game_id)) \
+        .scalar_subquery()
+
+
+def game_stats_query(game_id=None):
+    """Builds a query computing the PlayerGameStats columns from the full history
+
+    :param game_id: If provided, only the statistics of this Game are computed
+    :return A select of player_id, game_id, games_played, wins, total_score, scored_games and best_score
+    :rtype Select
+    """
+    query = select(SessionPlayers.player_id,
+                   Session.game,
+                   func.count(),
+                   func.sum(case((SessionPlayers.winner, 1), else_=0)),
+                   func.coalesce(func.sum(SessionPlayers.score), 0),
+                   func.count(SessionPlayers.score),
+                   func.max(SessionPlayers.score)) \
+        .join(Session, SessionPlayers.session_id == Session.id) \
+        .where(and_(SessionPlayers.player_id.isnot(None), Session.game.isnot(None))) \
+        .group_by(SessionPlayers.player_id, Session.game)
+
+    if game_id is not None:
+        query = query.where(Session.game == game_id)
+
+    return query
+
+
+def rebuild_game(game_id=None):
+    """Recomputes the PlayerGameStats from the SessionPlayers and Sessions in the database, without committing
+
+    :param game_id: If provided, only the statistics of this Game are recomputed
+    """
+    clear = delete(PlayerGameStats.__table__)
+    if game_id is not None:
+        clear = clear.where(PlayerGameStats.game_id == game_id)
+
+    db.session.execute(clear)
+    db.session.execute(insert(PlayerGameStats.__table__).from_select(
+        ['player_id', 'game_id'] + PLAYER_GAME_STATS_COLUMNS + ['best_score'], game_stats_query(game_id)))
+    VersionDB.bump('player_stats')
+
+
+def rebuild():
+    """Recomputes all of the statistics from the SessionPlayers and Sessions in the database
+
+    :return The number of Players that have statistics
+    :rtype int
+    """
+    db.session.execute(delete(PlayerStats.__table__))
+    db.session.execute(insert(PlayerStats.__table__).from_select(
+        ['player_id'] + PLAYER_STATS_COLUMNS,
+        select(SessionPlayers.player_id,
+               func.count(),
+               func.sum(case((SessionPlayers.winner, 1), else_=0)),
+               func.coalesce(func.sum(SessionPlayers.score), 0),
+               func.count(SessionPlayers.score))
+        .join(Session, SessionPlayers.session_id == Session.id)
+        .where(and_(SessionPlayers.player_id.isnot(None), Session.game.isnot(None)))
+        .group_by(SessionPlayers.player_id)))
+
+    rebuild_game()
+    db.session.commit()
+
+    return db.session.execute(select(func.count()).select_from(PlayerStats)).scalar()
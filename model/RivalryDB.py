@@ -0,0 +1,94 @@
+from model.database import db
+from model.models import Session, SessionPlayers
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.orm import aliased
+
+# The maximum number of Players of a head-to-head matrix, which has a cell for every pair of them
+MAX_MATRIX_PLAYERS = 100
+
+RIVALRY_COLUMNS = ['sessions', 'wins', 'losses', 'ties', 'scored_sessions', 'total_score_delta']
+
+
+def _query(player_ids, opponent_ids, game_id=None):
+    """Builds the self-join of SessionPlayers that pairs every Player with each opponent they shared a Session with
+
+    The result has one row per (player, opponent) pair, aggregated over the Sessions they both played on
+    different teams (or without a team)
+    """
+    player = aliased(SessionPlayers)
+    opponent = aliased(SessionPlayers)
+    player_won = func.coalesce(player.winner, False)
+    opponent_won = func.coalesce(opponent.winner, False)
+    score_delta = player.score - opponent.score
+
+    query = select(player.player_id,
+                   opponent.player_id,
+                   func.count(func.distinct(player.session_id)),
+                   func.sum(case((and_(player_won, ~opponent_won), 1), else_=0)),
+                   func.sum(case((and_(opponent_won, ~player_won), 1), else_=0)),
+                   func.sum(case((and_(player_won, opponent_won), 1), else_=0)),
+                   func.count(score_delta),
+                   func.coalesce(func.sum(score_delta), 0)) \
+        .join(opponent, player.session_id == opponent.session_id) \
+        .where(and_(player.player_id.in_(player_ids),
+                    opponent.player_id.in_(opponent_ids),
+                    player.player_id != opponent.player_id,
+                    # teammates played with, not against, each other
+                    or_(player.team.is_(None), opponent.team.is_(None), player.team != opponent.team))) \
+        .group_by(player.player_id, opponent.player_id)
+
+    if game_id is not None:
+        query = query.join(Session, player.session_id == Session.id).where(Session.game == game_id)
+
+    return query
+
+
+def _to_obj(player_id, opponent_id, game_id, values=None):
+    obj = dict(zip(RIVALRY_COLUMNS, values or [0] * len(RIVALRY_COLUMNS)))
+    obj['player_id'] = player_id
+    obj['opponent_id'] = opponent_id
+    obj['game_id'] = game_id
+    obj['average_score_delta'] = obj['total_score_delta'] / obj['scored_sessions'] if obj['scored_sessions'] else None
+    return obj
+
+
+def get(player_id, opponent_id, game_id=None):
+    """Returns the head-to-head record of a Player against an opponent, over the Sessions they both played
+    on different teams (Sessions where they were on the same team are not counted)
+
+    A win is a Session the Player won and the opponent did not, a loss the reverse, and a tie a Session
+    they both won.  Score deltas are the Player's score minus the opponent's,
+    over the Sessions where both have a score
+
+    :param player_id: The id of the Player
+    :param opponent_id: The id of the opponent
+    :param game_id: If provided, only the Sessions of this Game are counted
+    :return A dict holding the player_id, opponent_id, game_id, sessions, wins, losses, ties,
+        scored_sessions, total_score_delta and average_score_delta
+    :rtype dict
+    """
+    row = db.session.execute(_query([player_id], [opponent_id], game_id)).first()
+    return _to_obj(player_id, opponent_id, game_id, row[2:] if row is not None else None)
+
+
+def get_matrix(player_ids, game_id=None):
+    """Returns the head-to-head records of every pair of the specified Players, from a single query
+
+    :param player_ids: The ids of the Players, at most MAX_MATRIX_PLAYERS
+    :param game_id: If provided, only the Sessions of this Game are counted
+    :return A list with a row for each Player, in the requested order, holding a record (see get) against
+        each of the Players in the same order, or None against the Player itself
+    :rtype list
+    :raise ValueError if more than MAX_MATRIX_PLAYERS Players are requested
+    """
+    player_ids = list(dict.fromkeys(player_ids))
+    if len(player_ids) > MAX_MATRIX_PLAYERS:
+        raise ValueError('At most %d players can be compared at once' % MAX_MATRIX_PLAYERS)
+
+    records = {(row[0], row[1]): row[2:]
+               for row in db.session.execute(_query(player_ids, player_ids, game_id))} if player_ids else {}
+
+    return [[_to_obj(player_id, opponent_id, game_id, records.get((player_id, opponent_id)))
+             if player_id != opponent_id else None
+             for opponent_id in player_ids]
+            for player_id in player_ids]
@@ -1,40 +1,195 @@
-from model.database import db
-from model.models import Session
+from model.database import db, chunked, MAX_BIND_PARAMETERS, STREAM_CHUNK_SIZE
+from model.models import Session, SessionPlayers
+import model.ChangeLogDB as ChangeLogDB
+import model.GameDB as GameDB
+import model.PlayerStatsDB as PlayerStatsDB
+import model.SessionPlayersDB as SessionPlayersDB
+import model.VersionDB as VersionDB
+import model.live_scores as live_scores
+from model.types import canonical_id
+from sqlalchemy import and_, or_, select
 from uuid import uuid4
 from datetime import date
 
+# The fields of the dicts returned by the row functions, matching Session.to_obj()
+FIELDS = ('id', 'date', 'game_id')
 
-def get_all():
-    """Returns all of the Session objects in the database
+# The related resources the row functions can embed, and the ones embedded by default (as in Session.to_obj())
+INCLUDES = ('players', 'game')
+DEFAULT_INCLUDE = ('players',)
 
-    :return A list of Session objects
-    :rtype list
+
+def _filter(statement, date_from=None, date_to=None, game_id=None, player_id=None, descending=False):
+    """Applies the provided filters to a query or select of Sessions, ordering it by date and then id
+
+    Each filter is pushed down to SQL and served by an index: date ranges by the (date, id) index,
+    games by the (game, date) index and players by the player_id index of session-players
+
+    :param statement: The ORM query or Core select of Sessions to filter
+    :param date_from: If provided, only Sessions on or after this date are included
+    :param date_to: If provided, only Sessions on or before this date are included
+    :param game_id: If provided, only Sessions of this Game are included
+    :param player_id: If provided, only Sessions this Player took part in are included
+    :param descending: Whether to order the Sessions newest first
+    :return The filtered and ordered statement
     """
-    return Session.query.all()
+    if date_from is not None:
+        statement = statement.filter(Session.date >= date_from)
 
+    if date_to is not None:
+        statement = statement.filter(Session.date <= date_to)
 
-def get(session_id):
-    """Returns the Session object specified by the provided id
+    if game_id is not None:
+        statement = statement.filter(Session.game == game_id)
 
-    :param session_id: The id of the Session to retrieve, nominally a uuid
-    :return A single Session object
-    :rtype Session
+    if player_id is not None:
+        statement = statement.filter(Session.id.in_(select(SessionPlayers.session_id)
+                                                    .where(SessionPlayers.player_id == player_id)))
+
+    if descending:
+        return statement.order_by(Session.date.desc(), Session.id.desc())
+
+    return statement.order_by(Session.date, Session.id)
+
+
+def _after(statement, after, descending=False):
+    """Restricts an ordered query or select of Sessions to those that come after the (date, id) key
+    """
+    if after is None:
+        return statement
+
+    after_date, after_id = after
+    if descending:
+        return statement.filter(or_(Session.date < after_date,
+                                    and_(Session.date == after_date, Session.id < after_id)))
+
+    return statement.filter(or_(Session.date > after_date,
+                                and_(Session.date == after_date, Session.id > after_id)))
+
+
+def _to_rows(sessions, fields=FIELDS, include=DEFAULT_INCLUDE):
+    """Converts (id, date[, game]) tuples into dicts holding the requested fields of each Session, in the
+    format of Session.to_obj(), along with the requested related resources.  The players of all of them
+    are loaded with one IN query (the same query the players relationship is loaded with), and their
+    Games with GameDB.get_many
+    """
+    if 'players' in include:
+        players = {session[0]: [] for session in sessions}
+        columns = [SessionPlayers.__table__.c[key] for key in SessionPlayersDB.ROW_KEYS]
+        for chunk in chunked(list(players), MAX_BIND_PARAMETERS):
+            for row in db.session.execute(select(*columns).where(SessionPlayers.session_id.in_(chunk))):
+                players[row[1]].append(live_scores.apply(row[0], dict(zip(SessionPlayersDB.ROW_KEYS, row))))
+
+    if 'game' in include:
+        games = {game.id: game.to_obj() for game in GameDB.get_many({session[2] for session in sessions} - {None})[0]}
+
+    rows = []
+    for session in sessions:
+        row = {'id': session[0], 'date': session[1], 'game_id': session[2] if len(session) > 2 else None}
+        if fields != FIELDS:
+            row = {field: row[field] for field in fields}
+        if 'players' in include:
+            row['players'] = players[session[0]]
+        if 'game' in include:
+            row['game'] = games.get(session[2])
+        rows.append(row)
+
+    return rows
+
+
+def _select_rows(fields=FIELDS, include=DEFAULT_INCLUDE, **filters):
+    """Builds a select of the columns of the Sessions matching the provided filters that the requested fields
+    and related resources need, as (id, date[, game]) tuples
+    """
+    # the id and date are always selected, as they key the players and the pages
+    columns = [Session.id, Session.date]
+    if 'game_id' in fields or 'game' in include:
+        columns.append(Session.game)
+
+    return _filter(select(*columns), **filters)
+
+
+def iter_rows(chunk_size=STREAM_CHUNK_SIZE, fields=FIELDS, include=DEFAULT_INCLUDE, **filters):
+    """Iterates over the Sessions that match the provided filters as plain dicts, in the same order and
+    format as get_all() and to_obj(), without creating any model objects
+
+    Use this for read only lists and exports, where hydrating model objects would cost more than the query.
+    Only the columns and related resources that were asked for are read
+
+    :param chunk_size: The number of rows to fetch from the database at a time
+    :param fields: The fields to return, a subset of FIELDS
+    :param include: The related resources to embed, a subset of INCLUDES
+    :param filters: The filters to apply, as accepted by _filter
+    :return An iterator of dicts
+    :rtype iterator
+    """
+    result = db.session.execute(_select_rows(fields, include, **filters).execution_options(yield_per=chunk_size))
+    for sessions in result.partitions():
+        yield from _to_rows(sessions, fields, include)
+
+
+def get_page_rows(limit, after=None, fields=FIELDS, include=DEFAULT_INCLUDE, **filters):
+    """Returns a page of the Sessions that match the provided filters as plain dicts, ordered by date and then id
+
+    Uses keyset pagination, so the cost of a page does not depend on how deep into the list it is
+
+    :param limit: The maximum number of Sessions to return
+    :param after: If provided, a (date, id) tuple of the last Session of the previous page
+    :param fields: The fields to return, a subset of FIELDS
+    :param include: The related resources to embed, a subset of INCLUDES
+    :param filters: The filters to apply, as accepted by _filter
+    :return A tuple of the list of dicts and the (date, id) key to pass as after for the next page,
+        which is None if this was the last page
+    :rtype tuple
+    """
+    sessions = db.session.execute(_after(_select_rows(fields, include, **filters), after, filters.get('descending'))
+                                  .limit(limit + 1)).all()
+
+    if len(sessions) <= limit:
+        return _to_rows(sessions, fields, include), None
+
+    last = sessions[limit - 1]
+    return _to_rows(sessions[:limit], fields, include), (last[1], last[0])
+
+
+def get_many_rows(session_ids, fields=FIELDS, include=DEFAULT_INCLUDE):
+    """Returns the Sessions specified by the provided ids as plain dicts, see iter_rows
+
+    The Sessions are fetched with IN queries of at most MAX_BIND_PARAMETERS ids each
+
+    :param session_ids: A list of the ids of the Sessions to retrieve
+    :param fields: The fields to return, a subset of FIELDS
+    :param include: The related resources to embed, a subset of INCLUDES
+    :return A tuple of the list of dicts in the requested order (without duplicates),
+        and the list of requested ids that could not be found
+    :rtype tuple
     """
-    return Session.query.filter_by(id=session_id).first()
+    session_ids = list(dict.fromkeys(session_ids))
+
+    rows = {}
+    for chunk in chunked(session_ids, MAX_BIND_PARAMETERS):
+        sessions = db.session.execute(_select_rows(fields, include).where(Session.id.in_(chunk))).all()
+        rows.update(zip([session[0] for session in sessions], _to_rows(sessions, fields, include)))
 
+    return [rows[session_id] for session_id in session_ids if session_id in rows], \
+        [session_id for session_id in session_ids if session_id not in rows]
 
-def create(sess_date, game_id, session_id=None):
+
+def create(sess_date, game_id, session_id=None, commit=True):
     """Creates a Session given the provided values
 
     :param sess_date: The date of the session
     :param game_id: The id of the game the session belongs to
     :param session_id: The id to assign to the Session.  If not provided, a uuid will be generated
+    :param commit: Whether to commit the new Session.  Pass False to write it in the same
+        transaction as its players
     :return The created Session object
     :rtype: Session
+    :raise InvalidIdError if the provided id or game_id is not a UUID
     """
 
-    if session_id is None:
-        session_id = str(uuid4())
+    session_id = str(uuid4()) if session_id is None else canonical_id(session_id)
+    game_id = canonical_id(game_id, 'game_id')
 
     date_parts = [int(x) for x in sess_date.split('-')]
     # TODO: should probably eventually add some validation here
@@ -42,7 +197,10 @@ def create(sess_date, game_id, session_id=None):
     new_session = Session(id=session_id, date=date_obj, game=game_id)
 
     db.session.add(new_session)
-    db.session.commit()
+    ChangeLogDB.record('session', ChangeLogDB.CREATE, [session_id])
+    VersionDB.bump('session')
+    if commit:
+        db.session.commit()
 
     return new_session
 
@@ -56,21 +214,31 @@ def update(session_id, sess_date=None, game_id=None):
     :return The updated Session object
     :rtype Session
     :raise ValueError if the Session could not be found
+    :raise InvalidIdError if the provided game_id is not a UUID
     """
     session_to_update = Session.query.filter_by(id=session_id).first()
 
     if session_to_update is None:
         raise ValueError("Could not find Session with id")
 
-    if date is not None:
+    if game_id is not None:
+        game_id = canonical_id(game_id, 'game_id')
+
+    if sess_date is not None:
         date_parts = [int(x) for x in sess_date.split('-')]
         # TODO: should probably eventually add some validation here
         date_obj = date(date_parts[0], date_parts[1], date_parts[2])
         session_to_update.date = date_obj
 
-    if game_id is not None:
-        session_to_update.game_id = game_id
+    if game_id is not None and game_id != session_to_update.game:
+        # move the player statistics of this Session over to the new game
+        previous = [PlayerStatsDB.snapshot(player, session_to_update.game) for player in session_to_update.players]
+        session_to_update.game = game_id
+        PlayerStatsDB.apply(removed=previous,
+                            added=[PlayerStatsDB.snapshot(player, game_id) for player in session_to_update.players])
 
+    ChangeLogDB.record('session', ChangeLogDB.UPDATE, [session_to_update.id])
+    VersionDB.bump('session')
     db.session.commit()
 
     return session_to_update
@@ -89,7 +257,15 @@ def delete(session_id):
     if session_to_delete is None:
         raise ValueError("Could not find Session with id")
 
+    # players of a deleted Session no longer count towards the player statistics
+    previous = [PlayerStatsDB.snapshot(player, session_to_delete.game) for player in session_to_delete.players]
+    detached = [player.id for player in session_to_delete.players]
     db.session.delete(session_to_delete)
+    PlayerStatsDB.apply(removed=previous)
+    # deleting the Session also detaches its players from it
+    ChangeLogDB.record('session', ChangeLogDB.DELETE, [session_id])
+    ChangeLogDB.record('session-players', ChangeLogDB.UPDATE, detached)
+    VersionDB.bump('session', 'session-players')
     db.session.commit()
 
     return True
@@ -1,25 +1,139 @@
-from model.database import db
-from model.models import SessionPlayers
+from model.database import db, chunked, upsert, MAX_BIND_PARAMETERS, STREAM_CHUNK_SIZE
+from model.models import Session, SessionPlayers
+import model.ChangeLogDB as ChangeLogDB
+import model.PlayerStatsDB as PlayerStatsDB
+import model.live_scores as live_scores
+import model.VersionDB as VersionDB
+from model.types import canonical_id
+from sqlalchemy import and_, or_, select
 from uuid import uuid4
+import logging
+import time
 
+logger = logging.getLogger('bgt-backend.session-players')
 
-def get_all():
-    """Returns all of the SessionPlayers objects in the database
+# The columns overwritten when merging a SessionPlayers that already exists
+MERGE_COLUMNS = ['session_id', 'player_id', 'score', 'team', 'winner', 'updated_at']
 
-    :return A list of SessionPlayers objects
-    :rtype list
+# The keys of the dicts returned by the row functions, matching SessionPlayers.to_obj()
+ROW_KEYS = ('id', 'session_id', 'player_id', 'score', 'team', 'winner')
+
+# The number of SessionPlayers written by each statement of merge_all
+MERGE_BATCH_SIZE = MAX_BIND_PARAMETERS // (len(MERGE_COLUMNS) + 1)
+
+
+def _columns(fields):
+    # the id is always selected last, whether or not it was asked for, to apply any pending live scores
+    return [SessionPlayers.__table__.c[key] for key in fields] + [SessionPlayers.id]
+
+
+def _to_row(row, fields):
+    return live_scores.apply(row[-1], dict(zip(fields, row)))
+
+
+def iter_rows(chunk_size=STREAM_CHUNK_SIZE, fields=ROW_KEYS):
+    """Iterates over all of the SessionPlayers as plain dicts, in the format of to_obj(), without creating
+    any model objects
+
+    Use this for read only lists and exports, where hydrating model objects would cost more than the query.
+    Only the columns of the requested fields are read.  Pending live scores are included (see model/live_scores.py)
+
+    :param chunk_size: The number of rows to fetch from the database at a time
+    :param fields: The fields to return, a subset of ROW_KEYS
+    :return An iterator of dicts
+    :rtype iterator
+    """
+    result = db.session.execute(select(*_columns(fields)).execution_options(yield_per=chunk_size))
+    return (_to_row(row, fields) for row in result)
+
+
+def _without_date():
+    # the SessionPlayers that have no Session (see SessionDB.delete), or whose Session has no date
+    return or_(SessionPlayers.session_id.is_(None),
+               SessionPlayers.session_id.in_(select(Session.id).where(Session.date.is_(None))))
+
+
+def get_page_rows(limit, after=None, fields=ROW_KEYS):
+    """Returns a page of the SessionPlayers as plain dicts, ordered by the date of their Session and then id
+
+    Uses keyset pagination, so the cost of a page does not depend on how deep into the list it is.
+    The SessionPlayers without a date, because they have no Session or their Session has none, come first
+
+    :param limit: The maximum number of SessionPlayers to return
+    :param after: If provided, a (date, id) tuple of the last SessionPlayers of the previous page,
+        where the date is None if that SessionPlayers had no date
+    :param fields: The fields to return, a subset of ROW_KEYS
+    :return A tuple of the list of dicts and the (date, id) key to pass as after for the next page,
+        which is None if this was the last page
+    :rtype tuple
     """
-    return SessionPlayers.query.all()
+    # each row is paired with the date of its key, the id being selected last by _columns
+    rows = []
+    if after is None or after[0] is None:
+        statement = select(*_columns(fields)).where(_without_date()).order_by(SessionPlayers.id)
+        if after is not None:
+            statement = statement.where(SessionPlayers.id > after[1])
+
+        rows = [(row, None) for row in db.session.execute(statement.limit(limit + 1))]
+        after = None
+
+    if len(rows) <= limit:
+        statement = select(*_columns(fields), Session.date) \
+            .join(Session, SessionPlayers.session_id == Session.id) \
+            .order_by(Session.date, SessionPlayers.id)
+
+        if after is None:
+            statement = statement.where(Session.date.is_not(None))
+        else:
+            after_date, after_id = after
+            statement = statement.where(or_(Session.date > after_date,
+                                            and_(Session.date == after_date, SessionPlayers.id > after_id)))
+
+        rows += [(row[:-1], row[-1]) for row in db.session.execute(statement.limit(limit + 1 - len(rows)))]
 
+    session_players = [_to_row(row, fields) for row, _ in rows[:limit]]
 
-def get(session_players_id):
-    """Returns the SessionPlayers object specified by the provided id
+    if len(rows) <= limit:
+        return session_players, None
+
+    row, row_date = rows[limit - 1]
+    return session_players, (row_date, row[-1])
+
+
+def get_row(session_players_id, fields=ROW_KEYS):
+    """Returns the SessionPlayers specified by the provided id as a plain dict, see iter_rows
 
     :param session_players_id: The id of the SessionPlayers to retrieve, nominally a uuid
-    :return A single SessionPlayers object
-    :rtype SessionPlayers
+    :param fields: The fields to return, a subset of ROW_KEYS
+    :return The dict, or None if no SessionPlayers has the id
+    :rtype dict
+    """
+    row = db.session.execute(select(*_columns(fields)).where(SessionPlayers.id == session_players_id)).first()
+    return _to_row(row, fields) if row is not None else None
+
+
+def get_many_rows(session_players_ids, fields=ROW_KEYS):
+    """Returns the SessionPlayers specified by the provided ids as plain dicts, see iter_rows
+
+    :param session_players_ids: A list of the ids of the SessionPlayers to retrieve
+    :param fields: The fields to return, a subset of ROW_KEYS
+    :return A tuple of the list of dicts in the requested order (without duplicates),
+        and the list of requested ids that could not be found
+    :rtype tuple
     """
-    return SessionPlayers.query.filter_by(id=session_players_id).first()
+    session_players_ids = list(dict.fromkeys(session_players_ids))
+
+    rows = {}
+    for chunk in chunked(session_players_ids, MAX_BIND_PARAMETERS):
+        rows.update((row[-1], _to_row(row, fields))
+                    for row in db.session.execute(select(*_columns(fields)).where(SessionPlayers.id.in_(chunk))))
+
+    return [rows[session_players_id] for session_players_id in session_players_ids if session_players_id in rows], \
+        [session_players_id for session_players_id in session_players_ids if session_players_id not in rows]
+
+
+def _new_id(session_players_id):
+    return str(uuid4()) if not session_players_id else canonical_id(session_players_id)
 
 
 def create(session_id, player_id, score, team, winner, session_players_id=None):
@@ -33,19 +147,20 @@ def create(session_id, player_id, score, team, winner, session_players_id=None):
     :param session_players_id: The id to assign to the SessionPlayers.  If not provided, a uuid will be generated
     :return The created SessionPlayers object
     :rtype: SessionPlayers
+    :raise InvalidIdError if any of the provided ids is not a UUID
     """
 
-    if session_players_id is None:
-        session_players_id = str(uuid4())
-
-    new_session_players = SessionPlayers(id=session_players_id,
-                                         session_id=session_id,
-                                         player_id=player_id,
+    new_session_players = SessionPlayers(id=_new_id(session_players_id),
+                                         session_id=canonical_id(session_id, 'session_id'),
+                                         player_id=canonical_id(player_id, 'player_id'),
                                          score=score,
                                          team=team,
                                          winner=winner)
 
     db.session.add(new_session_players)
+    PlayerStatsDB.apply(added=[PlayerStatsDB.snapshot(new_session_players)])
+    ChangeLogDB.record('session-players', ChangeLogDB.CREATE, [new_session_players.id])
+    VersionDB.bump('session-players')
     db.session.commit()
 
     return new_session_players
@@ -63,17 +178,20 @@ def update(session_players_id, session_id=None, player_id=None, score=None, team
     :return The updated SessionPlayers object
     :rtype SessionPlayers
     :raise ValueError if the SessionPlayers could not be found
+    :raise InvalidIdError if the provided session_id or player_id is not a UUID
     """
     session_players_to_update = SessionPlayers.query.filter_by(id=session_players_id).first()
 
     if session_players_to_update is None:
         raise ValueError("Could not find SessionPlayers with id")
 
+    previous = PlayerStatsDB.snapshot(session_players_to_update)
+
     if session_id is not None:
-        session_players_to_update.session_id = session_id
+        session_players_to_update.session_id = canonical_id(session_id, 'session_id')
 
     if player_id is not None:
-        session_players_to_update.player_id = player_id
+        session_players_to_update.player_id = canonical_id(player_id, 'player_id')
 
     if score is not None:
         session_players_to_update.score = score
@@ -84,6 +202,11 @@ def update(session_players_id, session_id=None, player_id=None, score=None, team
     if winner is not None:
         session_players_to_update.winner = winner
 
+    session_players_to_update.updated_at = time.time()
+
+    PlayerStatsDB.apply(removed=[previous], added=[PlayerStatsDB.snapshot(session_players_to_update)])
+    ChangeLogDB.record('session-players', ChangeLogDB.UPDATE, [session_players_to_update.id])
+    VersionDB.bump('session-players')
     db.session.commit()
 
     return session_players_to_update
@@ -100,49 +223,101 @@ def merge(session_id, player_id, score, team, winner, session_players_id=None):
     :param session_players_id: The id to assign to the SessionPlayers.  If not provided, a uuid will be generated
     :return The created SessionPlayers object
     :rtype: SessionPlayers
+    :raise InvalidIdError if any of the provided ids is not a UUID
     """
 
-    if session_players_id is None:
-        session_players_id = str(uuid4())
+    session_players_id = _new_id(session_players_id)
 
     new_session_players = SessionPlayers(id=session_players_id,
-                                         session_id=session_id,
-                                         player_id=player_id,
+                                         session_id=canonical_id(session_id, 'session_id'),
+                                         player_id=canonical_id(player_id, 'player_id'),
                                          score=score,
                                          team=team,
-                                         winner=winner)
+                                         winner=winner,
+                                         updated_at=time.time())
+
+    existing = db.session.get(SessionPlayers, session_players_id)
+    previous = [PlayerStatsDB.snapshot(existing)] if existing is not None else []
 
     db.session.merge(new_session_players)
+    PlayerStatsDB.apply(removed=previous, added=[PlayerStatsDB.snapshot(new_session_players)])
+    ChangeLogDB.record('session-players', ChangeLogDB.UPDATE if existing is not None else ChangeLogDB.CREATE,
+                       [session_players_id])
+    VersionDB.bump('session-players')
     db.session.commit()
 
     return new_session_players
 
 
-def merge_all(session_id, session_player_list):
+def merge_all(session_id, session_player_list, commit=True):
     """Creates or updates all of the SessionPlayers in the provided list
 
+    All of the SessionPlayers are written with a single INSERT ... ON CONFLICT DO UPDATE statement
+    per batch of MERGE_BATCH_SIZE rows, inside one transaction, so either all of them are saved or none are
+
     :param session_id: The id of the session to add the session players to
-    :param session_player_list: A list of session player entries to be merged
+    :param session_player_list: A list of session player entries (dicts holding "player_id", "score",
+        "team", "winner" and optionally "id") to be merged
+    :param commit: Whether to commit the transaction once all of the session players are written
     :return a list of all of the added/modified session players
     :raise ValueError if a required value is not provided
+    :raise InvalidIdError if any of the provided ids is not a UUID
     """
 
     if session_player_list is None:
         raise ValueError("session_list is required")
 
-    print('length of array was %d' % len(session_player_list))
+    session_id = canonical_id(session_id, 'session_id')
 
-    return_values = []
+    logger.debug('Merging %d players into session %s', len(session_player_list), session_id)
 
+    rows = {}
+    now = time.time()
     for session_player in session_player_list:
-        return_values.append(merge(session_id,
-                                   session_player.player_id,
-                                   session_player.score,
-                                   session_player.team,
-                                   session_player.winner,
-                                   session_player.id))
-
-    return return_values
+        if 'player_id' not in session_player:
+            raise ValueError("player_id is required")
+
+        session_players_id = _new_id(session_player.get('id'))
+        rows[session_players_id] = {'id': session_players_id,
+                                    'session_id': session_id,
+                                    'player_id': canonical_id(session_player['player_id'], 'player_id'),
+                                    'score': session_player.get('score'),
+                                    'team': session_player.get('team'),
+                                    'winner': session_player.get('winner'),
+                                    'updated_at': now}
+
+    try:
+        # make sure the Session the players belong to has been written first
+        db.session.flush()
+
+        statement = upsert(SessionPlayers.__table__, ['id'], MERGE_COLUMNS)
+        for batch in chunked(rows.values(), MERGE_BATCH_SIZE):
+            existing = db.session.execute(select(SessionPlayers.id,
+                                                 SessionPlayers.session_id,
+                                                 SessionPlayers.player_id,
+                                                 SessionPlayers.score,
+                                                 SessionPlayers.winner)
+                                          .where(SessionPlayers.id.in_([row['id'] for row in batch]))).all()
+
+            db.session.execute(statement.values(batch))
+            PlayerStatsDB.apply(removed=[PlayerStatsDB.snapshot(row._asdict()) for row in existing],
+                                added=[PlayerStatsDB.snapshot(row) for row in batch])
+
+            updated = {row.id for row in existing}
+            ChangeLogDB.record('session-players', ChangeLogDB.UPDATE,
+                               [row['id'] for row in batch if row['id'] in updated])
+            ChangeLogDB.record('session-players', ChangeLogDB.CREATE,
+                               [row['id'] for row in batch if row['id'] not in updated])
+
+        VersionDB.bump('session-players')
+
+        if commit:
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return [SessionPlayers(**row) for row in rows.values()]
 
 
 def delete(session_players_id):
@@ -158,7 +333,11 @@ def delete(session_players_id):
     if session_players_to_delete is None:
         raise ValueError("Could not find SessionPlayers with id")
 
+    previous = PlayerStatsDB.snapshot(session_players_to_delete)
     db.session.delete(session_players_to_delete)
+    PlayerStatsDB.apply(removed=[previous])
+    ChangeLogDB.record('session-players', ChangeLogDB.DELETE, [session_players_to_delete.id])
+    VersionDB.bump('session-players')
     db.session.commit()
 
     return True
@@ -0,0 +1,28 @@
+from model.database import db, upsert
+from model.models import TableVersion
+from sqlalchemy import select
+
+
+def bump(*names):
+    """Increments the version of each of the named tables, without committing
+
+    Call this in the same transaction as the change to the tables, so the new version becomes
+    visible exactly when the change does
+
+    :param names: The names of the tables that were changed
+    """
+    db.session.execute(upsert(TableVersion.__table__, ['name'], increment_columns=['version']),
+                       [{'name': name, 'version': 1} for name in names])
+
+
+def get(*names):
+    """Returns the current versions of the named tables
+
+    :param names: The names of the tables to return the version of
+    :return A dict of table name to version, where a table that has never changed is at version 0
+    :rtype dict
+    """
+    versions = dict(db.session.execute(select(TableVersion.name, TableVersion.version)
+                                       .where(TableVersion.name.in_(names))).all())
+
+    return {name: versions.get(name, 0) for name in names}
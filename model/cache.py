@@ -0,0 +1,208 @@
+from collections import OrderedDict
+from flask import current_app, g, has_app_context, has_request_context
+from threading import Lock
+import model.VersionDB as VersionDB
+import time
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 300
+DEFAULT_CHECK_INTERVAL = 100
+
+# Every cache created, by table name, so their counters can be reported
+caches = {}
+
+# When the versions of the tables of every cache were last checked, see _check_versions()
+_checked = {'at': None}
+_checked_lock = Lock()
+
+# The key under which the full list of rows of a table is cached
+ALL_ROWS = ('all',)
+
+
+class TableCache:
+    """A bounded, expiring LRU cache of the rows of a single table
+
+    Entries are dropped when the table's version in table_version changes, which happens whenever any
+    process writes to the table.  The versions of the tables of every cache are checked together, with
+    one query, at most once per request and once every BGT_CACHE_CHECK_INTERVAL milliseconds, so a write
+    made by another process is seen at most that long after it commits.  A write made by this process
+    drops the entries straight away, see invalidate()
+
+    The size and time to live are read from the BGT_CACHE_SIZE and BGT_CACHE_TTL (seconds) app config
+    the first time the cache is used.  A size of 0 disables the cache
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.max_size = None
+        self.ttl = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._generation = None
+        # incremented whenever the entries are dropped, so a value loaded before then is not stored after
+        self._epoch = 0
+        self._lock = Lock()
+        caches[table] = self
+
+    def _configure(self):
+        config = current_app.config if has_app_context() else {}
+        self.max_size = int(config.get('BGT_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+        self.ttl = float(config.get('BGT_CACHE_TTL', DEFAULT_CACHE_TTL))
+
+    def _set_generation(self, generation):
+        """Drops every entry if the table has been changed by any process since the last check
+        """
+        with self._lock:
+            if generation != self._generation:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._epoch += 1
+                self._generation = generation
+
+    def get(self, key, load):
+        """Returns the cached value for the key, calling load() to fetch and cache it on a miss
+
+        :param key: The key of the value
+        :param load: A function taking no arguments that returns the value from the database.
+            A returned value of None is not cached
+        :return The value
+        """
+        if self.max_size is None:
+            self._configure()
+
+        if self.max_size <= 0:
+            return load()
+
+        _check_versions()
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            epoch = self._epoch
+
+        value = load()
+        if value is None:
+            return value
+
+        with self._lock:
+            if self._epoch != epoch:
+                # the table changed while the value was loaded, so it may already be stale
+                return value
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return value
+
+    def get_many(self, keys, load_many):
+        """Returns the cached values for the keys, calling load_many() once to fetch and cache all of the misses
+
+        :param keys: The keys of the values
+        :param load_many: A function taking a list of the missing keys that returns a dict of key to value
+            for the ones that exist in the database
+        :return A dict of key to value for the keys that were found
+        :rtype dict
+        """
+        if self.max_size is None:
+            self._configure()
+
+        if self.max_size <= 0:
+            return load_many(list(keys))
+
+        _check_versions()
+
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    found[key] = entry[1]
+                else:
+                    self.misses += 1
+                    missing.append(key)
+            epoch = self._epoch
+
+        if not missing:
+            return found
+
+        loaded = load_many(missing)
+        found.update(loaded)
+
+        with self._lock:
+            if self._epoch != epoch:
+                # the table changed while the values were loaded, so they may already be stale
+                return found
+            for key, value in loaded.items():
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return found
+
+    def invalidate(self):
+        """Drops every entry, and forces the table version to be checked again on the next lookup
+
+        Call this after committing a change to the table
+        """
+        with self._lock:
+            self.invalidations += 1
+            self._entries.clear()
+            self._epoch += 1
+            self._generation = None
+        _checked['at'] = None
+
+    def stats(self):
+        """Returns the counters of the cache
+
+        :return A dict holding the size, limits and hit, miss, eviction and invalidation counts
+        :rtype dict
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+def _check_versions():
+    """Checks the versions of the tables of every cache, at most once per request and once every
+    BGT_CACHE_CHECK_INTERVAL milliseconds, dropping the entries of the tables that changed
+    """
+    if has_request_context():
+        if g.get('_bgt_cache_checked'):
+            return
+        g._bgt_cache_checked = True
+
+    interval = current_app.config.get('BGT_CACHE_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL) / 1000 \
+        if has_app_context() else 0
+    now = time.monotonic()
+    with _checked_lock:
+        if _checked['at'] is not None and now - _checked['at'] < interval:
+            return
+        _checked['at'] = now
+
+    for table, generation in VersionDB.get(*caches).items():
+        caches[table]._set_generation(generation)
@@ -1,2 +1,62 @@
 from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy()
\ No newline at end of file
+from sqlalchemy import case, or_
+from sqlalchemy.dialects import postgresql, sqlite
+db = SQLAlchemy()
+
+# The number of rows fetched at a time when streaming a whole table
+STREAM_CHUNK_SIZE = 500
+
+# The number of bound parameters allowed in a single statement, kept below SQLite's default limit of 999
+MAX_BIND_PARAMETERS = 900
+
+
+def chunked(values, size):
+    """Splits the provided values into lists of at most size entries
+
+    :param values: An iterable of values to split
+    :param size: The maximum number of values in each chunk
+    :return An iterator of lists of values
+    :rtype iterator
+    """
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def upsert(table, key_columns, update_columns=(), increment_columns=(), max_columns=()):
+    """Builds an INSERT ... ON CONFLICT DO UPDATE statement for the current database
+
+    :param table: The Table to insert into
+    :param key_columns: The names of the columns of the unique key that decides whether a row already exists
+    :param update_columns: The names of the columns to overwrite with the inserted values when a row already exists
+    :param increment_columns: The names of the columns to add the inserted values to when a row already exists
+    :param max_columns: The names of the columns to keep the greater of the existing and inserted values in
+        when a row already exists
+    :return The insert statement, to be given its values when executed
+    :raise NotImplementedError if the database does not support upserts
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        statement = sqlite.insert(table)
+    elif dialect == 'postgresql':
+        statement = postgresql.insert(table)
+    else:
+        raise NotImplementedError("Upserts are not supported on %s" % dialect)
+
+    if not update_columns and not increment_columns and not max_columns:
+        return statement.on_conflict_do_nothing(index_elements=key_columns)
+
+    set_ = {column: statement.excluded[column] for column in update_columns}
+    set_.update({column: table.c[column] + statement.excluded[column] for column in increment_columns})
+    set_.update({column: case((or_(table.c[column].is_(None), statement.excluded[column] > table.c[column]),
+                               statement.excluded[column]),
+                              else_=table.c[column])
+                 for column in max_columns})
+
+    return statement.on_conflict_do_update(index_elements=key_columns, set_=set_)
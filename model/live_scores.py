@@ -0,0 +1,302 @@
+from model.database import db, chunked, MAX_BIND_PARAMETERS
+from model.models import SessionPlayers
+import model.ChangeLogDB as ChangeLogDB
+import model.PlayerStatsDB as PlayerStatsDB
+import model.VersionDB as VersionDB
+from flask import current_app
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.exc import OperationalError
+from hashlib import sha1
+from threading import Event, Lock, Thread
+import atexit
+import logging
+import os
+import time
+
+logger = logging.getLogger('bgt-backend.live-scores')
+
+# The SessionPlayers columns that live score updates can change
+FIELDS = ('score', 'team', 'winner')
+
+DEFAULT_FLUSH_INTERVAL = 250
+DEFAULT_FLUSH_SIZE = 500
+
+# The pending values of each SessionPlayers, by id, and those of the batch being written.  Each field
+# maps to a tuple of the value it had when it was first queued, when it was last queued and the value to write
+_pending = {}
+_in_flight = {}
+
+# The state of this process: the app to flush with, the pid that started the flush thread, and the number
+# of updates since the last flush
+_state = {'app': None, 'pid': None, 'updates': 0}
+
+_lock = Lock()
+_flush_lock = Lock()
+_wake = Event()
+
+
+def is_enabled():
+    """Returns whether live scoring is enabled for the current app (BGT_LIVE_SCORING)
+
+    :rtype bool
+    """
+    return bool(current_app.config.get('BGT_LIVE_SCORING'))
+
+
+def fingerprint():
+    """Returns a digest of the queued values of this process, for use in ETags, as the table versions only
+    change once the values are written
+
+    :return None if nothing is queued, so every process agrees on the ETag of the same rows
+    :rtype str
+    """
+    if not _pending and not _in_flight:
+        return None
+
+    with _lock:
+        queued = [sorted((session_players_id, sorted(values.items())) for session_players_id, values in queue.items())
+                  for queue in (_in_flight, _pending)]
+
+    return sha1(repr(queued).encode('utf-8')).hexdigest()
+
+
+def validate(values):
+    """Checks the values of a live score update, which are only written later, against the types of their columns
+
+    :param values: A dict holding the new value of any of FIELDS
+    :return The values, with a winner of 0 or 1 made a boolean
+    :rtype dict
+    :raise ValueError if a value does not fit its column
+    """
+    values = dict(values)
+
+    for field in ('score', 'team'):
+        if values.get(field) is not None and (isinstance(values[field], bool) or not isinstance(values[field], int)):
+            raise ValueError('%s must be an integer' % field)
+
+    if values.get('winner') is not None:
+        if values['winner'] not in (True, False):
+            raise ValueError('winner must be true or false')
+        values['winner'] = bool(values['winner'])
+
+    return values
+
+
+def enqueue(session_players_id, values, current):
+    """Queues a live score update of a SessionPlayers, to be written by the next flush
+
+    Updates of the same SessionPlayers are coalesced, keeping the latest value of each field.  The queue
+    is flushed every BGT_LIVE_SCORING_INTERVAL milliseconds, as soon as BGT_LIVE_SCORING_BATCH updates are
+    waiting, and when the process exits.
+
+    The latest update wins, even when updates of the same SessionPlayers are queued by different processes:
+    a queued value is written unless its field has been changed since it was queued by an update made after
+    it (see SessionPlayers.updated_at), e.g. a live score queued and written by another worker
+
+    :param session_players_id: The canonical id of an existing SessionPlayers
+    :param values: A dict holding the new value of any of FIELDS, see validate()
+    :param current: The SessionPlayers as it is now, as returned by SessionPlayersDB.get_row()
+    :return The values as they will be written, see validate()
+    :rtype dict
+    :raise ValueError if a value does not fit its column
+    """
+    values = validate(values)
+
+    _ensure_flush_thread()
+
+    now = time.time()
+    with _lock:
+        queued = _pending.setdefault(session_players_id, {})
+        for field, value in values.items():
+            # a field queued (or being written) already keeps the value it had when it was first queued
+            base = queued.get(field) or _in_flight.get(session_players_id, {}).get(field)
+            queued[field] = (base[0] if base is not None else current[field], now, value)
+        _state['updates'] += 1
+        if _state['updates'] >= _state['app'].config.get('BGT_LIVE_SCORING_BATCH', DEFAULT_FLUSH_SIZE):
+            _wake.set()
+
+    return values
+
+
+def apply(session_players_id, row):
+    """Applies the pending live score updates of a SessionPlayers to a row read from the database,
+    so a client reads its own writes before they are flushed
+
+    :param session_players_id: The id of the SessionPlayers
+    :param row: A dict holding any of the fields of the SessionPlayers, which is updated in place
+    :return The row
+    :rtype dict
+    """
+    if not _pending and not _in_flight:
+        return row
+
+    with _lock:
+        for values in (_in_flight.get(session_players_id), _pending.get(session_players_id)):
+            for field, (_, _, value) in values.items() if values is not None else ():
+                if field in row:
+                    row[field] = value
+
+    return row
+
+
+def _write(batch):
+    """Writes a batch of coalesced updates, and the statistics they change, in one transaction
+
+    :return The number of SessionPlayers written
+    """
+    columns = [SessionPlayers.id, SessionPlayers.session_id, SessionPlayers.player_id,
+               SessionPlayers.score, SessionPlayers.team, SessionPlayers.winner, SessionPlayers.updated_at]
+    statement = update(SessionPlayers.__table__) \
+        .where(SessionPlayers.id == bindparam('row_id')) \
+        .values(dict({field: bindparam('new_' + field) for field in FIELDS}, updated_at=bindparam('new_updated_at')))
+
+    written = 0
+    for chunk in chunked(list(batch), MAX_BIND_PARAMETERS):
+        # a SessionPlayers deleted since its update was queued is skipped.  The rows are locked (where the
+        # database supports it) so they cannot change between the comparison below and the update
+        existing = [row._asdict() for row in db.session.execute(select(*columns)
+                                                               .where(SessionPlayers.id.in_(chunk))
+                                                               .with_for_update())]
+
+        previous, updated = [], []
+        for row in existing:
+            # a field nobody else has changed is written, otherwise only if this update is the latest
+            last_updated = row['updated_at'] or 0
+            queued = {field: (queued_at, value) for field, (base, queued_at, value) in batch[row['id']].items()
+                      if row[field] == base or queued_at >= last_updated}
+            if len(queued) < len(batch[row['id']]):
+                logger.info('Dropped the live scores of session players %s, updated later by another process',
+                            row['id'])
+            if queued:
+                previous.append(row)
+                updated.append(dict(row, updated_at=max([last_updated] + [at for at, _ in queued.values()]),
+                                    **{field: value for field, (_, value) in queued.items()}))
+
+        if not updated:
+            continue
+
+        db.session.execute(statement, [dict({'new_' + field: row[field] for field in FIELDS + ('updated_at',)},
+                                            row_id=row['id'])
+                                       for row in updated])
+        PlayerStatsDB.apply(removed=[PlayerStatsDB.snapshot(row) for row in previous],
+                            added=[PlayerStatsDB.snapshot(row) for row in updated])
+        ChangeLogDB.record('session-players', ChangeLogDB.UPDATE, [row['id'] for row in updated])
+        written += len(updated)
+
+    if written:
+        VersionDB.bump('session-players')
+    db.session.commit()
+
+    return written
+
+
+def _put_back(batch):
+    with _lock:
+        for session_players_id, values in batch.items():
+            _pending[session_players_id] = dict(values, **_pending.get(session_players_id, {}))
+
+
+def _write_each(batch):
+    """Writes the updates of a batch that failed one SessionPlayers at a time, dropping those that fail
+    so they do not hold up the rest of the queue
+    """
+    written = 0
+    for session_players_id, values in batch.items():
+        try:
+            written += _write({session_players_id: values})
+        except OperationalError:
+            db.session.rollback()
+            _put_back({session_players_id: values})
+        except Exception:
+            db.session.rollback()
+            logger.exception('Dropped the live scores of session players %s, which could not be written',
+                             session_players_id)
+
+    return written
+
+
+def flush():
+    """Writes every pending live score update in a single transaction
+
+    If the database is unavailable (e.g. locked), the updates are put back in the queue (behind any newer
+    ones) for the next flush.  If the write fails for any other reason, the SessionPlayers are written one at
+    a time, and the updates of those that still fail are dropped
+
+    :return The number of SessionPlayers written
+    :rtype int
+    """
+    with _flush_lock:
+        with _lock:
+            batch = {session_players_id: dict(values) for session_players_id, values in _pending.items()}
+            _pending.clear()
+            _in_flight.update(batch)
+            _state['updates'] = 0
+
+        if not batch or _state['app'] is None:
+            return 0
+
+        try:
+            with _state['app'].app_context():
+                try:
+                    written = _write(batch)
+                except OperationalError:
+                    _put_back(batch)
+                    raise
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Could not write the live scores of %d session players together', len(batch))
+                    written = _write_each(batch)
+        finally:
+            with _lock:
+                _in_flight.clear()
+
+        logger.debug('Flushed the live scores of %d session players', written)
+        return written
+
+
+def _flush_forever(interval):
+    while True:
+        _wake.wait(interval)
+        _wake.clear()
+        try:
+            flush()
+        except Exception:
+            logger.exception('Could not write the live scores of %d session players', len(_pending))
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception('Could not write the live scores of %d session players on exit', len(_pending))
+
+
+def _ensure_flush_thread():
+    """Starts the thread that flushes the queue of this process, once per process
+    """
+    if _state['pid'] == os.getpid():
+        return
+
+    with _lock:
+        if _state['pid'] == os.getpid():
+            return
+        _state['pid'] = os.getpid()
+        _state['app'] = current_app._get_current_object()
+
+    interval = _state['app'].config.get('BGT_LIVE_SCORING_INTERVAL', DEFAULT_FLUSH_INTERVAL) / 1000
+    Thread(target=_flush_forever, args=(interval,), name='bgt-live-scores', daemon=True).start()
+
+
+def _reset_after_fork():
+    global _lock, _flush_lock
+
+    # the parent writes its own queue, so a forked worker starts with an empty one
+    _lock = Lock()
+    _flush_lock = Lock()
+    _pending.clear()
+    _in_flight.clear()
+    _state['updates'] = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(_flush_at_exit)
@@ -0,0 +1,398 @@
+from flask import g, has_request_context
+from model.cache import caches
+from model.database import db
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Mapper
+from threading import Lock, Thread
+import glob
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger('bgt-backend.metrics')
+
+# The upper bounds of the buckets of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# The upper bounds of the buckets of the queries per request histogram
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+# How often each process writes its metrics to BGT_METRICS_DIR, in seconds
+DUMP_INTERVAL = 1.0
+
+# The file of BGT_METRICS_DIR holding the counters and histograms of the processes that have exited, see retire()
+RETIRED_FILE = 'retired.json'
+
+# The number of names of retired files remembered in RETIRED_FILE
+RETIRED_FILES_KEPT = 1000
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_lock = Lock()
+_metrics = {}
+
+# The metrics directory and dump thread of this process, see configure(), and the pid and name of its file
+_state = {'directory': None, 'app': None, 'pid': None, 'file': None}
+
+
+class _Metric:
+    """A named counter, gauge or histogram, holding one value per set of label values
+    """
+
+    def __init__(self, name, kind, description, buckets=None):
+        self.name = name
+        self.kind = kind
+        self.description = description
+        self.buckets = buckets
+        self.values = {}
+        _metrics[name] = self
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # one count per bucket, then the sum and the count of every observation
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+
+REQUEST_SECONDS = _Metric('bgt_request_duration_seconds', 'histogram',
+                          'Time taken to handle each request, by endpoint', LATENCY_BUCKETS)
+REQUEST_QUERIES = _Metric('bgt_request_sql_queries', 'histogram',
+                          'Number of SQL statements executed by each request, by endpoint', QUERY_COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = _Metric('bgt_request_sql_duration_seconds', 'histogram',
+                              'Time spent executing SQL by each request, by endpoint', LATENCY_BUCKETS)
+SQL_QUERIES = _Metric('bgt_sql_queries_total', 'counter', 'Number of SQL statements executed, by kind')
+SQL_SECONDS = _Metric('bgt_sql_query_duration_seconds', 'histogram',
+                      'Time taken by each SQL statement, by kind', LATENCY_BUCKETS)
+SQL_ROWS_WRITTEN = _Metric('bgt_sql_rows_written_total', 'counter',
+                           'Number of rows inserted, updated or deleted, by kind')
+ORM_OBJECTS_LOADED = _Metric('bgt_orm_objects_loaded_total', 'counter',
+                             'Number of model objects loaded from the database, by model')
+
+
+def _collect():
+    """Reads the gauges and counters that are kept elsewhere: the connection pool and the caches
+
+    :return A list of (name, kind, description, labels, value) tuples
+    :rtype list
+    """
+    samples = []
+
+    for table, cache in caches.items():
+        stats = cache.stats()
+        labels = (('table', table),)
+        samples.append(('bgt_cache_entries', 'gauge', 'Number of entries held by each cache', labels, stats['size']))
+        for counter in ('hits', 'misses', 'evictions', 'invalidations'):
+            samples.append(('bgt_cache_%s_total' % counter, 'counter', 'Number of cache %s' % counter,
+                            labels, stats[counter]))
+
+    app = _state['app']
+    if app is not None:
+        with app.app_context():
+            pool = db.engine.pool
+        for name, description in (('size', 'Number of connections the pool keeps open'),
+                                  ('checkedin', 'Number of idle connections in the pool'),
+                                  ('checkedout', 'Number of connections in use'),
+                                  ('overflow', 'Number of connections opened beyond the pool size, '
+                                               'negative while the pool is not full')):
+            # only queue based pools report their sizes
+            if hasattr(pool, name):
+                samples.append(('bgt_db_pool_' + name, 'gauge', description, (), getattr(pool, name)()))
+
+    return samples
+
+
+def _snapshot():
+    """Returns every metric of this process in a json serializable form
+
+    :return A dict of metric name to its kind, description, buckets and samples
+    :rtype dict
+    """
+    snapshot = {}
+    with _lock:
+        for metric in _metrics.values():
+            snapshot[metric.name] = {'kind': metric.kind,
+                                     'description': metric.description,
+                                     'buckets': metric.buckets,
+                                     'samples': [[list(key), value] for key, value in metric.values.items()]}
+
+    for name, kind, description, labels, value in _collect():
+        entry = snapshot.setdefault(name, {'kind': kind, 'description': description, 'buckets': None, 'samples': []})
+        entry['samples'].append([list(labels), value])
+
+    return snapshot
+
+
+def _merge(snapshots):
+    """Sums the samples of several snapshots that share a metric name and label values
+
+    :param snapshots: A list of snapshots, as returned by _snapshot
+    :return The merged snapshot
+    :rtype dict
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, entry in snapshot.items():
+            target = merged.setdefault(name, dict(entry, samples={}))
+            for labels, value in entry['samples']:
+                key = tuple(tuple(label) for label in labels)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target['samples'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target['samples'][key] = current + value
+
+    for entry in merged.values():
+        entry['samples'] = [[list(key), value] for key, value in entry['samples'].items()]
+
+    return merged
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _file_name():
+    # named after the pid and the time, so a process reusing the pid of a retired one gets a file of its own
+    if _state['file'] is None or _state['file'][0] != os.getpid():
+        _state['file'] = (os.getpid(), '%d-%d.json' % (os.getpid(), time.time_ns()))
+    return _state['file'][1]
+
+
+def dump():
+    """Writes the metrics of this process to its file in the metrics directory, if there is one
+    """
+    directory = _state['directory']
+    if directory is None:
+        return
+
+    path = os.path.join(directory, _file_name())
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as dump_file:
+        json.dump(_snapshot(), dump_file)
+    os.replace(temporary, path)
+
+
+def _read(path):
+    try:
+        with open(path) as dump_file:
+            return json.load(dump_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _without_gauges(snapshot):
+    return {name: entry for name, entry in snapshot.items() if entry['kind'] != 'gauge'}
+
+
+def retire(pid):
+    """Folds the counters and histograms of a process that has exited into the retired file of the metrics
+    directory, and removes the file of the process, so the directory does not grow with every restart
+
+    Call this from a single process (e.g. the parent of the workers) once the process has exited
+
+    :param pid: The pid of the process
+    """
+    directory = _state['directory']
+    if directory is None:
+        return
+
+    retired_path = os.path.join(directory, RETIRED_FILE)
+    for path in glob.glob(os.path.join(directory, '%d-*.json' % pid)):
+        snapshot = _read(path)
+        if snapshot is not None:
+            retired = _read(retired_path) or {'files': [], 'metrics': {}}
+            # the files folded in lately, so a reader that loaded one of them before it was removed does not
+            # count it twice
+            retired = {'files': retired['files'][-RETIRED_FILES_KEPT:] + [os.path.basename(path)],
+                       'metrics': _merge([retired['metrics'], _without_gauges(snapshot)])}
+
+            temporary = retired_path + '.tmp'
+            with open(temporary, 'w') as retired_file:
+                json.dump(retired, retired_file)
+            os.replace(temporary, retired_path)
+
+        for leftover in (path, path + '.tmp'):
+            try:
+                os.remove(leftover)
+            except FileNotFoundError:
+                pass
+
+
+def _dump_forever():
+    while True:
+        time.sleep(DUMP_INTERVAL)
+        try:
+            dump()
+        except Exception:
+            logger.exception('Could not write the metrics of process %d', os.getpid())
+
+
+def ensure_dump_thread():
+    """Starts the thread that writes the metrics of this process, once per process
+    """
+    if _state['directory'] is None or _state['pid'] == os.getpid():
+        return
+
+    with _lock:
+        if _state['pid'] == os.getpid():
+            return
+        _state['pid'] = os.getpid()
+
+    Thread(target=_dump_forever, name='bgt-metrics', daemon=True).start()
+
+
+def _reset_after_fork():
+    global _lock
+
+    # a forked worker starts counting from zero, rather than repeating what its parent counted
+    _lock = Lock()
+    for metric in _metrics.values():
+        metric.values = {}
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def use_directory(directory):
+    """Makes this process, and every worker forked from it, write its metrics to the directory
+
+    Metrics written there by earlier runs are removed, so call this once before starting the workers
+
+    :param directory: The metrics directory, which is created if it does not exist
+    """
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.json*')):
+        os.remove(path)
+
+    _state['directory'] = directory
+
+
+def render():
+    """Renders the metrics in the Prometheus text format
+
+    If BGT_METRICS_DIR is configured the metrics of every process that has written there are summed.
+    Counters and histograms of processes that have exited are kept (see retire()), so that totals never
+    go backwards, while gauges only include the processes that are still running
+
+    :return The metrics as text
+    :rtype str
+    """
+    directory = _state['directory']
+    if directory is None:
+        merged = _merge([_snapshot()])
+    else:
+        dump()
+        snapshots = {}
+        for path in glob.glob(os.path.join(directory, '*-*.json')):
+            snapshot = _read(path)
+            if snapshot is not None:
+                pid = int(os.path.basename(path).split('-')[0])
+                snapshots[os.path.basename(path)] = snapshot if _is_alive(pid) else _without_gauges(snapshot)
+
+        # read after the files of the processes, so one retired in between is counted once
+        retired = _read(os.path.join(directory, RETIRED_FILE)) or {'files': [], 'metrics': {}}
+        retired_files = set(retired['files'])
+        merged = _merge([retired['metrics']] + [snapshot for name, snapshot in snapshots.items()
+                                                if name not in retired_files])
+
+    lines = []
+    for name in sorted(merged):
+        entry = merged[name]
+        lines.append('# HELP %s %s' % (name, entry['description']))
+        lines.append('# TYPE %s %s' % (name, entry['kind']))
+        for labels, value in sorted(entry['samples'], key=lambda sample: sample[0]):
+            if entry['kind'] != 'histogram':
+                lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+                continue
+
+            for bound, count in zip(entry['buckets'], value):
+                lines.append('%s_bucket%s %s' % (name, _labels(labels + [['le', _number(bound)]]), count))
+            lines.append('%s_bucket%s %s' % (name, _labels(labels + [['le', '+Inf']]), value[-1]))
+            lines.append('%s_sum%s %s' % (name, _labels(labels), _number(value[-2])))
+            lines.append('%s_count%s %s' % (name, _labels(labels), value[-1]))
+
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                          .replace('\n', '\\n'))
+                             for name, value in labels)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _statement_kind(statement):
+    words = statement.lstrip().split(None, 1)
+    return words[0].lower() if words else 'other'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._bgt_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_bgt_started', None)
+    if started is None:
+        return
+
+    elapsed = time.perf_counter() - started
+    kind = _statement_kind(statement)
+    SQL_QUERIES.inc(kind=kind)
+    SQL_SECONDS.observe(elapsed, kind=kind)
+
+    # drivers report -1 rather than the number of rows a SELECT returns
+    if kind in ('insert', 'update', 'delete') and cursor.rowcount > 0:
+        SQL_ROWS_WRITTEN.inc(cursor.rowcount, kind=kind)
+
+    if has_request_context() and '_bgt_sql' in g:
+        g._bgt_sql[0] += 1
+        g._bgt_sql[1] += elapsed
+
+
+@event.listens_for(Mapper, 'load')
+def _on_load(target, context):
+    ORM_OBJECTS_LOADED.inc(model=target.__class__.__name__)
+
+
+def configure(app):
+    """Makes this process report the metrics of the app, see routes/request_metrics.py
+
+    When the app is served by several processes, set BGT_METRICS_DIR to a directory shared by all of
+    them so that each one writes its metrics there and /metrics reports the sum of every process
+
+    :param app: The Flask app
+    """
+    _state['app'] = app
+    if app.config.get('BGT_METRICS_DIR'):
+        _state['directory'] = app.config['BGT_METRICS_DIR']
+        os.makedirs(_state['directory'], exist_ok=True)
@@ -0,0 +1,74 @@
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, insert, select
+from model.migrations import m0001_initial_schema, m0002_foreign_key_indexes, m0003_session_game_date_index, \
+    m0004_player_stats, m0005_leaderboard, m0006_table_version, m0007_binary_uuids, m0008_idempotency_key, \
+    m0009_change_log, m0010_idempotency_committed, m0011_session_players_updated_at
+
+# Every migration, in the order they are applied.  Each module provides VERSION, DESCRIPTION and upgrade(connection)
+MIGRATIONS = [
+    m0001_initial_schema,
+    m0002_foreign_key_indexes,
+    m0003_session_game_date_index,
+    m0004_player_stats,
+    m0005_leaderboard,
+    m0006_table_version,
+    m0007_binary_uuids,
+    m0008_idempotency_key,
+    m0009_change_log,
+    m0010_idempotency_committed,
+    m0011_session_players_updated_at,
+]
+
+schema_version = Table('schema_version', MetaData(),
+                       Column('version', Integer, primary_key=True),
+                       Column('description', String),
+                       Column('applied_at', DateTime, server_default=func.current_timestamp()))
+
+
+def latest_version():
+    """Returns the version of the newest migration
+
+    :return The version the schema has once every migration has been applied
+    :rtype int
+    """
+    return MIGRATIONS[-1].VERSION
+
+
+def current_version(connection):
+    """Returns the version of the most recent migration applied to the database
+
+    :param connection: A connection to the database to check
+    :return The current schema version, or 0 if no migrations have been applied
+    :rtype int
+    """
+    schema_version.create(connection, checkfirst=True)
+    return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(engine, target=None):
+    """Applies every migration newer than the current schema version of the database
+
+    Each migration is applied and recorded in its own transaction, so a failing migration
+    leaves the database at the last version that succeeded
+
+    :param engine: The Engine of the database to upgrade
+    :param target: If provided, the version to stop at.  Otherwise every migration is applied
+    :return A list of the versions that were applied
+    :rtype list
+    """
+    applied = []
+
+    for migration in MIGRATIONS:
+        if target is not None and migration.VERSION > target:
+            break
+
+        with engine.begin() as connection:
+            if migration.VERSION <= current_version(connection):
+                continue
+
+            migration.upgrade(connection)
+            connection.execute(insert(schema_version).values(version=migration.VERSION,
+                                                             description=migration.DESCRIPTION))
+
+        applied.append(migration.VERSION)
+
+    return applied
@@ -0,0 +1,36 @@
+from sqlalchemy import Boolean, Column, Date, ForeignKey, Integer, MetaData, String, Table
+
+VERSION = 1
+DESCRIPTION = 'Create the game, player, session and session-players tables'
+
+metadata = MetaData()
+
+Table('game', metadata,
+      Column('id', String, primary_key=True),
+      Column('name', String),
+      Column('scoring', String))
+
+Table('player', metadata,
+      Column('id', String, primary_key=True),
+      Column('name', String))
+
+Table('session', metadata,
+      Column('id', String, primary_key=True),
+      Column('date', Date),
+      Column('game', String, ForeignKey('game.id')))
+
+Table('session-players', metadata,
+      Column('id', String, primary_key=True),
+      Column('session_id', String, ForeignKey('session.id')),
+      Column('player_id', String, ForeignKey('player.id')),
+      Column('score', Integer),
+      Column('team', Integer),
+      Column('winner', Boolean))
+
+
+def upgrade(connection):
+    """Creates the original tables, leaving any that already exist (from before migrations were used) alone
+
+    :param connection: The connection to run the migration on
+    """
+    metadata.create_all(connection, checkfirst=True)
@@ -0,0 +1,15 @@
+from sqlalchemy import text
+
+VERSION = 2
+DESCRIPTION = 'Index the session_id and player_id foreign keys of session-players'
+
+
+def upgrade(connection):
+    """Adds the indexes used to load the players of a Session and to filter SessionPlayers by player
+
+    :param connection: The connection to run the migration on
+    """
+    connection.execute(text('CREATE INDEX IF NOT EXISTS "ix_session-players_session_id" '
+                            'ON "session-players" (session_id)'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS "ix_session-players_player_id" '
+                            'ON "session-players" (player_id)'))
@@ -0,0 +1,15 @@
+from sqlalchemy import text
+
+VERSION = 3
+DESCRIPTION = 'Index session by date and id, and by game and date'
+
+
+def upgrade(connection):
+    """Adds the indexes used to page through Sessions by date and to find the Sessions of a game, newest first
+
+    The (game, date) index also serves lookups on game alone, so game does not get an index of its own
+
+    :param connection: The connection to run the migration on
+    """
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_session_date_id ON session (date, id)'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_session_game_date ON session (game, date)'))
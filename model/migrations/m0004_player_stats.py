@@ -0,0 +1,70 @@
+from sqlalchemy import Boolean, Column, Date, ForeignKey, Index, Integer, MetaData, String, Table, \
+    and_, case, func, insert, select
+
+VERSION = 4
+DESCRIPTION = 'Create and backfill the player_stats and player_game_stats tables'
+
+metadata = MetaData()
+
+session = Table('session', metadata,
+                Column('id', String, primary_key=True),
+                Column('date', Date),
+                Column('game', String))
+
+session_players = Table('session-players', metadata,
+                        Column('id', String, primary_key=True),
+                        Column('session_id', String),
+                        Column('player_id', String),
+                        Column('score', Integer),
+                        Column('team', Integer),
+                        Column('winner', Boolean))
+
+player_stats = Table('player_stats', metadata,
+                     Column('player_id', String, ForeignKey('player.id'), primary_key=True),
+                     Column('games_played', Integer, nullable=False, default=0),
+                     Column('wins', Integer, nullable=False, default=0),
+                     Column('total_score', Integer, nullable=False, default=0),
+                     Column('scored_games', Integer, nullable=False, default=0))
+
+player_game_stats = Table('player_game_stats', metadata,
+                          Column('player_id', String, ForeignKey('player.id'), primary_key=True),
+                          Column('game_id', String, ForeignKey('game.id'), primary_key=True),
+                          Column('games_played', Integer, nullable=False, default=0),
+                          Column('wins', Integer, nullable=False, default=0),
+                          Index('ix_player_game_stats_player_id_games_played', 'player_id', 'games_played'))
+
+Table('player', metadata, Column('id', String, primary_key=True))
+Table('game', metadata, Column('id', String, primary_key=True))
+
+
+def upgrade(connection):
+    """Creates the player statistics tables and fills them from the existing SessionPlayers
+
+    :param connection: The connection to run the migration on
+    """
+    player_stats.create(connection, checkfirst=True)
+    player_game_stats.create(connection, checkfirst=True)
+    connection.execute(player_game_stats.delete())
+    connection.execute(player_stats.delete())
+
+    won = func.sum(case((session_players.c.winner, 1), else_=0))
+    counted = and_(session_players.c.player_id.isnot(None), session.c.game.isnot(None))
+    joined = session_players.join(session, session_players.c.session_id == session.c.id)
+
+    connection.execute(insert(player_stats).from_select(
+        ['player_id', 'games_played', 'wins', 'total_score', 'scored_games'],
+        select(session_players.c.player_id,
+               func.count(),
+               won,
+               func.coalesce(func.sum(session_players.c.score), 0),
+               func.count(session_players.c.score))
+        .select_from(joined)
+        .where(counted)
+        .group_by(session_players.c.player_id)))
+
+    connection.execute(insert(player_game_stats).from_select(
+        ['player_id', 'game_id', 'games_played', 'wins'],
+        select(session_players.c.player_id, session.c.game, func.count(), won)
+        .select_from(joined)
+        .where(counted)
+        .group_by(session_players.c.player_id, session.c.game)))
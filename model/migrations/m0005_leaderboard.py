@@ -0,0 +1,54 @@
+from sqlalchemy import Boolean, Column, Date, Integer, MetaData, String, Table, case, func, insert, select, text
+
+VERSION = 5
+DESCRIPTION = 'Add score columns to player_game_stats for the per-game leaderboards'
+
+metadata = MetaData()
+
+session = Table('session', metadata,
+                Column('id', String, primary_key=True),
+                Column('date', Date),
+                Column('game', String))
+
+session_players = Table('session-players', metadata,
+                        Column('id', String, primary_key=True),
+                        Column('session_id', String),
+                        Column('player_id', String),
+                        Column('score', Integer),
+                        Column('winner', Boolean))
+
+player_game_stats = Table('player_game_stats', metadata,
+                          Column('player_id', String, primary_key=True),
+                          Column('game_id', String, primary_key=True),
+                          Column('games_played', Integer),
+                          Column('wins', Integer),
+                          Column('total_score', Integer),
+                          Column('scored_games', Integer),
+                          Column('best_score', Integer))
+
+
+def upgrade(connection):
+    """Adds the total, count and best of the scores to player_game_stats, indexes it by game and
+    refills it from the existing SessionPlayers
+
+    :param connection: The connection to run the migration on
+    """
+    connection.execute(text('ALTER TABLE player_game_stats ADD COLUMN total_score INTEGER NOT NULL DEFAULT 0'))
+    connection.execute(text('ALTER TABLE player_game_stats ADD COLUMN scored_games INTEGER NOT NULL DEFAULT 0'))
+    connection.execute(text('ALTER TABLE player_game_stats ADD COLUMN best_score INTEGER'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_player_game_stats_game_id_wins '
+                            'ON player_game_stats (game_id, wins)'))
+
+    connection.execute(player_game_stats.delete())
+    connection.execute(insert(player_game_stats).from_select(
+        ['player_id', 'game_id', 'games_played', 'wins', 'total_score', 'scored_games', 'best_score'],
+        select(session_players.c.player_id,
+               session.c.game,
+               func.count(),
+               func.sum(case((session_players.c.winner, 1), else_=0)),
+               func.coalesce(func.sum(session_players.c.score), 0),
+               func.count(session_players.c.score),
+               func.max(session_players.c.score))
+        .select_from(session_players.join(session, session_players.c.session_id == session.c.id))
+        .where(session_players.c.player_id.isnot(None), session.c.game.isnot(None))
+        .group_by(session_players.c.player_id, session.c.game)))
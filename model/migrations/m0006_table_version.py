@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, MetaData, String, Table
+
+VERSION = 6
+DESCRIPTION = 'Create the table_version table used for conditional requests'
+
+metadata = MetaData()
+
+table_version = Table('table_version', metadata,
+                      Column('name', String, primary_key=True),
+                      Column('version', Integer, nullable=False, default=0))
+
+
+def upgrade(connection):
+    """Creates the table holding a version for each table, which is incremented on every change
+
+    :param connection: The connection to run the migration on
+    """
+    table_version.create(connection, checkfirst=True)
@@ -0,0 +1,86 @@
+from model.types import legacy_uuid
+from sqlalchemy import bindparam, inspect, text
+
+VERSION = 7
+DESCRIPTION = 'Store every id as a 16 byte UUID (native uuid on PostgreSQL) instead of its 36 character text'
+
+# The id columns of each table
+ID_COLUMNS = {
+    'game': ['id'],
+    'player': ['id'],
+    'session': ['id', 'game'],
+    'session-players': ['id', 'session_id', 'player_id'],
+    'player_stats': ['player_id'],
+    'player_game_stats': ['player_id', 'game_id'],
+}
+
+# Every text form PostgreSQL accepts as a uuid
+POSTGRESQL_UUID_PATTERN = r'^\{?[0-9a-f]{8}-?([0-9a-f]{4}-?){3}[0-9a-f]{12}\}?$'
+
+
+def _uuid_blob(value):
+    if value is None or isinstance(value, bytes):
+        return value
+
+    return legacy_uuid(value).bytes
+
+
+def _upgrade_sqlite(connection):
+    # SQLite keeps a blob as a blob whatever the declared type of the column, so the ids are converted in place
+    connection.connection.driver_connection.create_function('bgt_uuid_blob', 1, _uuid_blob, deterministic=True)
+
+    quote = connection.dialect.identifier_preparer.quote
+    for table, columns in ID_COLUMNS.items():
+        connection.execute(text('UPDATE %s SET %s' % (quote(table), ', '.join('%s = bgt_uuid_blob(%s)' %
+                                                                               (quote(column), quote(column))
+                                                                               for column in columns))))
+
+
+def _upgrade_postgresql(connection):
+    quote = connection.dialect.identifier_preparer.quote
+
+    # give the ids that are not UUIDs the uuid5 of their text, which maps every reference to them the same way
+    for table, columns in ID_COLUMNS.items():
+        for column in columns:
+            invalid = connection.execute(text('SELECT DISTINCT %s FROM %s WHERE %s !~* :pattern' %
+                                              (quote(column), quote(table), quote(column))),
+                                         {'pattern': POSTGRESQL_UUID_PATTERN}).scalars().all()
+            if invalid:
+                connection.execute(text('UPDATE %s SET %s = :new WHERE %s = :old' %
+                                        (quote(table), quote(column), quote(column)))
+                                   .bindparams(bindparam('new'), bindparam('old')),
+                                   [{'old': value, 'new': str(legacy_uuid(value))} for value in invalid])
+
+    # a column can only change type once nothing references it, so the foreign keys are dropped and then re-added
+    inspector = inspect(connection)
+    foreign_keys = [(table, foreign_key) for table in ID_COLUMNS for foreign_key in inspector.get_foreign_keys(table)]
+    for table, foreign_key in foreign_keys:
+        connection.execute(text('ALTER TABLE %s DROP CONSTRAINT %s' % (quote(table), quote(foreign_key['name']))))
+
+    for table, columns in ID_COLUMNS.items():
+        connection.execute(text('ALTER TABLE %s %s' % (quote(table), ', '.join(
+            'ALTER COLUMN %s TYPE uuid USING %s::uuid' % (quote(column), quote(column)) for column in columns))))
+
+    for table, foreign_key in foreign_keys:
+        connection.execute(text('ALTER TABLE %s ADD CONSTRAINT %s FOREIGN KEY (%s) REFERENCES %s (%s)' % (
+            quote(table), quote(foreign_key['name']),
+            ', '.join(quote(column) for column in foreign_key['constrained_columns']),
+            quote(foreign_key['referred_table']),
+            ', '.join(quote(column) for column in foreign_key['referred_columns']))))
+
+
+def upgrade(connection):
+    """Converts every id, and every reference to one, from text to a binary UUID
+
+    Ids that are not UUIDs are replaced by a uuid5 of their text (see model.types.legacy_uuid), consistently
+    across every table, so the rows still reference each other.  On SQLite, run VACUUM afterwards to
+    return the space the text ids took to the file system
+
+    :param connection: The connection to run the migration on
+    """
+    if connection.dialect.name == 'postgresql':
+        _upgrade_postgresql(connection)
+    elif connection.dialect.name == 'sqlite':
+        _upgrade_sqlite(connection)
+    else:
+        raise NotImplementedError("Binary ids are not supported on %s" % connection.dialect.name)
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Float, Index, Integer, LargeBinary, MetaData, String, Table
+
+VERSION = 8
+DESCRIPTION = 'Create the idempotency_key table used to deduplicate retried creates'
+
+metadata = MetaData()
+
+idempotency_key = Table('idempotency_key', metadata,
+                        Column('key', String, primary_key=True),
+                        Column('fingerprint', String, nullable=False),
+                        Column('status', Integer),
+                        Column('mimetype', String),
+                        Column('body', LargeBinary),
+                        Column('created_at', Float, nullable=False),
+                        Column('expires_at', Float, nullable=False),
+                        Index('ix_idempotency_key_expires_at', 'expires_at'))
+
+
+def upgrade(connection):
+    """Creates the table recording the response to each Idempotency-Key
+
+    :param connection: The connection to run the migration on
+    """
+    idempotency_key.create(connection, checkfirst=True)
@@ -0,0 +1,25 @@
+from model.types import BinaryUUID
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table
+
+VERSION = 9
+DESCRIPTION = 'Create the change_log table used for delta sync'
+
+metadata = MetaData()
+
+change_log = Table('change_log', metadata,
+                   Column('seq', Integer, primary_key=True),
+                   Column('entity', String, nullable=False),
+                   Column('entity_id', BinaryUUID, nullable=False),
+                   Column('operation', String, nullable=False),
+                   Index('ix_change_log_entity_entity_id', 'entity', 'entity_id'),
+                   sqlite_autoincrement=True)
+
+
+def upgrade(connection):
+    """Creates the table logging the changes to every entity, read by GET /changes/
+
+    The log starts out empty, so clients take its high-water mark before downloading everything once
+
+    :param connection: The connection to run the migration on
+    """
+    change_log.create(connection, checkfirst=True)
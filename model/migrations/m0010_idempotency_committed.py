@@ -0,0 +1,13 @@
+from sqlalchemy import text
+
+VERSION = 10
+DESCRIPTION = 'Record whether the request holding an Idempotency-Key has committed its writes'
+
+
+def upgrade(connection):
+    """Adds the committed flag of the idempotency_key table, set in the same transaction as the writes of the
+    request holding the key
+
+    :param connection: The connection to run the migration on
+    """
+    connection.execute(text('ALTER TABLE idempotency_key ADD COLUMN committed BOOLEAN NOT NULL DEFAULT false'))
@@ -0,0 +1,12 @@
+from sqlalchemy import text
+
+VERSION = 11
+DESCRIPTION = 'Record when each SessionPlayers was last updated, so the latest of two updates wins'
+
+
+def upgrade(connection):
+    """Adds the updated_at column of session-players, which stays null until a row is first updated
+
+    :param connection: The connection to run the migration on
+    """
+    connection.execute(text('ALTER TABLE "session-players" ADD COLUMN updated_at FLOAT'))
@@ -1,5 +1,6 @@
 from model.database import db
-from sqlalchemy import Column, String, Integer, Boolean, Date, ForeignKey
+from model.types import BinaryUUID
+from sqlalchemy import Column, String, Integer, Boolean, Date, Float, ForeignKey, Index, LargeBinary
 from sqlalchemy.orm import relationship
 
 
@@ -7,7 +8,7 @@ class Game(db.Model):
     """Model class used to store Game objects in the database
     """
     __tablename__ = 'game'
-    id = Column(String, primary_key=True)
+    id = Column(BinaryUUID, primary_key=True)
     name = Column(String)
     scoring = Column(String)
 
@@ -32,7 +33,7 @@ class Player(db.Model):
     """Model class used to store Player objects in the database
     """
     __tablename__ = 'player'
-    id = Column(String, primary_key=True)
+    id = Column(BinaryUUID, primary_key=True)
     name = Column(String)
 
     def __repr__(self):
@@ -52,14 +53,22 @@ class Player(db.Model):
 
 class SessionPlayers(db.Model):
     """Model class used to store the Players that participated in a Session
+
+    updated_at is the time (from time.time()) of the latest update, used to order the live score updates
+    of several processes (see model/live_scores.py)
     """
     __tablename__ = 'session-players'
-    id = Column(String, primary_key=True)
-    session_id = Column(String, ForeignKey('session.id'))
-    player_id = Column(String, ForeignKey('player.id'))
+    __table_args__ = (
+        Index('ix_session-players_session_id', 'session_id'),
+        Index('ix_session-players_player_id', 'player_id'),
+    )
+    id = Column(BinaryUUID, primary_key=True)
+    session_id = Column(BinaryUUID, ForeignKey('session.id'))
+    player_id = Column(BinaryUUID, ForeignKey('player.id'))
     score = Column(Integer)
     team = Column(Integer)
     winner = Column(Boolean)
+    updated_at = Column(Float)
     session = relationship("Session", back_populates="players")
 
     def __repr__(self):
@@ -86,9 +95,13 @@ class Session(db.Model):
     """Model class used to store the Session information
     """
     __tablename__ = 'session'
-    id = Column(String, primary_key=True)
+    __table_args__ = (
+        Index('ix_session_date_id', 'date', 'id'),
+        Index('ix_session_game_date', 'game', 'date'),
+    )
+    id = Column(BinaryUUID, primary_key=True)
     date = Column(Date)
-    game = Column(String, ForeignKey('game.id'))
+    game = Column(BinaryUUID, ForeignKey('game.id'))
     players = relationship("SessionPlayers", back_populates="session")
 
     def __repr(self):
@@ -106,3 +119,131 @@ class Session(db.Model):
             'game_id': self.game,
             'players': [player.to_obj() for player in self.players]
         }
+
+
+class PlayerStats(db.Model):
+    """Model class used to store the aggregated statistics of a Player across all of their Sessions
+
+    Maintained incrementally by PlayerStatsDB whenever SessionPlayers are written
+    """
+    __tablename__ = 'player_stats'
+    player_id = Column(BinaryUUID, ForeignKey('player.id'), primary_key=True)
+    games_played = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    total_score = Column(Integer, nullable=False, default=0)
+    scored_games = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<PlayerStats(player_id='%s', games_played='%d', wins='%d')>" % \
+               (self.player_id, self.games_played, self.wins)
+
+    def to_obj(self):
+        """Returns the object in JSON format
+
+        :return: String representation of the object
+        """
+
+        return {
+            'player_id': self.player_id,
+            'games_played': self.games_played,
+            'wins': self.wins,
+            'win_rate': self.wins / self.games_played if self.games_played else 0,
+            'average_score': self.total_score / self.scored_games if self.scored_games else None
+        }
+
+
+class PlayerGameStats(db.Model):
+    """Model class used to store the aggregated statistics of a Player for a single Game
+
+    Maintained incrementally by PlayerStatsDB whenever SessionPlayers are written, and read
+    by LeaderboardDB as the leaderboard of each Game
+    """
+    __tablename__ = 'player_game_stats'
+    __table_args__ = (
+        Index('ix_player_game_stats_player_id_games_played', 'player_id', 'games_played'),
+        Index('ix_player_game_stats_game_id_wins', 'game_id', 'wins'),
+    )
+    player_id = Column(BinaryUUID, ForeignKey('player.id'), primary_key=True)
+    game_id = Column(BinaryUUID, ForeignKey('game.id'), primary_key=True)
+    games_played = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    total_score = Column(Integer, nullable=False, default=0)
+    scored_games = Column(Integer, nullable=False, default=0)
+    best_score = Column(Integer)
+
+    def __repr__(self):
+        return "<PlayerGameStats(player_id='%s', game_id='%s', games_played='%d', wins='%d')>" % \
+               (self.player_id, self.game_id, self.games_played, self.wins)
+
+    def to_obj(self):
+        """Returns the object in JSON format
+
+        :return: String representation of the object
+        """
+
+        return {
+            'player_id': self.player_id,
+            'game_id': self.game_id,
+            'games_played': self.games_played,
+            'wins': self.wins,
+            'win_rate': self.wins / self.games_played if self.games_played else 0,
+            'best_score': self.best_score,
+            'average_score': self.total_score / self.scored_games if self.scored_games else None
+        }
+
+
+class TableVersion(db.Model):
+    """Model class used to store a version for each table, incremented every time the table changes
+
+    Used to tell whether anything has changed since a response was generated, without reading the rows
+    """
+    __tablename__ = 'table_version'
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<TableVersion(name='%s', version='%d')>" % (self.name, self.version)
+
+
+class IdempotencyKey(db.Model):
+    """Model class used to store the Idempotency-Key of a create request, and the response it was answered with
+
+    The status is None while the request is still being handled, and committed is set as soon as the writes
+    of the request are committed (see IdempotencyDB.hold())
+    """
+    __tablename__ = 'idempotency_key'
+    __table_args__ = (
+        Index('ix_idempotency_key_expires_at', 'expires_at'),
+    )
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    status = Column(Integer)
+    mimetype = Column(String)
+    body = Column(LargeBinary)
+    created_at = Column(Float, nullable=False)
+    expires_at = Column(Float, nullable=False)
+    committed = Column(Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return "<IdempotencyKey(key='%s', status='%s')>" % (self.key, self.status)
+
+
+class ChangeLog(db.Model):
+    """Model class used to store the log of changes to the Games, Players, Sessions and SessionPlayers
+
+    Each entity only keeps its latest change, and a deleted entity keeps a tombstone (see ChangeLogDB)
+    """
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        Index('ix_change_log_entity_entity_id', 'entity', 'entity_id'),
+        # sequence numbers are never reused, even once the newest change has been superseded
+        {'sqlite_autoincrement': True},
+    )
+    seq = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)
+    entity_id = Column(BinaryUUID, nullable=False)
+    operation = Column(String, nullable=False)
+
+    def __repr__(self):
+        return "<ChangeLog(seq='%d', entity='%s', entity_id='%s', operation='%s')>" % \
+               (self.seq, self.entity, self.entity_id, self.operation)
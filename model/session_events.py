@@ -0,0 +1,280 @@
+from model.database import db
+from model.models import ChangeLog, SessionPlayers
+import model.ChangeLogDB as ChangeLogDB
+import model.SessionPlayersDB as SessionPlayersDB
+from flask import current_app
+from sqlalchemy import and_, select
+from threading import Event, Lock, Thread
+import logging
+import os
+import queue
+
+logger = logging.getLogger('bgt-backend.session-events')
+
+DEFAULT_POLL_INTERVAL = 500
+
+# The maximum number of changes read by each poll of the change log
+POLL_BATCH_SIZE = 1000
+
+# The number of events a subscriber can fall behind by before it is told to reset
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# The kinds of events sent to the watchers of a Session
+SNAPSHOT = 'snapshot'
+PLAYER = 'player'
+REMOVED = 'removed'
+DELETED = 'deleted'
+RESET = 'reset'
+
+# The subscribers of each Session, by session id, and the Session each of their SessionPlayers belongs to
+_subscribers = {}
+_session_of = {}
+
+# The state of this process: the app to poll with, the pid that started the poller, the sequence number the
+# poller has read up to, and the lowest sequence number a new subscriber needs the poller to read from
+_state = {'app': None, 'pid': None, 'seq': None, 'rewind': None}
+
+_lock = Lock()
+_wake = Event()
+
+
+class Subscription:
+    """The events of a single Session for one watcher, see subscribe()
+
+    :param session_id: The id of the Session
+    :param since: The sequence number of the last change the watcher has seen
+    """
+
+    def __init__(self, session_id, since):
+        self.session_id = session_id
+        self.since = since
+        self.events = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def get(self, timeout):
+        """Waits for the next event
+
+        :param timeout: The number of seconds to wait
+        :return A tuple of the kind of event, its sequence number and its data, or None on timeout
+        :rtype tuple
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _publish(self, kind, seq, data):
+        # a watcher hears about each change once, even if the poller reads it again after a rewind
+        if seq <= self.since:
+            return
+
+        self.since = seq
+        try:
+            self.events.put_nowait((kind, seq, data))
+        except queue.Full:
+            # too far behind: drop the backlog and tell the watcher to start over
+            with self.events.mutex:
+                self.events.queue.clear()
+            self.events.put_nowait((RESET, seq, None))
+
+
+def subscribe(session_id, since, session_players_ids):
+    """Subscribes to the changes of the SessionPlayers of a Session committed after a sequence number
+
+    Every Session watched in this process is served by a single poller thread, which reads the change log
+    as soon as this process commits a change, and every BGT_SESSION_EVENTS_INTERVAL milliseconds for the
+    changes committed by other processes.  Each change is published to every subscriber of its Session,
+    so the cost of a change does not grow with the number of watchers
+
+    :param session_id: The canonical id of the Session
+    :param since: The sequence number the watcher is up to date with, see ChangeLogDB.get_high_water_mark()
+    :param session_players_ids: The ids of the SessionPlayers the watcher knows to be in the Session
+    :return The subscription, to pass to unsubscribe() once the watcher is gone
+    :rtype Subscription
+    """
+    _ensure_poller()
+
+    subscription = Subscription(session_id, since)
+    with _lock:
+        _subscribers.setdefault(session_id, set()).add(subscription)
+        for session_players_id in session_players_ids:
+            _session_of[session_players_id] = session_id
+        if _state['rewind'] is None or since < _state['rewind']:
+            _state['rewind'] = since
+
+    _wake.set()
+    return subscription
+
+
+def unsubscribe(subscription):
+    """Stops publishing events to a subscription
+
+    :param subscription: The subscription returned by subscribe()
+    """
+    with _lock:
+        subscribers = _subscribers.get(subscription.session_id)
+        if subscribers is None:
+            return
+
+        subscribers.discard(subscription)
+        if not subscribers:
+            del _subscribers[subscription.session_id]
+            for session_players_id in [key for key, value in _session_of.items()
+                                       if value == subscription.session_id]:
+                del _session_of[session_players_id]
+
+
+def _publish(session_id, kind, seq, data):
+    for subscription in list(_subscribers.get(session_id, ())):
+        subscription._publish(kind, seq, data)
+
+
+def _read(since):
+    """Reads the changes to Sessions and SessionPlayers after a sequence number, along with the current
+    values of the SessionPlayers
+    """
+    columns = [SessionPlayers.__table__.c[key] for key in SessionPlayersDB.ROW_KEYS]
+    statement = select(ChangeLog.seq, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.operation, *columns) \
+        .outerjoin(SessionPlayers, and_(ChangeLog.entity == 'session-players',
+                                        SessionPlayers.id == ChangeLog.entity_id)) \
+        .where(ChangeLog.seq > since, ChangeLog.entity.in_(['session', 'session-players'])) \
+        .order_by(ChangeLog.seq) \
+        .limit(POLL_BATCH_SIZE)
+
+    return db.session.execute(statement).all()
+
+
+def poll():
+    """Reads the changes committed since the last poll and publishes them to the subscribers of their Sessions
+
+    :return The number of changes read
+    :rtype int
+    """
+    with _lock:
+        rewind, _state['rewind'] = _state['rewind'], None
+        if rewind is not None and (_state['seq'] is None or rewind < _state['seq']):
+            _state['seq'] = rewind
+
+    if _state['seq'] is None:
+        return 0
+
+    with _state['app'].app_context():
+        rows = _read(_state['seq'])
+        floor = ChangeLogDB.get_floor() if rows else 0
+
+    with _lock:
+        if rows and _state['seq'] < floor:
+            # the changes the subscribers are waiting for have been dropped, so they have to start over
+            for session_id in list(_subscribers):
+                _publish(session_id, RESET, floor, None)
+
+        for seq, entity, entity_id, operation, *values in rows:
+            if entity == 'session':
+                if operation == ChangeLogDB.DELETE:
+                    _publish(entity_id, DELETED, seq, {'id': entity_id})
+                continue
+
+            row = dict(zip(SessionPlayersDB.ROW_KEYS, values)) if values[0] is not None else None
+            previous = _session_of.get(entity_id)
+            current = row['session_id'] if row is not None else None
+
+            if previous is not None and previous != current:
+                del _session_of[entity_id]
+                _publish(previous, REMOVED, seq, {'id': entity_id})
+
+            if current in _subscribers:
+                _session_of[entity_id] = current
+                _publish(current, PLAYER, seq, row)
+
+        if rows:
+            _state['seq'] = rows[-1][0]
+
+    return len(rows)
+
+
+def replay(session_id, since, until):
+    """Returns the events a watcher that was up to date with a sequence number has missed since
+
+    The change log only keeps the latest change of each SessionPlayers, so the SessionPlayers of the Session
+    changed since then are returned once each, with their current values.  A SessionPlayers deleted since then
+    cannot be traced back to its Session, so None is returned instead if any was, if changes since then have
+    been dropped from the log, or if the sequence number is ahead of the log (e.g. the database was restored
+    from a backup): the watcher then needs the whole Session again
+
+    :param session_id: The canonical id of the Session
+    :param since: The sequence number of the last change the watcher has seen (its Last-Event-ID)
+    :param until: The sequence number the replay stops at, see ChangeLogDB.get_high_water_mark()
+    :return A list of PLAYER events (tuples of the kind, sequence number and data), or None
+    :rtype list
+    """
+    if since > until or since < ChangeLogDB.get_floor():
+        return None
+
+    in_range = and_(ChangeLog.entity == 'session-players', ChangeLog.seq > since, ChangeLog.seq <= until)
+
+    deleted = db.session.execute(select(ChangeLog.seq)
+                                 .where(in_range, ChangeLog.operation == ChangeLogDB.DELETE).limit(1)).first()
+    if deleted is not None:
+        return None
+
+    columns = [SessionPlayers.__table__.c[key] for key in SessionPlayersDB.ROW_KEYS]
+    rows = db.session.execute(select(ChangeLog.seq, *columns)
+                              .join(SessionPlayers, SessionPlayers.id == ChangeLog.entity_id)
+                              .where(in_range, SessionPlayers.session_id == session_id)
+                              .order_by(ChangeLog.seq)).all()
+
+    return [(PLAYER, row[0], dict(zip(SessionPlayersDB.ROW_KEYS, row[1:]))) for row in rows]
+
+
+def _notify():
+    # the news of a local commit: read the change log now rather than at the next interval
+    _wake.set()
+
+
+def _poll_forever(interval):
+    while True:
+        # idle until the first watcher subscribes
+        _wake.wait(interval if _subscribers else None)
+        _wake.clear()
+
+        with _lock:
+            if not _subscribers:
+                _state['seq'] = None
+                continue
+
+        try:
+            while poll() == POLL_BATCH_SIZE:
+                pass
+        except Exception:
+            logger.exception('Could not read the change log')
+
+
+def _ensure_poller():
+    """Starts the thread that polls the change log for the watchers of this process, once per process
+    """
+    if _state['pid'] == os.getpid():
+        return
+
+    with _lock:
+        if _state['pid'] == os.getpid():
+            return
+        _state['pid'] = os.getpid()
+        _state['app'] = current_app._get_current_object()
+
+    interval = _state['app'].config.get('BGT_SESSION_EVENTS_INTERVAL', DEFAULT_POLL_INTERVAL) / 1000
+    Thread(target=_poll_forever, args=(interval,), name='bgt-session-events', daemon=True).start()
+
+
+def _reset_after_fork():
+    global _lock, _wake
+
+    # the watchers belong to the parent, a forked worker starts its own poller when it gets one
+    _lock = Lock()
+    _wake = Event()
+    _subscribers.clear()
+    _session_of.clear()
+    _state['seq'] = None
+    _state['rewind'] = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+ChangeLogDB.on_commit(_notify)
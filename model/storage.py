@@ -0,0 +1,89 @@
+from model.database import db
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+import os
+
+DEFAULT_DATABASE_URI = 'sqlite:///model/bgt-backend.db'
+
+
+def _env(name, default, cast=str):
+    value = os.environ.get(name)
+    return default if value is None or value == '' else cast(value)
+
+
+def _env_bool(name, default):
+    return _env(name, default, lambda value: value.strip().lower() in ('1', 'true', 'yes', 'on'))
+
+
+def configure(app, database_uri=None):
+    """Applies the storage settings from the environment to the app config
+
+    Must be called before db.init_app(app), and followed by init_app(app).  Reads the following environment
+    variables:
+
+    * BGT_DATABASE_URI: the SQLAlchemy URI of the database (defaults to the SQLite file in model/)
+    * BGT_SQL_ECHO: whether to log every SQL statement (defaults to off)
+    * BGT_POOL_SIZE, BGT_POOL_MAX_OVERFLOW, BGT_POOL_TIMEOUT, BGT_POOL_RECYCLE: connection pool sizing
+    * BGT_SQLITE_JOURNAL_MODE, BGT_SQLITE_SYNCHRONOUS, BGT_SQLITE_BUSY_TIMEOUT (ms),
+      BGT_SQLITE_MMAP_SIZE (bytes), BGT_SQLITE_CACHE_SIZE (KiB): the pragmas applied to SQLite connections,
+      stored in the BGT_SQLITE_PRAGMAS config
+
+    :param app: The Flask app to configure
+    :param database_uri: If provided, overrides BGT_DATABASE_URI
+    """
+    uri = database_uri or _env('BGT_DATABASE_URI', DEFAULT_DATABASE_URI)
+    backend = make_url(uri).get_backend_name()
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ECHO'] = _env_bool('BGT_SQL_ECHO', False)
+
+    options = {'pool_pre_ping': True}
+
+    if backend == 'sqlite':
+        busy_timeout = _env('BGT_SQLITE_BUSY_TIMEOUT', 5000, int)
+        app.config['BGT_SQLITE_PRAGMAS'] = {
+            'journal_mode': _env('BGT_SQLITE_JOURNAL_MODE', 'WAL'),
+            'synchronous': _env('BGT_SQLITE_SYNCHRONOUS', 'NORMAL'),
+            'busy_timeout': busy_timeout,
+            'mmap_size': _env('BGT_SQLITE_MMAP_SIZE', 256 * 1024 * 1024, int),
+            # negative values are in KiB rather than pages
+            'cache_size': -_env('BGT_SQLITE_CACHE_SIZE', 64 * 1024, int),
+            'temp_store': 'MEMORY'
+        }
+        options['connect_args'] = {'timeout': busy_timeout / 1000, 'check_same_thread': False}
+
+        # an in-memory database only lives as long as its connection, so it can not be pooled
+        if make_url(uri).database not in (None, '', ':memory:'):
+            options['pool_size'] = _env('BGT_POOL_SIZE', 5, int)
+            options['max_overflow'] = _env('BGT_POOL_MAX_OVERFLOW', 10, int)
+            options['pool_timeout'] = _env('BGT_POOL_TIMEOUT', 30, int)
+    else:
+        options['pool_size'] = _env('BGT_POOL_SIZE', 10, int)
+        options['max_overflow'] = _env('BGT_POOL_MAX_OVERFLOW', 20, int)
+        options['pool_timeout'] = _env('BGT_POOL_TIMEOUT', 30, int)
+        options['pool_recycle'] = _env('BGT_POOL_RECYCLE', 1800, int)
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def init_app(app):
+    """Applies the SQLite pragmas of the app (see configure) to every new connection of its engine
+
+    The pragmas are bound to the engine, so apps using different databases each keep their own.
+    Must be called after db.init_app(app)
+
+    :param app: The Flask app whose engine to set up
+    """
+    pragmas = dict(app.config.get('BGT_SQLITE_PRAGMAS') or {})
+    if not pragmas:
+        return
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'connect')
+    def apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
@@ -0,0 +1,94 @@
+from sqlalchemy import LargeBinary
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import TypeDecorator
+import uuid
+
+# The namespace of the uuid5 ids given to rows whose id was not a UUID when the ids were converted to binary
+LEGACY_ID_NAMESPACE = uuid.UUID('6f6b8d3e-2c5a-4c55-9a39-52a1f4a0be0e')
+
+
+class InvalidIdError(ValueError):
+    """Raised when an id provided for a write is not a UUID
+    """
+
+
+def parse_uuid(value):
+    """Parses a UUID from any of the forms uuid.UUID accepts, or from its 16 bytes
+
+    :param value: The value to parse
+    :return The UUID, or None if the value is not a UUID
+    :rtype uuid.UUID
+    """
+    if isinstance(value, uuid.UUID):
+        return value
+
+    try:
+        if isinstance(value, str):
+            return uuid.UUID(value)
+        if isinstance(value, bytes) and len(value) == 16:
+            return uuid.UUID(bytes=value)
+    except ValueError:
+        pass
+
+    return None
+
+
+def canonical_id(value, name='id'):
+    """Returns the canonical (lower case, hyphenated) form of an id provided for a write
+
+    :param value: The id to check
+    :param name: The name of the value, used in the error message
+    :return The canonical id
+    :rtype str
+    :raise InvalidIdError if the value is not a UUID
+    """
+    parsed = parse_uuid(value)
+    if parsed is None:
+        raise InvalidIdError('%s must be a UUID' % name)
+
+    return str(parsed)
+
+
+def legacy_uuid(value):
+    """Returns the UUID an existing id is stored as: the id itself if it is a UUID, otherwise a uuid5 of it,
+    so that every reference to the same id still matches after the conversion
+
+    :param value: The existing id
+    :return The UUID, or None if the value is None
+    :rtype uuid.UUID
+    """
+    if value is None:
+        return None
+
+    return parse_uuid(value) or uuid.uuid5(LEGACY_ID_NAMESPACE, str(value))
+
+
+class BinaryUUID(TypeDecorator):
+    """A UUID, stored as 16 bytes (or with the native uuid type on PostgreSQL) and exchanged as its canonical string
+
+    A value that is not a UUID binds as NULL, so looking up or filtering by an invalid id simply finds
+    nothing.  Writes must check their ids with canonical_id() first, as an invalid id would otherwise be
+    written as NULL
+    """
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        parsed = parse_uuid(value)
+        if parsed is None:
+            return None
+
+        return str(parsed) if dialect.name == 'postgresql' else parsed.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+
+        digits = value.hex()
+        return '%s-%s-%s-%s-%s' % (digits[:8], digits[8:12], digits[12:16], digits[16:20], digits[20:])
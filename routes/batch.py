@@ -0,0 +1,51 @@
+from flask import abort, request
+from routes.fields import project
+
+# The maximum number of ids that can be requested at once
+MAX_BATCH_IDS = 10000
+
+
+def is_batch():
+    """Returns whether the current request asked for specific ids with the "ids" query parameter
+
+    :return True if "ids" was provided in the query string
+    :rtype bool
+    """
+    return 'ids' in request.args
+
+
+def get_ids():
+    """Reads the requested ids of the current request
+
+    The ids are either a comma separated "ids" query parameter, or an "ids" list in the JSON body
+
+    :return The list of requested ids
+    :rtype list
+    """
+    if request.method == 'GET':
+        ids = [value.strip() for value in request.args.get('ids', '').split(',') if value.strip()]
+    else:
+        body = request.get_json(silent=True)
+        ids = body.get('ids') if isinstance(body, dict) else None
+        if not isinstance(ids, list) or not all(isinstance(value, str) for value in ids):
+            abort(400, 'Expected a JSON body holding a list of "ids"!')
+
+    if len(ids) > MAX_BATCH_IDS:
+        abort(400, 'At most %d ids can be requested at once' % MAX_BATCH_IDS)
+
+    return ids
+
+
+def batch_response(objects, missing, fields=None):
+    """Builds the body of a batch fetch response
+
+    :param objects: The objects that were found, in the requested order
+    :param missing: The requested ids that were not found
+    :param fields: If provided, only these fields of each object are returned
+    :return A dict holding the serialized objects and the missing ids
+    :rtype dict
+    """
+    return {
+        'items': [obj.to_obj() if fields is None else project(obj.to_obj(), fields) for obj in objects],
+        'missing': missing
+    }
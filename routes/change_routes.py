@@ -0,0 +1,70 @@
+from flask import Blueprint, abort, request
+import model.ChangeLogDB as ChangeLogDB
+import model.GameDB as GameDB
+import model.PlayerDB as PlayerDB
+import model.SessionDB as SessionDB
+import model.SessionPlayersDB as SessionPlayersDB
+from routes.conditional import conditional
+from routes.encoding import json_response
+from routes.pagination import get_limit
+
+change_api = Blueprint('change_api', __name__)
+
+# Loads the current objects of the entities of each type, as a list of dicts
+_LOADERS = {
+    'game': lambda ids: [game.to_obj() for game in GameDB.get_many(ids)[0]],
+    'player': lambda ids: [player.to_obj() for player in PlayerDB.get_many(ids)[0]],
+    'session': lambda ids: SessionDB.get_many_rows(ids, include=())[0],
+    'session-players': lambda ids: SessionPlayersDB.get_many_rows(ids)[0],
+}
+
+
+def _add_data(changes):
+    """Adds the current object of every entity that was created or updated to its change, as "data"
+    """
+    ids = {}
+    for change in changes:
+        if change['op'] != ChangeLogDB.DELETE:
+            ids.setdefault(change['type'], []).append(change['id'])
+
+    objects = {(entity, obj['id']): obj for entity, entity_ids in ids.items() for obj in _LOADERS[entity](entity_ids)}
+
+    for change in changes:
+        if change['op'] != ChangeLogDB.DELETE:
+            change['data'] = objects.get((change['type'], change['id']))
+            if change['data'] is None:
+                # deleted since the change was read, its tombstone follows in a later page
+                del change['data']
+                change['op'] = ChangeLogDB.DELETE
+
+
+@change_api.route('', methods=['GET'])
+@conditional('change_log', 'session-players')
+def get_changes():
+    """Returns the changes made to the Games, Players, Sessions and SessionPlayers since a sequence number,
+    for clients that keep an offline copy to catch up without downloading everything again
+
+    Expects "since", the "next" of the previous response, and accepts "limit" (see get_limit).  Each
+    changed entity appears once, with its latest change: "seq", "type", "id", "op" (create, update or
+    delete) and, unless it was deleted, its current object as "data".  Without "since", only "next" is
+    returned: take it before downloading everything, and sync from it afterwards
+
+    :return 200 and a json object holding the "changes", the "next" value of since and whether there
+        are "more" changes after them, 400 if since is not a non-negative integer, or 410 if changes since
+        then are no longer kept and everything has to be downloaded again
+    """
+    if 'since' not in request.args:
+        return json_response({'changes': [], 'next': ChangeLogDB.get_high_water_mark(), 'more': False}), 200
+
+    since = request.args.get('since', type=int)
+    if since is None or since < 0:
+        abort(400, 'since must be a non-negative integer')
+
+    try:
+        changes, next_since, more = ChangeLogDB.get_changes(since, get_limit())
+    except ValueError:
+        abort(410, 'Changes since %d are no longer kept, download everything again' % since)
+
+    _add_data(changes)
+
+    return json_response({'changes': changes, 'next': next_since, 'more': more}), 200
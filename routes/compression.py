@@ -0,0 +1,245 @@
+from flask import current_app, request
+from routes.streaming import EVENT_STREAM_MIMETYPE
+from collections import OrderedDict
+import threading
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The mimetypes worth compressing, matched by prefix
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+# The number of bytes of a streamed response compressed between flushes, so rows reach the client in
+# batches of this size rather than all at the end, without flushing the compressor for every row
+STREAM_FLUSH_SIZE = 64 * 1024
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+
+class _GzipCompressor:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _ZstdCompressor:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+# The supported encodings, in order of preference when the client accepts several equally
+COMPRESSORS = OrderedDict([('br', _BrotliCompressor if brotli is not None else None),
+                           ('zstd', _ZstdCompressor if zstandard is not None else None),
+                           ('gzip', _GzipCompressor)])
+
+
+def available_encodings():
+    """Returns the encodings that can be used, in order of preference
+
+    gzip is always available, br requires the brotli package and zstd the zstandard package
+
+    :return A list of encoding names
+    :rtype list
+    """
+    return [encoding for encoding, compressor in COMPRESSORS.items() if compressor is not None]
+
+
+def compress(data, encoding):
+    """Compresses a whole body with the named encoding
+
+    :param data: The bytes to compress
+    :param encoding: The name of the encoding, one of available_encodings()
+    :return The compressed bytes
+    :rtype bytes
+    """
+    compressor = COMPRESSORS[encoding]()
+    return compressor.compress(data) + compressor.finish()
+
+
+def _compress_stream(chunks, encoding):
+    """Compresses the chunks of a streamed response as they are produced, flushing every STREAM_FLUSH_SIZE bytes
+    """
+    compressor = COMPRESSORS[encoding]()
+    pending = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+
+            compressed = compressor.compress(chunk)
+            pending += len(chunk)
+            if pending >= STREAM_FLUSH_SIZE:
+                compressed += compressor.flush()
+                pending = 0
+
+            if compressed:
+                yield compressed
+
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+class CompressedCache:
+    """A least recently used cache of compressed bodies, keyed by ETag and encoding, bounded by total size
+
+    :param max_bytes: The maximum combined size of the cached bodies
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+
+            self._entries[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+def _is_compressible(response):
+    if response.status_code < 200 or response.status_code >= 300 or response.status_code == 204:
+        return False
+
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return False
+
+    # every event has to reach the client as soon as it is sent
+    if response.mimetype == EVENT_STREAM_MIMETYPE:
+        return False
+
+    return response.mimetype is not None and response.mimetype.startswith(COMPRESSIBLE_MIMETYPES)
+
+
+def _compress_response(response):
+    """Compresses the response with the best encoding the client accepts, see init_app
+    """
+    encodings = current_app.config['BGT_COMPRESSION_ENCODINGS']
+    if not encodings:
+        return response
+
+    etag, weak = response.get_etag()
+
+    if response.status_code == 304:
+        # a client holding a compressed copy sent back its weak ETag, which is the one to confirm
+        if etag is not None and not weak and request.if_none_match.is_weak(etag):
+            response.set_etag(etag, weak=True)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    if not _is_compressible(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    encoding = request.accept_encodings.best_match(encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+    else:
+        body = response.get_data()
+        if len(body) < current_app.config['BGT_COMPRESSION_MIN_SIZE']:
+            return response
+
+        # the ETag identifies the uncompressed body, so it also identifies its compressed copies
+        cache = current_app.extensions['bgt_compression_cache'] if etag is not None else None
+        compressed = cache.get((etag, weak, encoding)) if cache is not None else None
+        if compressed is None:
+            compressed = compress(body, encoding)
+            if cache is not None:
+                cache.put((etag, weak, encoding), compressed)
+
+        response.set_data(compressed)
+
+    response.headers['Content-Encoding'] = encoding
+    if response.is_streamed:
+        response.headers.pop('Content-Length', None)
+
+    # the compressed bytes differ from the uncompressed ones, so the ETag only holds as a weak validator
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+def init_app(app):
+    """Compresses the JSON, NDJSON and text responses of the app with the best encoding the client accepts
+
+    The encoding is negotiated from the Accept-Encoding header among BGT_COMPRESSION_ENCODINGS (br, zstd
+    and gzip, where installed).  Bodies smaller than BGT_COMPRESSION_MIN_SIZE bytes are sent as they are.
+    Streamed responses are compressed chunk by chunk as they are sent, without buffering them.  Compressed
+    bodies of responses with an ETag are cached, up to BGT_COMPRESSION_CACHE_SIZE bytes, so an unchanged
+    list is only compressed once.  The ETag of a compressed response is made weak, as the representation
+    is equivalent but not byte for byte identical
+
+    :param app: The Flask app
+    :raise ValueError if BGT_COMPRESSION_ENCODINGS names an encoding that is not available
+    """
+    unsupported = set(app.config['BGT_COMPRESSION_ENCODINGS']) - set(available_encodings())
+    if unsupported:
+        raise ValueError('Unsupported compression encodings: %s' % ', '.join(sorted(unsupported)))
+
+    app.extensions['bgt_compression_cache'] = CompressedCache(app.config['BGT_COMPRESSION_CACHE_SIZE'])
+    app.after_request(_compress_response)
@@ -0,0 +1,46 @@
+from flask import make_response, request
+from functools import wraps
+from hashlib import sha1
+import model.VersionDB as VersionDB
+import model.live_scores as live_scores
+
+
+def conditional(*tables):
+    """Decorator adding ETag and If-None-Match support to a GET route
+
+    The ETag is derived from the versions of the tables the response is built from, along with the
+    request path, query string and Accept header.  If the client already holds the current ETag,
+    a 304 is returned without calling the route, so none of the rows are read
+
+    :param tables: The names of the tables the response of the route depends on
+    :return The decorator
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = VersionDB.get(*tables)
+            key = '|'.join(['%s=%d' % (table, versions[table]) for table in tables] +
+                           [request.full_path, request.headers.get('Accept', '')])
+            if 'session-players' in tables and live_scores.is_enabled():
+                # queued live scores are part of the response before they reach the table versions
+                fingerprint = live_scores.fingerprint()
+                if fingerprint is not None:
+                    key += '|live=' + fingerprint
+            etag = sha1(key.encode('utf-8')).hexdigest()
+
+            # compressed responses carry the ETag as a weak validator (see routes/compression.py)
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.vary.add('Accept')
+
+            return response
+
+        return wrapper
+
+    return decorator
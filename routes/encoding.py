@@ -0,0 +1,80 @@
+from flask import Response, current_app, jsonify
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+from datetime import date
+from functools import lru_cache
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@lru_cache(maxsize=4096)
+def _http_date(value):
+    # sessions share a few thousand distinct dates at most, so each one is only formatted once
+    return http_date(value)
+
+
+def _default(value):
+    """Serializes the values JSON has no type for, in the same way as the app's jsonify()
+    """
+    if isinstance(value, date):
+        return _http_date(value)
+
+    return DefaultJSONProvider.default(value)
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, default=_default, ensure_ascii=True, sort_keys=True, separators=(',', ':')).encode()
+
+
+def dumps(obj):
+    """Encodes the object exactly as the app's compact jsonify() would, but faster
+
+    Uses orjson when it is installed, and the standard library otherwise.  Dates are formatted as HTTP dates
+    and non-ASCII characters are escaped, as jsonify() does
+
+    :param obj: The object to encode, made of dicts, lists, strings, numbers, booleans, None and dates
+    :return The encoded object, without a trailing newline
+    :rtype bytes
+    """
+    if orjson is None:
+        return _stdlib_dumps(obj)
+
+    try:
+        encoded = orjson.dumps(obj, default=_default,
+                               option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+    except orjson.JSONEncodeError:
+        # e.g. integers beyond 64 bits, which the standard library handles
+        return _stdlib_dumps(obj)
+
+    # orjson always writes UTF-8, while jsonify() escapes everything beyond ASCII
+    return encoded if encoded.isascii() else _stdlib_dumps(obj)
+
+
+def is_compact():
+    """Returns whether the app serializes JSON with the default, compact settings that dumps() reproduces
+
+    :return False in debug mode (where jsonify() indents its output) or if the JSON settings were changed
+    :rtype bool
+    """
+    provider = current_app.json
+    if type(provider) is not DefaultJSONProvider or not provider.sort_keys or not provider.ensure_ascii:
+        return False
+
+    return provider.compact or (provider.compact is None and not current_app.debug)
+
+
+def json_response(obj):
+    """Builds a JSON response holding the object, byte for byte the same as jsonify(obj)
+
+    :param obj: The object to return, see dumps()
+    :return The response
+    :rtype Response
+    """
+    if not is_compact():
+        return jsonify(obj)
+
+    return Response(dumps(obj) + b'\n', mimetype=current_app.json.mimetype)
@@ -0,0 +1,56 @@
+from flask import abort, request
+
+
+def _get_names(arg, available):
+    names = {value.strip() for value in request.args[arg].split(',') if value.strip()}
+    if names - set(available):
+        abort(400, '%s must be a comma separated list of: %s' % (arg, ', '.join(available)))
+
+    # keep the order of available, so equivalent requests build identical queries
+    return tuple(name for name in available if name in names)
+
+
+def get_fields(available):
+    """Reads the "fields" query parameter of the current request, a comma separated list of the fields to return
+
+    :param available: The names of the fields of the resource
+    :return The requested fields, in the order of available, or all of them if "fields" was not provided
+    :rtype tuple
+    """
+    if 'fields' not in request.args:
+        return tuple(available)
+
+    fields = _get_names('fields', available)
+    if not fields:
+        abort(400, 'fields must name at least one of: %s' % ', '.join(available))
+
+    return fields
+
+
+def get_include(available, default=()):
+    """Reads the "include" query parameter of the current request, a comma separated list of the related
+    resources to embed
+
+    :param available: The names of the related resources that can be embedded
+    :param default: The related resources embedded when "include" is not provided
+    :return The requested related resources, in the order of available
+    :rtype tuple
+    """
+    if 'include' not in request.args:
+        return tuple(default)
+
+    return _get_names('include', available)
+
+
+def project(obj, fields):
+    """Returns only the requested fields of a serialized object
+
+    Only for objects that are already in memory (e.g. cached rows); objects read from the database
+    should have their fields selected by the query instead
+
+    :param obj: The serialized object
+    :param fields: The fields to keep
+    :return The object holding only the requested fields
+    :rtype dict
+    """
+    return {field: obj[field] for field in fields}
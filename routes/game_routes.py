@@ -1,22 +1,64 @@
 from flask import Blueprint, abort, jsonify, request
 import model.GameDB as GameDB
+import model.LeaderboardDB as LeaderboardDB
+from model.types import InvalidIdError
+from routes.batch import batch_response, get_ids, is_batch
+from routes.conditional import conditional
+from routes.fields import get_fields, project
+from routes.idempotency import idempotent
+from routes.pagination import get_limit
+from routes.streaming import stream_rows, wants_stream
 
 game_api = Blueprint('game_api', __name__)
 
 
 @game_api.route('', methods=['GET'])
+@conditional('game')
 def get_all():
     """Returns all of the Games that exist in the database
 
+    If "ids" is provided in the query string as a comma separated list, only those Games are returned,
+    in the requested order, as a json object holding "items" and the "missing" ids
+
+    If "stream=1" is provided in the query string, or application/x-ndjson is requested in the
+    Accept header, the result is streamed as newline delimited JSON with one object per line
+
+    If "fields" is provided in the query string as a comma separated list, only those fields of each
+    Game are returned
+
     :return the result as a json array
     """
-    return jsonify([game.to_obj() for game in GameDB.get_all()]), 200
+    fields = get_fields(GameDB.FIELDS)
+
+    if is_batch():
+        return jsonify(batch_response(*GameDB.get_many(get_ids()), fields=fields)), 200
+
+    # only the streamed rows come from the database, the others are served from the cache
+    if wants_stream():
+        return stream_rows(GameDB.iter_rows(fields=fields))
+
+    return jsonify([project(game.to_obj(), fields) for game in GameDB.get_all()]), 200
+
+
+@game_api.route('lookup', methods=['POST'])
+def lookup():
+    """Returns the Games specified by the list of "ids" in the JSON request body
+
+    Use this instead of GET with "ids" when there are too many ids to fit in a URL
+
+    :return 200 and a json object holding the "items" in the requested order and the "missing" ids,
+        or 400 if no list of ids was provided
+    """
+    return jsonify(batch_response(*GameDB.get_many(get_ids()), fields=get_fields(GameDB.FIELDS))), 200
 
 
 @game_api.route('<string:game_id>', methods=['GET'])
+@conditional('game')
 def get(game_id):
     """Returns the Game specified by the provided game_id
 
+    Accepts an optional "fields" query parameter, a comma separated list of the fields to return
+
     :param game_id: The id of the Game to return
     :return 200 and the specified Game object, or 404 if no Game was found with the specified id
     """
@@ -24,24 +66,51 @@ def get(game_id):
     if game_obj is None:
         abort(404, 'No Game found for given id!')
 
-    return jsonify(game_obj.to_obj()), 200
+    return jsonify(project(game_obj.to_obj(), get_fields(GameDB.FIELDS))), 200
+
+
+@game_api.route('<string:game_id>/leaderboard', methods=['GET'])
+@conditional('game', 'session', 'session-players', 'player_stats')
+def get_leaderboard(game_id):
+    """Returns the leaderboard of the Game specified by the provided game_id
+
+    Players are ranked by wins, then win rate, then best score, then average score.
+    Accepts an optional "limit" query parameter for the number of Players to return
+
+    :param game_id: The id of the Game to return the leaderboard of
+    :return 200 and the ranked Players as a json array, or 404 if no Game was found with the specified id
+    """
+    if GameDB.get(game_id) is None:
+        abort(404, 'No Game found for given id!')
+
+    leaderboard = []
+    for rank, stats in enumerate(LeaderboardDB.get(game_id, get_limit()), start=1):
+        entry = stats.to_obj()
+        entry['rank'] = rank
+        leaderboard.append(entry)
+
+    return jsonify(leaderboard), 200
 
 
 @game_api.route('', methods=['POST'])
+@idempotent
 def create():
     """Used to create a new Game.
 
     Expects the details of the Game in JSON format as part of the request body
     If no id is provided, an Id will be generated as part of the Game creation
 
-    :return 200 and the newly created Game or 400 if no request body was found
+    :return 200 and the newly created Game or 400 if no request body was found or the id is not a UUID
     """
     if not request.json:
         abort(400, 'No request body provided!')
 
-    game = GameDB.create(request.json['name'],
-                         request.json['scoring'],
-                         request.json['id'] if 'id' in request.json else None)
+    try:
+        game = GameDB.create(request.json['name'],
+                             request.json['scoring'],
+                             request.json['id'] if 'id' in request.json else None)
+    except InvalidIdError as error:
+        abort(400, str(error))
 
     return jsonify(game.to_obj()), 200
 
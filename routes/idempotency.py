@@ -0,0 +1,97 @@
+from flask import Response, abort, current_app, make_response, request
+from functools import wraps
+from hashlib import sha256
+import model.IdempotencyDB as IdempotencyDB
+import time
+
+# The maximum length of an Idempotency-Key
+MAX_KEY_LENGTH = 255
+
+# The shortest and longest pauses between checks on a key held by a request that is still running, in seconds
+WAIT_POLL_MIN = 0.02
+WAIT_POLL_MAX = 0.5
+
+
+def _fingerprint():
+    digest = sha256()
+    for part in (request.method.encode(), request.path.encode(), request.get_data()):
+        digest.update(part)
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+def _replay(record):
+    response = Response(record.body, status=record.status, mimetype=record.mimetype)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """Decorator adding Idempotency-Key support to a create route
+
+    The first request with a key runs the route, and a successful response is recorded against the key
+    for BGT_IDEMPOTENCY_TTL seconds.  Retries with the same key and body get the recorded response back
+    (with an "Idempotent-Replayed: true" header) without running the route again.  A retry that arrives
+    while the first request is still running waits up to BGT_IDEMPOTENCY_WAIT seconds for it to finish,
+    and gets a 409 if it does not.  Reusing a key for a different request is answered with a 422.
+    Responses that are not successful are not recorded, so retrying them runs the route again, unless the
+    route had already committed its writes.  A key whose route committed but never recorded its response
+    (e.g. the process died in between) is not run again either: retries get a 409 until the key expires
+
+    :param view: The route to decorate
+    :return The decorated route
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return view(*args, **kwargs)
+
+        if not key or len(key) > MAX_KEY_LENGTH:
+            abort(400, 'Idempotency-Key must be between 1 and %d characters' % MAX_KEY_LENGTH)
+
+        fingerprint = _fingerprint()
+        deadline = time.monotonic() + current_app.config['BGT_IDEMPOTENCY_WAIT']
+        pause = WAIT_POLL_MIN
+
+        while True:
+            record = IdempotencyDB.claim(key, fingerprint, current_app.config['BGT_IDEMPOTENCY_TTL'],
+                                         current_app.config['BGT_IDEMPOTENCY_MAX_KEYS'])
+            if record is None:
+                break
+
+            if record.fingerprint != fingerprint:
+                abort(422, 'The Idempotency-Key has already been used for a different request')
+
+            if record.status is not None:
+                return _replay(record)
+
+            if record.committed and record.created_at <= time.time() - IdempotencyDB.IDEMPOTENCY_PENDING_TIMEOUT:
+                abort(409, 'The request with this Idempotency-Key was applied, but its response was lost')
+
+            if time.monotonic() >= deadline:
+                response = make_response('A request with this Idempotency-Key is still in progress', 409)
+                response.headers['Retry-After'] = '1'
+                return response
+
+            time.sleep(pause)
+            pause = min(pause * 2, WAIT_POLL_MAX)
+
+        # from here on, every commit of the route also marks the key as committed, in the same transaction
+        IdempotencyDB.hold(key)
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            IdempotencyDB.release(key)
+            raise
+
+        if 200 <= response.status_code < 300 and not response.is_streamed:
+            IdempotencyDB.complete(key, response.status_code, response.mimetype, response.get_data())
+        elif not IdempotencyDB.release(key) and not response.is_streamed:
+            # the route wrote something before failing, so its response is the one to replay
+            IdempotencyDB.complete(key, response.status_code, response.mimetype, response.get_data())
+
+        return response
+
+    return wrapper
@@ -0,0 +1,13 @@
+from flask import Blueprint, Response
+import model.metrics as metrics
+
+metrics_api = Blueprint('metrics_api', __name__)
+
+
+@metrics_api.route('', methods=['GET'])
+def get():
+    """Returns the request latency, SQL, connection pool and cache metrics in the Prometheus text format
+
+    :return 200 and the metrics as text
+    """
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
@@ -0,0 +1,97 @@
+from flask import abort, request
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date
+import json
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def is_paginated():
+    """Returns whether the current request asked for a page rather than the full list
+
+    :return True if either "limit" or "after" was provided in the query string
+    :rtype bool
+    """
+    return 'limit' in request.args or 'after' in request.args
+
+
+def get_limit():
+    """Reads the "limit" query parameter of the current request
+
+    :return The requested page size, defaulting to DEFAULT_PAGE_SIZE
+    :rtype int
+    """
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if limit is None or limit < 1 or limit > MAX_PAGE_SIZE:
+        abort(400, 'limit must be between 1 and %d' % MAX_PAGE_SIZE)
+
+    return limit
+
+
+def encode_cursor(values):
+    """Encodes the key values of the last row of a page into an opaque cursor token
+
+    :param values: A list of key values (strings, numbers or dates), or None if there is no next page
+    :return The cursor token, or None if values was None
+    :rtype str
+    """
+    if values is None:
+        return None
+
+    encoded = json.dumps([value.isoformat() if isinstance(value, date) else value for value in values],
+                         separators=(',', ':'))
+    return urlsafe_b64encode(encoded.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token):
+    """Decodes a cursor token created by encode_cursor
+
+    Aborts the request with a 400 if the token is not a valid cursor
+
+    :param token: The cursor token provided by the client
+    :return The list of key values stored in the cursor
+    :rtype list
+    """
+    try:
+        values = json.loads(urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        abort(400, 'Invalid cursor provided!')
+
+    if not isinstance(values, list):
+        abort(400, 'Invalid cursor provided!')
+
+    return values
+
+
+def get_date_cursor():
+    """Reads the "after" query parameter of the current request as a (date, id) cursor
+
+    The date of the cursor is null when the last row of the previous page had no date
+
+    :return A tuple of the date (or None) and id to continue after, or None if no cursor was provided
+    :rtype tuple
+    """
+    token = request.args.get('after')
+    if not token:
+        return None
+
+    values = decode_cursor(token)
+    try:
+        return date.fromisoformat(values[0]) if values[0] is not None else None, values[1]
+    except (IndexError, TypeError, ValueError):
+        abort(400, 'Invalid cursor provided!')
+
+
+def page_response(items, next_values):
+    """Builds the body of a paginated list response
+
+    :param items: The serialized objects on the page
+    :param next_values: The key values of the last row on the page, or None if this was the last page
+    :return A dict holding the items and the cursor for the next page
+    :rtype dict
+    """
+    return {
+        'items': items,
+        'next': encode_cursor(next_values)
+    }
@@ -1,22 +1,64 @@
 from flask import Blueprint, abort, jsonify, request
+import model.GameDB as GameDB
 import model.PlayerDB as PlayerDB
+import model.PlayerStatsDB as PlayerStatsDB
+import model.RivalryDB as RivalryDB
+from routes.batch import batch_response, get_ids, is_batch
+from routes.conditional import conditional
+from routes.fields import get_fields, project
+from routes.idempotency import idempotent
+from routes.streaming import stream_rows, wants_stream
 
 player_api = Blueprint('player_api', __name__)
 
 
 @player_api.route('', methods=['GET'])
+@conditional('player')
 def get_all():
     """Returns all of the Players that exist in the database
 
+    If "ids" is provided in the query string as a comma separated list, only those Players are returned,
+    in the requested order, as a json object holding "items" and the "missing" ids
+
+    If "stream=1" is provided in the query string, or application/x-ndjson is requested in the
+    Accept header, the result is streamed as newline delimited JSON with one object per line
+
+    If "fields" is provided in the query string as a comma separated list, only those fields of each
+    Player are returned
+
     :return the result as a json array
     """
-    return jsonify([player.to_obj() for player in PlayerDB.get_all()]), 200
+    fields = get_fields(PlayerDB.FIELDS)
+
+    if is_batch():
+        return jsonify(batch_response(*PlayerDB.get_many(get_ids()), fields=fields)), 200
+
+    # only the streamed rows come from the database, the others are served from the cache
+    if wants_stream():
+        return stream_rows(PlayerDB.iter_rows(fields=fields))
+
+    return jsonify([project(player.to_obj(), fields) for player in PlayerDB.get_all()]), 200
+
+
+@player_api.route('lookup', methods=['POST'])
+def lookup():
+    """Returns the Players specified by the list of "ids" in the JSON request body
+
+    Use this instead of GET with "ids" when there are too many ids to fit in a URL
+
+    :return 200 and a json object holding the "items" in the requested order and the "missing" ids,
+        or 400 if no list of ids was provided
+    """
+    return jsonify(batch_response(*PlayerDB.get_many(get_ids()), fields=get_fields(PlayerDB.FIELDS))), 200
 
 
 @player_api.route('<string:player_id>', methods=['GET'])
+@conditional('player')
 def get(player_id):
     """Returns the Player specified by the provided player_id
 
+    Accepts an optional "fields" query parameter, a comma separated list of the fields to return
+
     :param player_id: The id of the Player to return
     :return 200 and the specified Player object, or 404 if no Player was found with the specified id
     """
@@ -24,10 +66,89 @@ def get(player_id):
     if player_obj is None:
         abort(404, 'No Player found for given id!')
 
-    return jsonify(player_obj.to_obj()), 200
+    return jsonify(project(player_obj.to_obj(), get_fields(PlayerDB.FIELDS))), 200
+
+
+@player_api.route('<string:player_id>/stats', methods=['GET'])
+@conditional('player', 'session', 'session-players', 'player_stats')
+def get_stats(player_id):
+    """Returns the statistics of the Player specified by the provided player_id
+
+    The statistics are maintained as SessionPlayers are written, so this does not scan the Player's history
+
+    :param player_id: The id of the Player to return the statistics of
+    :return 200 and the games played, wins, win rate, average score and favourite game of the Player,
+        or 404 if no Player was found with the specified id
+    """
+    if PlayerDB.get(player_id) is None:
+        abort(404, 'No Player found for given id!')
+
+    stats = PlayerStatsDB.get(player_id).to_obj()
+    stats['favourite_game_id'] = PlayerStatsDB.get_favourite_game(player_id)
+
+    return jsonify(stats), 200
+
+
+def _get_versus_game_id():
+    """Reads the optional "game_id" query parameter of a head-to-head request, aborting with 404 if no Game has it
+    """
+    game_id = request.args.get('game_id')
+    if game_id is not None and GameDB.get(game_id) is None:
+        abort(404, 'No Game found for given id!')
+
+    return game_id
+
+
+@player_api.route('versus', methods=['GET'])
+@conditional('player', 'game', 'session', 'session-players')
+def get_versus_matrix():
+    """Returns the head-to-head records between every pair of the Players listed in "ids"
+
+    Accepts an optional "game_id" query parameter to only count the Sessions of that Game.
+    The whole matrix is computed by a single query
+
+    :return 200 and a json object holding the "player_ids" found, the "matrix" of records (a row per Player,
+        with a record against each Player in the same order and null against itself) and the "missing" ids,
+        400 if no ids or too many were provided, or 404 if no Game was found with the specified game_id
+    """
+    ids = get_ids()
+    if not ids:
+        abort(400, 'Expected a comma separated list of "ids"!')
+
+    game_id = _get_versus_game_id()
+    players, missing = PlayerDB.get_many(ids)
+    player_ids = [player.id for player in players]
+
+    try:
+        matrix = RivalryDB.get_matrix(player_ids, game_id)
+    except ValueError as error:
+        abort(400, str(error))
+
+    return jsonify({'player_ids': player_ids, 'matrix': matrix, 'missing': missing}), 200
+
+
+@player_api.route('<string:player_id>/versus/<string:opponent_id>', methods=['GET'])
+@conditional('player', 'game', 'session', 'session-players')
+def get_versus(player_id, opponent_id):
+    """Returns the head-to-head record of a Player against an opponent
+
+    Accepts an optional "game_id" query parameter to only count the Sessions of that Game
+
+    :param player_id: The id of the Player
+    :param opponent_id: The id of the opponent
+    :return 200 and the shared sessions, wins, losses, ties and score deltas of the Player against the opponent,
+        or 404 if either Player, or the Game, was not found
+    """
+    player = PlayerDB.get(player_id)
+    opponent = PlayerDB.get(opponent_id)
+    if player is None or opponent is None:
+        abort(404, 'No Player found for given id!')
+
+    return jsonify(RivalryDB.get(player.id, opponent.id, _get_versus_game_id())), 200
 
 
 @player_api.route('', methods=['POST'])
+@idempotent
 def create():
     """Used to create a new Player.
 
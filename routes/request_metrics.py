@@ -0,0 +1,40 @@
+from flask import g, request
+import model.metrics as metrics
+import time
+
+
+def _start_timer():
+    metrics.ensure_dump_thread()
+    g._bgt_started = time.perf_counter()
+    # the number of SQL statements and the time spent in SQL, counted by model/metrics.py
+    g._bgt_sql = [0, 0.0]
+
+
+def _record(response):
+    started = g.pop('_bgt_started', None)
+    if started is None:
+        return response
+
+    endpoint = request.endpoint or 'unmatched'
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                    endpoint=endpoint, method=request.method, status=str(response.status_code))
+
+    # queries run while a streamed response is being sent are only counted in the totals
+    queries, seconds = g.pop('_bgt_sql')
+    metrics.REQUEST_QUERIES.observe(queries, endpoint=endpoint)
+    metrics.REQUEST_SQL_SECONDS.observe(seconds, endpoint=endpoint)
+
+    return response
+
+
+def init_app(app):
+    """Records the latency and SQL use of every request handled by the app, served at /metrics
+
+    Each request is labelled with its endpoint (blueprint and view name), method and status code.
+    See model/metrics.py for the metrics themselves, and BGT_METRICS_DIR for apps served by several processes
+
+    :param app: The Flask app to instrument
+    """
+    metrics.configure(app)
+    app.before_request(_start_timer)
+    app.after_request(_record)
@@ -1,50 +1,90 @@
 from flask import Blueprint, abort, jsonify, request
 import model.SessionPlayersDB as SessionPlayersDB
+import model.live_scores as live_scores
+from model.types import InvalidIdError
+from routes.conditional import conditional
+from routes.encoding import json_response
+from routes.fields import get_fields
+from routes.idempotency import idempotent
+from routes.pagination import get_date_cursor, get_limit, is_paginated, page_response
+from routes.streaming import stream_rows, wants_stream
+from sqlalchemy.exc import OperationalError
+import logging
+
+logger = logging.getLogger('bgt-backend.session-players')
 
 session_players_api = Blueprint('session_players_api', __name__)
 
 
 @session_players_api.route('', methods=['GET'])
+@conditional('session-players', 'session')
 def get_all():
     """Returns all of the SessionPlayers that exist in the database
 
-    :return the result as a json array
+    If "stream=1" is provided in the query string, or application/x-ndjson is requested in the
+    Accept header, the result is streamed as newline delimited JSON with one object per line
+
+    If "limit" and/or "after" are provided in the query string, a single page of SessionPlayers
+    (ordered by the date of their Session, then id) is returned along with the cursor to pass as
+    "after" for the next page
+
+    If "fields" is provided in the query string as a comma separated list, only those fields of each
+    SessionPlayers are read and returned
+
+    :return the result as a json array, or a json object holding "items" and "next" when paginated
     """
-    return jsonify([session_players.to_obj() for session_players in SessionPlayersDB.get_all()]), 200
+    fields = get_fields(SessionPlayersDB.ROW_KEYS)
+
+    # read only, so the SessionPlayers are fetched as plain rows rather than model objects
+    if wants_stream():
+        return stream_rows(SessionPlayersDB.iter_rows(fields=fields))
+
+    if is_paginated():
+        session_players, next_key = SessionPlayersDB.get_page_rows(get_limit(), get_date_cursor(), fields)
+        return json_response(page_response(session_players, next_key)), 200
+
+    return json_response(list(SessionPlayersDB.iter_rows(fields=fields))), 200
 
 
 @session_players_api.route('<string:session_players_id>', methods=['GET'])
+@conditional('session-players', 'session')
 def get(session_players_id):
     """Returns the SessionPlayers specified by the provided session_players_id
 
+    Accepts an optional "fields" query parameter, a comma separated list of the fields to return
+
     :param session_players_id: The id of the SessionPlayers to return
     :return 200 and the specified SessionPlayers object, or 404 if no SessionPlayers was found with the specified id
     """
-    session_players_obj = SessionPlayersDB.get(session_players_id)
-    if session_players_obj is None:
+    session_players = SessionPlayersDB.get_row(session_players_id, get_fields(SessionPlayersDB.ROW_KEYS))
+    if session_players is None:
         abort(404, 'No SessionPlayers found for given id!')
 
-    return jsonify(session_players_obj.to_obj()), 200
+    return json_response(session_players), 200
 
 
 @session_players_api.route('', methods=['POST'])
+@idempotent
 def create():
     """Used to create a new SessionPlayers.
 
     Expects the details of the SessionPlayers in JSON format as part of the request body
     If no id is provided, an Id will be generated as part of the SessionPlayers creation
 
-    :return 200 and the newly created SessionPlayers or 400 if no request body was found
+    :return 200 and the newly created SessionPlayers or 400 if no request body was found or an id is not a UUID
     """
     if not request.json:
         abort(400, 'No request body provided!')
 
-    session_players = SessionPlayersDB.create(request.json['session_id'],
-                                              request.json['player_id'],
-                                              request.json['score'],
-                                              request.json['team'],
-                                              request.json['winner'],
-                                              request.json['id'] if 'id' in request.json else None)
+    try:
+        session_players = SessionPlayersDB.create(request.json['session_id'],
+                                                  request.json['player_id'],
+                                                  request.json['score'],
+                                                  request.json['team'],
+                                                  request.json['winner'],
+                                                  request.json['id'] if 'id' in request.json else None)
+    except InvalidIdError as error:
+        abort(400, str(error))
 
     return jsonify(session_players.to_obj()), 200
 
@@ -56,13 +96,39 @@ def update(session_players_id):
     Expects either (or any combination) of "session_id", "player_id", "score",
         "team", "winner' to be provided in the request body
 
+    When live scoring is enabled (BGT_LIVE_SCORING) and only "score", "team" and/or "winner" are provided,
+    the update is queued and written with others in the next batch (see model/live_scores.py)
+
     :param session_players_id: the id of the SessionPlayers to be updated
-    :return 200 and the updated SessionPlayers, 400 if no request body has been provided
+    :return 200 and the updated SessionPlayers, 202 and the SessionPlayers as it will be once a queued update
+        is written, 400 if no request body has been provided, an id is not a UUID or a queued value does not
+        fit its column,
         404 if the specified SessionPlayers cannot be found
     """
     if not request.json:
         abort(400, 'No request body provided')
 
+    if live_scores.is_enabled():
+        if set(request.json) <= set(live_scores.FIELDS):
+            session_players = SessionPlayersDB.get_row(session_players_id)
+            if session_players is None:
+                abort(404, 'Could not find SessionPlayers with the provided id')
+
+            values = {field: request.json[field] for field in live_scores.FIELDS if request.json.get(field) is not None}
+            try:
+                session_players.update(live_scores.enqueue(session_players['id'], values, session_players))
+            except ValueError as error:
+                abort(400, str(error))
+            return jsonify(session_players), 202
+
+        # the scores queued in this worker are written first, so they reach the database in order.  If the
+        # database is locked they stay queued for the next flush, which keeps the fields changed by this update
+        try:
+            live_scores.flush()
+        except OperationalError:
+            logger.warning('Could not write the queued live scores before updating %s', session_players_id,
+                           exc_info=True)
+
     try:
         session_players = SessionPlayersDB.update(session_players_id,
                                                   request.json['session_id'] if 'session_id' in request.json else None,
@@ -71,6 +137,8 @@ def update(session_players_id):
                                                   request.json['team'] if 'team' in request.json else None,
                                                   request.json['winner'] if 'winner' in request.json else None)
         return jsonify(session_players.to_obj()), 200
+    except InvalidIdError as error:
+        abort(400, str(error))
     except ValueError:
         abort(404, 'Could not find SessionPlayers with the provided id')
 
@@ -1,58 +1,293 @@
-from flask import Blueprint, abort, jsonify, request
+from flask import Blueprint, Response, abort, jsonify, request
+import model.ChangeLogDB as ChangeLogDB
+import model.ImportDB as ImportDB
 import model.SessionDB as SessionDB
 import model.SessionPlayersDB as SessionPlayerDB
+import model.session_events as session_events
+from model.types import InvalidIdError
+from routes.batch import get_ids, is_batch
+from routes.conditional import conditional
+from routes.encoding import json_response
+from routes.fields import get_fields, get_include
+from routes.idempotency import idempotent
+from routes.pagination import get_date_cursor, get_limit, is_paginated, page_response
+from routes.streaming import EVENT_STREAM_MIMETYPE, format_event, stream_rows, wants_stream
+from datetime import date
+import io
+import logging
 
 session_api = Blueprint('session_api', __name__)
 
+logger = logging.getLogger('bgt-backend.sessions')
+
+# The number of seconds between the comments sent to keep an idle event stream open
+EVENTS_KEEPALIVE_INTERVAL = 15
+
+# The number of milliseconds a client waits before reconnecting to an event stream that ended
+EVENTS_RETRY = 2000
+
 
 @session_api.route('', methods=['GET'])
+@conditional('session', 'session-players', 'game')
 def get_all():
     """Returns all of the Sessions that exist in the database
 
-    :return the result as a json array
+    If "ids" is provided in the query string as a comma separated list, only those Sessions are returned,
+    in the requested order, as a json object holding "items" and the "missing" ids
+
+    If "stream=1" is provided in the query string, or application/x-ndjson is requested in the
+    Accept header, the result is streamed as newline delimited JSON with one object per line
+
+    If "limit" and/or "after" are provided in the query string, a single page of Sessions
+    (ordered by date, then id) is returned along with the cursor to pass as "after" for the next page
+
+    The Sessions can be filtered with "from" and "to" (ISO dates, inclusive), "game_id" and "player_id"
+    in the query string, and "order=desc" returns the newest Sessions first.  The filters apply to the
+    streamed, paginated and full results alike
+
+    See _get_projection for the "fields" and "include" query parameters, which apply to every result
+
+    :return the result as a json array, or a json object holding "items" and "next" when paginated
     """
-    return jsonify([session.to_obj() for session in SessionDB.get_all()]), 200
+    fields, include = _get_projection()
+
+    # read only, so the Sessions are fetched as plain rows rather than model objects
+    if is_batch():
+        return json_response(_batch_rows(get_ids(), fields, include)), 200
+
+    filters = _get_filters()
+
+    if wants_stream():
+        return stream_rows(SessionDB.iter_rows(fields=fields, include=include, **filters))
+
+    if is_paginated():
+        sessions, next_key = SessionDB.get_page_rows(get_limit(), get_date_cursor(), fields, include, **filters)
+        return json_response(page_response(sessions, next_key)), 200
+
+    return json_response(list(SessionDB.iter_rows(fields=fields, include=include, **filters))), 200
+
+
+def _get_projection():
+    """Reads the fields and related resources to return from the query string of the current request
+
+    "fields" is a comma separated list of the fields of each Session to return (id, date and game_id), and
+    "include" a comma separated list of the related resources to embed: "players" and/or "game".  Without
+    "include", the players are embedded unless "fields" is provided.  Only the columns and related
+    resources that were asked for are read from the database
+
+    :return The fields and related resources, as accepted by SessionDB.iter_rows
+    :rtype tuple
+    """
+    fields = get_fields(SessionDB.FIELDS)
+    default_include = SessionDB.DEFAULT_INCLUDE if 'fields' not in request.args else ()
+
+    return fields, get_include(SessionDB.INCLUDES, default_include)
+
+
+def _batch_rows(session_ids, fields, include):
+    sessions, missing = SessionDB.get_many_rows(session_ids, fields, include)
+    return {'items': sessions, 'missing': missing}
+
+
+def _get_filters():
+    """Reads the Session filters from the query string of the current request
+
+    :return The filters, as accepted by SessionDB.iter_rows
+    :rtype dict
+    """
+    filters = {}
+
+    for arg, name in (('from', 'date_from'), ('to', 'date_to')):
+        if request.args.get(arg):
+            try:
+                filters[name] = date.fromisoformat(request.args[arg])
+            except ValueError:
+                abort(400, '%s must be a date in the format YYYY-MM-DD' % arg)
+
+    for name in ('game_id', 'player_id'):
+        if request.args.get(name):
+            filters[name] = request.args[name]
+
+    order = request.args.get('order', 'asc').lower()
+    if order not in ('asc', 'desc'):
+        abort(400, 'order must be either asc or desc')
+    filters['descending'] = order == 'desc'
+
+    return filters
+
+
+@session_api.route('lookup', methods=['POST'])
+def lookup():
+    """Returns the Sessions specified by the list of "ids" in the JSON request body
+
+    Use this instead of GET with "ids" when there are too many ids to fit in a URL
+
+    :return 200 and a json object holding the "items" in the requested order and the "missing" ids,
+        or 400 if no list of ids was provided
+    """
+    return json_response(_batch_rows(get_ids(), *_get_projection())), 200
 
 
 @session_api.route('<string:session_id>', methods=['GET'])
+@conditional('session', 'session-players', 'game')
 def get(session_id):
     """Returns the Session specified by the provided session_id
 
+    Accepts the "fields" and "include" query parameters, see _get_projection
+
     :param session_id: The id of the Session to return
     :return 200 and the specified Session object, or 404 if no Session was found with the specified id
     """
-    session_obj = SessionDB.get(session_id)
-    if session_obj is None:
+    sessions, missing = SessionDB.get_many_rows([session_id], *_get_projection())
+    if not sessions:
+        abort(404, 'No Session found for given id!')
+
+    return json_response(sessions[0]), 200
+
+
+@session_api.route('<string:session_id>/events', methods=['GET'])
+def events(session_id):
+    """Streams the changes to the players of the specified Session as Server-Sent Events
+
+    The stream starts with a "snapshot" event holding every SessionPlayers of the Session, followed by a
+    "player" event holding the SessionPlayers whenever one is created or its score, team or winner change,
+    a "removed" event holding the id of one that was deleted or moved to another Session, and a "deleted"
+    event if the Session itself is deleted, which ends the stream.  Changes are pushed once committed, within
+    BGT_SESSION_EVENTS_INTERVAL milliseconds, whichever worker process committed them.
+
+    A client reconnecting with a Last-Event-ID header only gets the SessionPlayers changed since then, or a
+    new "snapshot" when they cannot be worked out from the change log.  A client too slow to keep up gets a
+    "reset" event, which ends the stream so it reconnects
+
+    :param session_id: The id of the Session to watch
+    :return 200 and the text/event-stream, or 404 if no Session was found with the specified id
+    """
+    try:
+        last_event_id = int(request.headers['Last-Event-ID'])
+    except (KeyError, ValueError):
+        last_event_id = None
+
+    # the high-water mark is read first, so any change committed while the players are read is also sent later
+    high_water_mark = ChangeLogDB.get_high_water_mark()
+
+    sessions, missing = SessionDB.get_many_rows([session_id], ('id',), ('players',))
+    if not sessions:
         abort(404, 'No Session found for given id!')
+    players = sessions[0]['players']
+
+    initial = session_events.replay(sessions[0]['id'], last_event_id, high_water_mark) \
+        if last_event_id is not None else None
+    if initial is None:
+        initial = [(session_events.SNAPSHOT, high_water_mark, players)]
+
+    subscription = session_events.subscribe(sessions[0]['id'], high_water_mark,
+                                            [player['id'] for player in players])
+
+    def generate():
+        yield b'retry: %d\n\n' % EVENTS_RETRY
+        for event, seq, data in initial:
+            yield format_event(event, data, seq)
 
-    return jsonify(session_obj.to_obj()), 200
+        while True:
+            published = subscription.get(EVENTS_KEEPALIVE_INTERVAL)
+            if published is None:
+                yield b': keep-alive\n\n'
+                continue
+
+            event, seq, data = published
+            if event == session_events.RESET:
+                # without an id, the client reconnects from the last event it did get
+                yield format_event(event, data)
+                return
+
+            yield format_event(event, data, seq)
+            if event == session_events.DELETED:
+                return
+
+    # nothing is read once streaming starts, so the request's database connection is released straight away
+    response = Response(generate(), mimetype=EVENT_STREAM_MIMETYPE)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(lambda: session_events.unsubscribe(subscription))
+
+    return response
 
 
 @session_api.route('', methods=['POST'])
+@idempotent
 def create():
     """Used to create a new Session.
 
     Expects the details of the Session in JSON format as part of the request body
     If no id is provided, an Id will be generated as part of the Session creation
 
-    :return 200 and the newly created Session or 400 if no request body was found
+    :return 200 and the newly created Session or 400 if no request body was found, an id is not a UUID or
+        players is not a list of objects
     """
     if not request.json:
         abort(400, 'No request body provided!')
 
-    session = SessionDB.create(request.json['date'],
-                               request.json['game_id'],
-                               request.json['id'] if 'id' in request.json else None)
+    players = request.json.get('players', [])
+    if not isinstance(players, list) or not all(isinstance(player, dict) for player in players):
+        abort(400, 'players must be a list of objects!')
+
+    # when players are provided, the Session and its players are written in a single transaction
+    try:
+        session = SessionDB.create(request.json['date'],
+                                   request.json['game_id'],
+                                   request.json['id'] if 'id' in request.json else None,
+                                   commit='players' not in request.json)
+    except InvalidIdError as error:
+        abort(400, str(error))
 
     if 'players' in request.json:
-        print("Found Players!")
-        SessionPlayerDB.merge_all(session.id, request.json['players'])
+        logger.debug('Creating session %s with %d players', session.id, len(players))
+        try:
+            SessionPlayerDB.merge_all(session.id, players)
+        except InvalidIdError as error:
+            abort(400, str(error))
+        except ValueError:
+            abort(400, 'Each player requires a player_id!')
     else:
-        print('No players Here!')
+        logger.debug('Creating session %s without players', session.id)
 
     return jsonify(session.to_obj()), 200
 
 
+@session_api.route('import', methods=['POST'])
+def import_sessions():
+    """Imports historical Sessions from an uploaded CSV or NDJSON file
+
+    The file is either uploaded as the "file" field of a multipart form, or sent as the raw request body.
+    The format is taken from the "format" query parameter ("csv" or "ndjson") if provided, otherwise it
+    is detected from the file name or content type.  See ImportDB.parse_csv and ImportDB.parse_ndjson
+    for the expected layout of each format
+
+    :return 200 and a summary of the import (including any per-line errors), or 400 if no file was provided
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        stream = upload.stream
+        file_format = 'csv' if upload.filename.lower().endswith('.csv') or 'csv' in upload.mimetype else 'ndjson'
+    elif request.content_length or 'chunked' in request.headers.get('Transfer-Encoding', ''):
+        stream = request.stream
+        file_format = 'csv' if 'csv' in request.mimetype else 'ndjson'
+    else:
+        abort(400, 'No file provided!')
+
+    file_format = request.args.get('format', file_format).lower()
+    if file_format not in ('csv', 'ndjson'):
+        abort(400, 'format must be either csv or ndjson')
+
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    parse = ImportDB.parse_csv if file_format == 'csv' else ImportDB.parse_ndjson
+
+    try:
+        return jsonify(ImportDB.import_sessions(parse(lines))), 200
+    except UnicodeDecodeError:
+        abort(400, 'The file must be UTF-8 encoded')
+
+
 @session_api.route('<string:session_id>', methods=['PUT'])
 def update(session_id):
     """Updates the specified Session with the contents of the request body (in JSON)
@@ -60,7 +295,7 @@ def update(session_id):
     Expects either (or both) of "date" and "game_id" to be provided in the request body
 
     :param session_id: the id of the Session to be updated
-    :return 200 and the updated Session, 400 if no request body has been provided
+    :return 200 and the updated Session, 400 if no request body has been provided or the game_id is not a UUID,
         404 if the specified Session cannot be found
     """
     if not request.json:
@@ -71,6 +306,8 @@ def update(session_id):
                                    request.json['date'] if 'date' in request.json else None,
                                    request.json['game_id'] if 'game_id' in request.json else None)
         return jsonify(session.to_obj()), 200
+    except InvalidIdError as error:
+        abort(400, str(error))
     except ValueError:
         abort(404, 'Could not find Session with the provided id')
 
@@ -0,0 +1,18 @@
+from flask import Blueprint, current_app, jsonify
+from model.cache import caches
+import os
+
+status_api = Blueprint('status_api', __name__)
+
+
+@status_api.route('', methods=['GET'])
+def get():
+    """Returns the status of this worker process, including the counters of its caches
+
+    :return 200 and the status as a json object
+    """
+    return jsonify({
+        'pid': os.getpid(),
+        'startup_seconds': current_app.config.get('BGT_STARTUP_SECONDS'),
+        'caches': {table: cache.stats() for table, cache in caches.items()}
+    }), 200
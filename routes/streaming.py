@@ -0,0 +1,52 @@
+from flask import Response, request, stream_with_context
+from routes.encoding import dumps
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+EVENT_STREAM_MIMETYPE = 'text/event-stream'
+
+
+def wants_stream():
+    """Returns whether the current request asked for a streamed NDJSON response
+
+    A stream is requested either with "stream=1" in the query string or by preferring
+    application/x-ndjson over application/json in the Accept header
+
+    :return True if the response should be streamed as NDJSON
+    :rtype bool
+    """
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return True
+
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def stream_rows(rows):
+    """Builds a streamed NDJSON response holding one line per row
+
+    The rows are serialized lazily as the response is sent, so an iterator that fetches its rows
+    in chunks keeps the memory use flat no matter how many rows there are
+
+    :param rows: An iterable of plain dicts in the format of to_obj(), such as returned by iter_rows()
+    :return A streamed response with the application/x-ndjson mimetype
+    :rtype Response
+    """
+    def generate():
+        for row in rows:
+            yield dumps(row) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def format_event(event, data, event_id=None):
+    """Formats a single Server-Sent Event
+
+    :param event: The name of the event
+    :param data: The data of the event, serialized as JSON
+    :param event_id: If provided, the id of the event, which the client sends back as Last-Event-ID when it reconnects
+    :return The event, ready to be written to a text/event-stream response
+    :rtype bytes
+    """
+    lines = [b'id: %d' % event_id] if event_id is not None else []
+    lines += [b'event: ' + event.encode('utf-8'), b'data: ' + dumps(data)]
+
+    return b'\n'.join(lines) + b'\n\n'
@@ -0,0 +1,177 @@
+from model import metrics
+from model.database import db
+from werkzeug.serving import make_server
+import logging
+import os
+import signal
+import socket
+import shutil
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger('bgt-backend.server')
+
+# How long to wait for workers to finish their requests when shutting down, in seconds
+SHUTDOWN_TIMEOUT = 10
+
+# A worker that exits within this many seconds of being started is counted as failing to start
+WORKER_MIN_UPTIME = 5
+
+# The pause before restarting a worker that failed to start, doubled for each failure in a row, in seconds
+RESTART_BACKOFF_MIN = 0.5
+RESTART_BACKOFF_MAX = 30
+
+# The number of times in a row a worker can fail to start before the server gives up and stops
+MAX_START_FAILURES = 10
+
+
+def _run_worker(app, listener, number):
+    """Serves requests on the shared listening socket until told to stop.  Runs in a forked child
+    """
+    started = time.perf_counter()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # the pooled connections (if any) belong to the parent, so this worker opens its own
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+    server = make_server(listener.getsockname()[0], listener.getsockname()[1], app,
+                         threaded=True, fd=listener.fileno())
+    logger.info('Worker %d (pid %d) ready in %.1f ms', number, os.getpid(), (time.perf_counter() - started) * 1000)
+
+    # serve_forever returns once a KeyboardInterrupt is raised by the signal handler
+    server.serve_forever()
+
+
+def _spawn(app, listener, number):
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            _run_worker(app, listener, number)
+        except Exception:
+            logger.exception('Worker %d failed', number)
+            status = 1
+
+        # unwind and exit normally so the exit handlers of this worker run, never returning to the parent loop
+        sys.exit(status)
+
+    return pid
+
+
+def serve(app, host='127.0.0.1', port=5000, workers=None, backlog=1024):
+    """Serves the app with a pre-forked pool of worker processes sharing one listening socket
+
+    The app is created once in the parent and inherited by each worker, so starting or restarting a worker
+    only costs a fork.  Workers share no state beyond the database: each one opens its own connections.
+    A worker that dies is replaced, after a pause that grows while it keeps failing to start (e.g. the
+    database is unreachable), and the server stops after MAX_START_FAILURES such failures in a row.
+    SIGTERM or SIGINT stops every worker and then the parent
+
+    Each worker writes its metrics to BGT_METRICS_DIR (or a temporary directory if that is not configured),
+    so that /metrics reports the sum of every worker no matter which one answers the scrape
+
+    :param app: The Flask app to serve, as returned by create_app
+    :param host: The address to listen on
+    :param port: The port to listen on
+    :param workers: The number of worker processes, defaulting to the number of CPUs
+    :param backlog: The size of the listening socket's queue of pending connections
+    :raise SystemExit if a worker keeps failing to start
+    """
+    workers = workers or os.cpu_count() or 1
+
+    listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    listener.set_inheritable(True)
+
+    metrics_dir = app.config.get('BGT_METRICS_DIR') or tempfile.mkdtemp(prefix='bgt-metrics-')
+    metrics.use_directory(metrics_dir)
+
+    # make sure no connections opened while creating the app are shared with the workers
+    with app.app_context():
+        db.engine.dispose()
+
+    # the number of each worker by pid, when each number was last started, how many times in a row
+    # it failed to start, and when the numbers waiting to be restarted are due
+    children = {}
+    started = {}
+    failures = {}
+    restarts = {number: 0 for number in range(workers)}
+    logger.info('Serving on %s:%d with %d workers', host, port, workers)
+
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    deadline = None
+    while children or (restarts and not stopping):
+        if stopping and deadline is None:
+            deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+
+        if deadline is not None and time.monotonic() > deadline:
+            for pid in children:
+                os.kill(pid, signal.SIGKILL)
+
+        for number, due in list(restarts.items()):
+            if not stopping and due <= time.monotonic():
+                del restarts[number]
+                started[number] = time.monotonic()
+                children[_spawn(app, listener, number)] = number
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG if deadline is not None or restarts else 0)
+        except InterruptedError:
+            continue
+        except ChildProcessError:
+            pid = 0
+
+        if pid == 0:
+            time.sleep(0.05)
+            continue
+
+        number = children.pop(pid, None)
+        metrics.retire(pid)
+        if number is None or stopping:
+            continue
+
+        if time.monotonic() - started[number] < WORKER_MIN_UPTIME:
+            failures[number] = failures.get(number, 0) + 1
+        else:
+            failures[number] = 0
+
+        if failures[number] >= MAX_START_FAILURES:
+            logger.error('Worker %d (pid %d) exited with status %d, failing to start %d times in a row, stopping',
+                         number, pid, status, failures[number])
+            stop(None, None)
+            continue
+
+        delay = min(RESTART_BACKOFF_MIN * 2 ** (failures[number] - 1), RESTART_BACKOFF_MAX) \
+            if failures[number] else 0
+        logger.warning('Worker %d (pid %d) exited with status %d, restarting it in %.1f s',
+                       number, pid, status, delay)
+        restarts[number] = time.monotonic() + delay
+
+    listener.close()
+
+    if not app.config.get('BGT_METRICS_DIR'):
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    if any(count >= MAX_START_FAILURES for count in failures.values()):
+        raise SystemExit(1)
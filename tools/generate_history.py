@@ -0,0 +1,304 @@
+"""Generates a realistic, reproducible play history for scale and load testing
+
+Run from the root of the repository against an empty (or new) database, for example:
+
+    python -m tools.generate_history --database sqlite:////tmp/bgt-large.db --sessions 5000000 --seed 7
+
+The same seed and scale always produce exactly the same rows, ids included
+"""
+from application import create_app
+from model.database import db
+from model.models import Game, Player, Session, SessionPlayers
+import model.ChangeLogDB as ChangeLogDB
+import model.PlayerStatsDB as PlayerStatsDB
+import model.VersionDB as VersionDB
+from sqlalchemy import insert
+from argparse import ArgumentParser
+from bisect import bisect
+from datetime import date, timedelta
+from itertools import accumulate
+import logging
+import random
+import time
+
+logger = logging.getLogger('bgt-backend.generate-history')
+
+# The number of Sessions written by each transaction
+GENERATE_BATCH_SIZE = 20000
+
+# The exponent of the Zipf distribution of game popularity, higher values concentrate play on fewer games
+GAME_POPULARITY_EXPONENT = 1.1
+
+# The exponent of the Zipf distribution of how often each group of players meets
+GROUP_ACTIVITY_EXPONENT = 0.8
+
+# The share of Sessions played with a game that is not one of the group's favourites
+OTHER_GAME_SHARE = 0.2
+
+# The chance of each player of a Session being a guest from outside the group
+GUEST_SHARE = 0.1
+
+# The chance of a Session ending in a tie
+TIE_SHARE = 0.03
+
+# The kinds of games generated, with the share of games of each kind
+GAME_KINDS = (('points', 0.65), ('team', 0.2), ('win-loss', 0.15))
+
+MIN_PLAYERS = 2
+MAX_PLAYERS = 8
+
+
+def _uuid(rng):
+    """Returns a random (version 4) uuid string drawn from rng, so it is reproducible from the seed
+    """
+    value = rng.getrandbits(128) & 0xffffffffffff0fff3fffffffffffffff | 0x00000000000040008000000000000000
+    digits = '%032x' % value
+    return '%s-%s-%s-%s-%s' % (digits[:8], digits[8:12], digits[12:16], digits[16:20], digits[20:])
+
+
+def _zipf_weights(count, exponent):
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def _pick(rng, items, cumulative_weights):
+    return items[bisect(cumulative_weights, rng.random() * cumulative_weights[-1])]
+
+
+class _Game:
+    def __init__(self, rng, number):
+        self.id = _uuid(rng)
+        self.name = 'Game %d' % (number + 1)
+        self.kind = _pick(rng, [kind for kind, share in GAME_KINDS],
+                          list(accumulate(share for kind, share in GAME_KINDS)))
+        self.min_players = rng.randint(MIN_PLAYERS, 4)
+        self.max_players = rng.randint(max(self.min_players, 4 if self.kind == 'team' else 2), MAX_PLAYERS)
+        self.mean_score = rng.randint(20, 150)
+        self.score_deviation = max(1, self.mean_score // rng.randint(3, 8))
+
+
+class _Group:
+    def __init__(self, rng, members, games, game_weights):
+        self.members = members
+        self.favourites = list({_pick(rng, games, game_weights) for _ in range(rng.randint(3, 8))})
+        self.favourites.sort(key=lambda game: game.name)
+
+
+def _play(rng, game, player_ids, session_id):
+    """Returns the SessionPlayers rows of one play of the game by the players
+    """
+    rows = [{'id': _uuid(rng), 'session_id': session_id, 'player_id': player_id,
+             'score': None, 'team': None, 'winner': False} for player_id in player_ids]
+    tie = rng.random() < TIE_SHARE
+
+    if game.kind == 'points':
+        for row in rows:
+            row['score'] = max(0, int(rng.gauss(game.mean_score, game.score_deviation)))
+        rows.sort(key=lambda row: row['score'], reverse=True)
+        if tie:
+            rows[1]['score'] = rows[0]['score']
+        best = rows[0]['score']
+        for row in rows:
+            row['winner'] = row['score'] == best
+    elif game.kind == 'team':
+        teams = 3 if len(rows) >= 6 and rng.random() < 0.25 else 2
+        rng.shuffle(rows)
+        for number, row in enumerate(rows):
+            row['team'] = number % teams + 1
+        # a drawn team game has no winners
+        if not tie:
+            winning_team = rng.randint(1, teams)
+            for row in rows:
+                row['winner'] = row['team'] == winning_team
+    else:
+        for row in rng.sample(rows, 2 if tie else 1):
+            row['winner'] = True
+
+    return rows
+
+
+def generate(sessions=None, session_players=None, games=None, players=None, seed=1,
+             start=date(2010, 1, 1), days=3650, batch_size=GENERATE_BATCH_SIZE):
+    """Writes a synthetic play history to the database of the current app, then rebuilds the statistics
+
+    Game popularity follows a Zipf distribution.  Players form recurring groups that each favour a few
+    games and meet at different rates, with the occasional guest.  Each Session has between 2 and 8
+    players (within the limits of its game) and is either scored, played in teams or simply won, with a
+    small share of ties.  Every row is written with bulk inserts, GENERATE_BATCH_SIZE Sessions per
+    transaction, and the same arguments always write the same rows
+
+    :param sessions: The number of Sessions to generate
+    :param session_players: If provided instead of sessions, Sessions are generated until there are
+        at least this many SessionPlayers
+    :param games: The number of Games, derived from the number of Sessions if not provided
+    :param players: The number of Players, derived from the number of Sessions if not provided
+    :param seed: The seed of the random number generator
+    :param start: The date of the earliest Session
+    :param days: The number of days the Sessions are spread over
+    :param batch_size: The number of Sessions written by each transaction
+    :return A dict holding the number of games, players, sessions and session players written
+    :rtype dict
+    :raise ValueError if neither sessions nor session_players is provided
+    """
+    if sessions is None and session_players is None:
+        raise ValueError('Either sessions or session_players is required')
+
+    rng = random.Random(seed)
+    expected_sessions = sessions if sessions is not None else session_players // 4
+    games = games or max(10, min(5000, expected_sessions // 200))
+    players = players or max(20, expected_sessions // 20)
+
+    game_list = [_Game(rng, number) for number in range(games)]
+    game_weights = _zipf_weights(games, GAME_POPULARITY_EXPONENT)
+    player_ids = [_uuid(rng) for _ in range(players)]
+
+    db.session.execute(insert(Game.__table__),
+                       [{'id': game.id, 'name': game.name, 'scoring': game.kind} for game in game_list])
+    db.session.execute(insert(Player.__table__),
+                       [{'id': player_id, 'name': 'Player %d' % (number + 1)}
+                        for number, player_id in enumerate(player_ids)])
+
+    # split the players into groups of 4 to 12 that tend to play together
+    shuffled = player_ids[:]
+    rng.shuffle(shuffled)
+    groups = []
+    first = 0
+    while first < players:
+        size = rng.randint(4, 12)
+        groups.append(_Group(rng, shuffled[first:first + size], game_list, game_weights))
+        first += size
+    group_weights = _zipf_weights(len(groups), GROUP_ACTIVITY_EXPONENT)
+
+    session_count = 0
+    session_player_count = 0
+    session_rows = []
+    session_player_rows = []
+
+    def done():
+        if sessions is not None:
+            return session_count >= sessions
+        return session_player_count >= session_players
+
+    # the secondary indexes are much cheaper to build once at the end than to maintain row by row
+    indexes = list(Session.__table__.indexes) + list(SessionPlayers.__table__.indexes)
+    for index in indexes:
+        index.drop(db.session.connection(), checkfirst=True)
+    db.session.commit()
+
+    try:
+        while not done():
+            group = _pick(rng, groups, group_weights)
+            if rng.random() < OTHER_GAME_SHARE:
+                game = _pick(rng, game_list, game_weights)
+            else:
+                game = rng.choice(group.favourites)
+
+            count = rng.randint(game.min_players, game.max_players)
+            chosen = set()
+            for player_id in rng.sample(group.members, min(count, len(group.members))):
+                chosen.add(rng.choice(player_ids) if rng.random() < GUEST_SHARE else player_id)
+            while len(chosen) < min(count, players):
+                chosen.add(rng.choice(player_ids))
+
+            session_id = _uuid(rng)
+            session_rows.append({'id': session_id,
+                                 'date': start + timedelta(days=rng.randrange(days)),
+                                 'game': game.id})
+            rows = _play(rng, game, sorted(chosen), session_id)
+            session_player_rows.extend(rows)
+
+            session_count += 1
+            session_player_count += len(rows)
+
+            if len(session_rows) >= batch_size:
+                _write(session_rows, session_player_rows)
+                session_rows, session_player_rows = [], []
+                logger.info('Wrote %d sessions and %d session players', session_count, session_player_count)
+
+        _write(session_rows, session_player_rows)
+    finally:
+        # put the indexes back even if generating failed part of the way through
+        db.session.rollback()
+        for index in indexes:
+            index.create(db.session.connection(), checkfirst=True)
+        db.session.commit()
+
+    # the generated rows are not logged one by one, so clients have to download everything again
+    ChangeLogDB.truncate()
+    VersionDB.bump('game', 'player', 'session', 'session-players')
+    db.session.commit()
+    PlayerStatsDB.rebuild()
+
+    return {'games': games, 'players': players, 'sessions': session_count, 'session_players': session_player_count}
+
+
+def _insert(table, rows):
+    """Inserts the rows straight through the database driver, skipping the per row parameter processing
+    of SQLAlchemy, which costs more than the insert itself at these volumes
+    """
+    if not rows:
+        return
+
+    columns = list(rows[0])
+    connection = db.session.connection()
+    placeholder = {'qmark': '?', 'numeric': ':%d', 'named': ':%s'}.get(connection.dialect.paramstyle, '%s')
+    placeholders = [placeholder % (number + 1) if placeholder == ':%d' else
+                    placeholder % column if placeholder == ':%s' else placeholder
+                    for number, column in enumerate(columns)]
+
+    preparer = connection.dialect.identifier_preparer
+    statement = 'INSERT INTO %s (%s) VALUES (%s)' % (preparer.format_table(table),
+                                                     ', '.join(preparer.quote(column) for column in columns),
+                                                     ', '.join(placeholders))
+
+    # the driver still needs the values in their database form, e.g. the ids as bytes
+    processors = [table.c[column].type.bind_processor(connection.dialect) for column in columns]
+    values = [tuple(value if processor is None else processor(value)
+                    for processor, value in zip(processors, row.values())) for row in rows]
+
+    if placeholder == ':%s':
+        connection.exec_driver_sql(statement, [dict(zip(columns, row)) for row in values])
+    else:
+        connection.exec_driver_sql(statement, values)
+
+
+def _write(session_rows, session_player_rows):
+    # inserting in primary key order keeps the writes to each index page together
+    session_rows.sort(key=lambda row: row['id'])
+    session_player_rows.sort(key=lambda row: row['id'])
+    _insert(Session.__table__, session_rows)
+    _insert(SessionPlayers.__table__, session_player_rows)
+    db.session.commit()
+
+
+def main():
+    parser = ArgumentParser(description='Generates a synthetic play history for scale testing')
+    parser.add_argument('--database', help='SQLAlchemy URI of the database (defaults to BGT_DATABASE_URI)')
+    scale = parser.add_mutually_exclusive_group(required=True)
+    scale.add_argument('--sessions', type=int, help='The number of sessions to generate')
+    scale.add_argument('--session-players', type=int, help='Generate sessions until there are this many players')
+    parser.add_argument('--games', type=int, help='The number of games (derived from the scale by default)')
+    parser.add_argument('--players', type=int, help='The number of players (derived from the scale by default)')
+    parser.add_argument('--seed', type=int, default=1, help='The seed of the random number generator')
+    parser.add_argument('--start', type=date.fromisoformat, default=date(2010, 1, 1),
+                        help='The date of the earliest session, as YYYY-MM-DD')
+    parser.add_argument('--days', type=int, default=3650, help='The number of days the sessions are spread over')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    config = {'BGT_AUTO_UPGRADE': True}
+    if args.database:
+        config['SQLALCHEMY_DATABASE_URI'] = args.database
+
+    started = time.perf_counter()
+    with create_app(config).app_context():
+        counts = generate(args.sessions, args.session_players, args.games, args.players, args.seed,
+                          args.start, args.days)
+
+    logger.info('Generated %(games)d games, %(players)d players, %(sessions)d sessions and '
+                '%(session_players)d session players', counts)
+    logger.info('Done in %.1f s', time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+from application import create_app
+
+# The app for WSGI servers, e.g. "gunicorn --workers 4 wsgi:app"
+app = create_app()